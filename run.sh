@@ -9,6 +9,9 @@ FINAL_REASONING_PROMPT_PATH="prompt/final_reasoning.md"
 NOPLAN_REASONING_PROMPT_PATH="prompt/noplan_reasoning.md"
 RESULT_FILE_PATH="result/final_reasoning_result.jsonl"
 MAX_WORKERS=5
+EMBEDDING_CACHE_PATH="cache/embeddings.sqlite"
+REWRITE_CACHE_PATH="cache/schema_linking.sqlite"
+MAX_PROMPT_TOKENS=15000
 
 # Check if the dataset file exists
 if [ ! -f "$DATASET_PATH" ]; then
@@ -55,7 +58,10 @@ python3 scripts/final_reasoning.py \
   --final_reasoning_prompt_path "$FINAL_REASONING_PROMPT_PATH" \
   --noplan_reasoning_prompt_path "$NOPLAN_REASONING_PROMPT_PATH" \
   --result_file_path "$RESULT_FILE_PATH" \
-  --max_workers "$MAX_WORKERS"
+  --max_workers "$MAX_WORKERS" \
+  --embedding_cache_path "$EMBEDDING_CACHE_PATH" \
+  --rewrite_cache_path "$REWRITE_CACHE_PATH" \
+  --max_prompt_tokens "$MAX_PROMPT_TOKENS"
 
 # Print completion message
 echo "Processing complete. Results saved to $RESULT_FILE_PATH"
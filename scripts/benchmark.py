@@ -0,0 +1,185 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import resource
+import subprocess
+import multiprocessing
+from itertools import islice
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from final_reasoning import process_single_table, configure_run, load_prompts, group_by_table, build_parser, iter_sharded_results
+from utils.dataset import iter_jsonl, bounded_map
+from utils.request_gpt import get_rate_limit_metrics
+from utils.response_cache import get_response_cache_stats
+
+# Pipeline stages in the order they run; retrieval includes its schema linking and question embeddings
+STAGES = ["clean_index", "col_template", "plan", "schema_linking", "embeddings", "retrieval", "answer"]
+
+
+def latency_summary(values):
+    """
+    Summarize a list of durations.
+
+    Args:
+        values: The durations in seconds.
+
+    Returns:
+        A dict with the count, total, mean, p50, p95, p99 and max of the durations (all None but the count if empty).
+    """
+    if not values:
+        return {"count": 0, "total": None, "mean": None, "p50": None, "p95": None, "p99": None, "max": None}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {
+        "count": len(values), "total": float(np.sum(values)), "mean": float(np.mean(values)),
+        "p50": float(p50), "p95": float(p95), "p99": float(p99), "max": float(np.max(values))
+    }
+
+
+def run_file_path(result_file_path, max_workers, processes=1):
+    """Get the result file of the run with max_workers threads (per process), e.g. result.workers5.jsonl or result.processes4.workers5.jsonl for result.jsonl"""
+    root, extension = os.path.splitext(result_file_path)
+    if processes > 1:
+        root = f"{root}.processes{processes}"
+    return f"{root}.workers{max_workers}{extension or '.jsonl'}"
+
+
+def run_once(args, max_workers, processes=1):
+    """
+    Process the benchmark questions with a thread pool of max_workers threads and measure the run.
+
+    Runs in a fresh process, so that every run starts with empty in-memory caches and table indexes,
+    and the peak RSS is the one of this run only. With several processes, the questions are sharded
+    by table between processes of max_workers threads each (see iter_sharded_results).
+
+    Args:
+        args: The parsed command line arguments.
+        max_workers: The number of threads (per process).
+        processes: The number of processes, default is 1.
+
+    Returns:
+        A dict with the throughput, the per-stage latencies, the API usage per question and the peak RSS of the run.
+    """
+    row_prompt, col_prompt, plan_prompt, final_reasoning_prompt, noplan_reasoning_prompt = load_prompts(args)
+    configure_run(args)
+
+    questions = islice(iter_jsonl(args.dataset_path), args.num_questions)
+    pending = group_by_table(questions, args.group_window)
+
+    def process(index, d, fingerprint):
+        start = time.perf_counter()
+        record = process_single_table(index, d, row_prompt, col_prompt, plan_prompt, final_reasoning_prompt, noplan_reasoning_prompt, fingerprint)
+        return record, time.perf_counter() - start
+
+    question_latencies = []
+    stage_latencies = {stage: [] for stage in STAGES}
+    api_calls = []
+    tokens = []
+    correct_count = 0
+    error_count = 0
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor, open(run_file_path(args.result_file_path, max_workers, processes), 'w', encoding='utf-8') as f:
+        if processes > 1:
+            run_args = argparse.Namespace(**{**vars(args), "max_workers": max_workers, "processes": processes})
+            results = iter_sharded_results(run_args, pending, processes, args.shard_chunk_size)
+        else:
+            results = bounded_map(executor, process, pending, args.max_in_flight)
+
+        for record, latency in results:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+            question_latencies.append(latency)
+            profile = record["profile"]
+            for stage, elapsed in profile["stages"].items():
+                stage_latencies.setdefault(stage, []).append(elapsed)
+            api_calls.append(profile["api_calls"])
+            tokens.append(profile["tokens"])
+            correct_count += bool(record.get("is_correct"))
+            error_count += "error" in record
+    elapsed = time.perf_counter() - start
+
+    num_questions = len(question_latencies)
+    return {
+        "processes": processes,
+        "max_workers": max_workers,
+        "num_questions": num_questions,
+        "wall_time": elapsed,
+        "questions_per_second": num_questions / elapsed if elapsed > 0 else None,
+        "correct": correct_count,
+        "errors": error_count,
+        "question_latency": latency_summary(question_latencies),
+        # Each stage is summarized over the questions that ran it (the table index stages only run once per table)
+        "stages": {stage: latency_summary(values) for stage, values in stage_latencies.items()},
+        "api_calls_per_question": mean_counts(api_calls, num_questions),
+        "tokens_per_question": mean_counts(tokens, num_questions),
+        # ru_maxrss is in kilobytes on Linux; the shard processes have exited, the largest one is reported
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "peak_shard_rss_mb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024 if processes > 1 else None,
+        "rate_limiter": get_rate_limit_metrics(),
+        "response_cache": get_response_cache_stats(),
+    }
+
+
+def mean_counts(counts, num_questions):
+    """Average per-question counters (dicts of name to count) over all questions"""
+    totals = {}
+    for question_counts in counts:
+        for name, count in question_counts.items():
+            totals[name] = totals.get(name, 0) + count
+    return {name: total / num_questions for name, total in totals.items()} if num_questions else {}
+
+
+def get_revision():
+    """Get the git revision of the code being benchmarked, or None outside a git checkout"""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(args):
+    """Benchmark the pipeline at each number of processes and workers and write the JSON report"""
+    report = {
+        "revision": get_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "dataset_path": args.dataset_path,
+        "backend": args.backend,
+        "config": vars(args),
+        "runs": [],
+    }
+
+    # Each run gets its own process, so that no run reuses the table indexes or memoized stages of the previous one
+    context = multiprocessing.get_context("spawn")
+    for processes in args.num_processes:
+        for max_workers in args.workers:
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as process:
+                run = process.submit(run_once, args, max_workers, processes).result()
+            print(f"processes={processes} max_workers={max_workers}: {run['num_questions']} questions in {run['wall_time']:.2f}s "
+                  f"({run['questions_per_second'] or 0:.2f} questions/s), peak RSS {run['peak_rss_mb']:.0f} MB")
+            report["runs"].append(run)
+
+    report_path = args.report_path or os.path.splitext(args.result_file_path)[0] + ".benchmark.json"
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"Benchmark report saved to {report_path}")
+
+
+if __name__ == "__main__":
+    parser = build_parser()
+    parser.description = "Benchmark the pipeline: throughput, per-stage latency, API usage and memory at several numbers of workers"
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 5, 10], help="Numbers of threads to benchmark, one run each (the results of each run are written next to --result_file_path)")
+    parser.add_argument('--num_processes', type=int, nargs='+', default=[1], help="Numbers of processes to benchmark, the questions being sharded by table between processes of --workers threads each (one run per combination)")
+    parser.add_argument('--num_questions', type=int, default=None, help="Only benchmark the first questions of the dataset (all if not set)")
+    parser.add_argument('--report_path', type=str, default=None, help="Path of the JSON report (result file path + .benchmark.json if not set)")
+
+    args = parser.parse_args()
+    main(args)
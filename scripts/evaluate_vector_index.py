@@ -0,0 +1,60 @@
+import json
+import argparse
+import numpy as np
+from utils.vector_index import ExactIndex, IVFIndex, evaluate_index
+
+
+def make_synthetic_embeddings(num_rows, dim, num_clusters, seed=0):
+    """
+    Generates clustered random vectors resembling row embeddings of a large table.
+
+    Args:
+        num_rows: The number of vectors.
+        dim: The vector dimension.
+        num_clusters: The number of clusters the vectors are drawn around.
+        seed: The random seed.
+
+    Returns:
+        A (num_rows, dim) float32 matrix.
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(num_clusters, dim))
+    assignments = rng.integers(0, num_clusters, size=num_rows)
+    return (centers[assignments] + 0.5 * rng.normal(size=(num_rows, dim))).astype(np.float32)
+
+
+def main(args):
+    if args.embeddings_path:
+        embeddings = np.load(args.embeddings_path).astype(np.float32)
+    else:
+        embeddings = make_synthetic_embeddings(args.num_rows, args.dim, args.num_clusters)
+
+    # Queries are perturbed rows, like questions about existing rows
+    rng = np.random.default_rng(1)
+    queries = embeddings[rng.integers(0, len(embeddings), size=args.num_queries)]
+    queries = queries + 0.5 * rng.normal(size=queries.shape).astype(np.float32)
+
+    exact_index = ExactIndex(embeddings)
+    report = {"num_rows": len(embeddings), "dim": embeddings.shape[1], "results": []}
+    for nprobe in args.nprobe:
+        ivf_index = IVFIndex(embeddings, nlist=args.nlist, nprobe=nprobe)
+        result = evaluate_index(ivf_index, exact_index, queries, args.k)
+        result.update(nlist=ivf_index.nlist, nprobe=nprobe)
+        report["results"].append(result)
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the IVF row index with exact search (recall and query latency)")
+    parser.add_argument('--embeddings_path', type=str, default=None, help="Path to a .npy matrix of row embeddings (synthetic vectors if not set)")
+    parser.add_argument('--num_rows', type=int, default=50000, help="Number of synthetic rows")
+    parser.add_argument('--dim', type=int, default=256, help="Dimension of the synthetic vectors")
+    parser.add_argument('--num_clusters', type=int, default=200, help="Number of clusters of the synthetic vectors")
+    parser.add_argument('--num_queries', type=int, default=100, help="Number of queries")
+    parser.add_argument('--k', type=int, default=20, help="Number of rows retrieved per query")
+    parser.add_argument('--nlist', type=int, default=None, help="Number of IVF clusters (square root of the number of rows if not set)")
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 4, 8, 16], help="Numbers of IVF clusters searched per query")
+
+    args = parser.parse_args()
+    main(args)
@@ -2,156 +2,464 @@ import json
 import re
 import os
 import sys
+import copy
+import time
 import argparse
+import contextlib
+import multiprocessing
 from tqdm import tqdm
 from processing_format import get_row_description, get_col_description, get_row_flattened
 from generate_solution_plan import get_solution_plan
-from utils.request_gpt import request_gpt_chat, request_gpt_embedding
-from utils.processing import clean_table, index_table
+from utils.request_gpt import request_gpt_chat, request_gpt_embedding, configure_backend, configure_rate_limits, get_rate_limit_metrics
+from utils.processing import clean_table, index_table, configure_table_sampling
+from utils.embedding_cache import configure_embedding_cache, reset_embedding_cache_stats, get_embedding_cache_stats
+from utils.prompt_templates import load_prompt
+from utils.response_cache import configure_response_cache, get_response_cache_stats
+from utils.dataset import iter_jsonl, bounded_map
+from utils.record_store import RecordStore, compact_record
+from utils.checkpoint import Checkpoint
+from utils.memo_cache import configure_memo_cache, disable_memo_cache, get_memo_cache
+from utils.vector_index import configure_row_index
+from utils.inverted_index import configure_string_match
+from utils.rank_fusion import configure_hybrid_retrieval
+from utils.prompt_budget import configure_prompt_budget, reset_prompt_budget_stats, get_prompt_budget_stats
+from utils.table_serializer import configure_table_format, TABLE_FORMATS
+from utils.profiling import reset_profile, get_profile, profile_stage
+from utils.tracing import configure_tracing, trace_span, new_correlation_id, write_metrics, snapshot_metrics, merge_metrics, merge_trace_file
 from get_sub_table import retrieve_final_subtable, retrieve_final_subtable_add
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from generate_answer import generate_final_answer, generate_noplan_answer
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from generate_answer import generate_final_answer, generate_noplan_answer, get_final_table_budget
+from table_index import get_table_index, table_fingerprint, configure_column_pruning
 
 
-def process_single_table(index, d, row_prompt, col_prompt, plan_prompt, final_reasoning_prompt, noplan_reasoning_prompt):
+# Memoized pipeline stages, in pipeline order (embeddings and schema-linking rewrites have their own caches)
+STAGE_CACHES = ["col_template", "solution_plan", "final_answer"]
+
+
+def process_single_table(index, d, row_prompt, col_prompt, plan_prompt, final_reasoning_prompt, noplan_reasoning_prompt, fingerprint=None):
     """Process a single table and return the result data"""
-    item = json.loads(d)
+    item = json.loads(d) if isinstance(d, str) else d
     table = item["table_text"]
     question = item["statement"]
     answer = ", ".join(item["answer"])
+    reset_embedding_cache_stats()
+    reset_prompt_budget_stats()
+    reset_profile()
+    # Every span of this question carries its correlation id, which is also stored in its record
+    correlation_id = new_correlation_id()
 
-    cleaned_table = clean_table(table)
-    indexed_cleaned_table = index_table(cleaned_table)
+    if fingerprint is None:
+        fingerprint = table_fingerprint(table)
+    table_index = None
 
-    try:
-        # Generate natural language descriptions for rows and columns
-        row_descriptions = get_row_flattened(cleaned_table)
-        col_descriptions = get_col_description(cleaned_table, col_prompt)
-
-        # Generate solution plan
-        solution_plan = get_solution_plan(cleaned_table, question, plan_prompt)
-
-        # If the plan is invalid or only has one stage (Reasoning)
-        if solution_plan is None or len(solution_plan) == 1:
-            # Perform reasoning without a plan
-            final_answer = generate_noplan_answer(question, indexed_cleaned_table, noplan_reasoning_prompt)
-            is_correct = final_answer.lower() == answer.lower()
-            record_data = {
-                "index": index,
-                "question": question,
-                "gold_answer": answer,
-                "pred_answer": final_answer,
-                "is_correct": is_correct,
-                "type": "Single stage reasoning or invalid plan",
-                "solution_plan": solution_plan,
-                "table_text": indexed_cleaned_table,
-                "prompt": noplan_reasoning_prompt,
-            }
-        else:
-            # If multiple stages are valid, proceed with Retrieval
-            final_subtable, final_row_indices, final_col_indices = retrieve_final_subtable_add(
-                solution_plan, indexed_cleaned_table, row_descriptions, col_descriptions, request_gpt_embedding, question
-            )
-            final_answer = generate_final_answer(question, solution_plan, final_subtable, final_reasoning_prompt)
-            final_answer = final_answer.strip()
-
-            # Check if the answer is correct
-            is_correct = final_answer.lower() == answer.lower()
-            record_data = {
-                "index": index,
-                "question": question,
-                "gold_answer": answer,
-                "pred_answer": final_answer,
-                "is_correct": is_correct,
-                "type": "Multiple stages",
-                "solution_plan": solution_plan,
-                "final_sub_table": final_subtable,
-                "final_row_indices": [int(idx) for idx in final_row_indices],
-                "final_col_indices": [int(idx) for idx in final_col_indices],
-                "row_descriptions": row_descriptions,
-                "col_descriptions": col_descriptions,
-                "table_text": indexed_cleaned_table,
-                "prompt": final_reasoning_prompt,
-            }
-
-    except Exception as e:
-        print(f"Error encountered {index}: {e}. Skipping this iteration.")
-        final_answer = generate_noplan_answer(question, indexed_cleaned_table, noplan_reasoning_prompt)
-        is_correct = final_answer.lower() == answer.lower()
-        record_data = {
-            "index": index,
-            "question": question,
-            "gold_answer": answer,
-            "pred_answer": final_answer,
-            "type": "Error generation",
-            "is_correct": is_correct,
-            "error": str(e),
-            "table_text": indexed_cleaned_table,
-            "prompt": noplan_reasoning_prompt,
-        }
+    # The span of the whole question is the parent of its API calls and retrieval steps, and records its error
+    with trace_span("question", table_fingerprint=fingerprint) as question_span:
+        try:
+            # Get the shared row/column descriptions and embeddings of this table
+            table_index = get_table_index(table, col_prompt, fingerprint)
+
+            # Generate solution plan
+            with profile_stage("plan"):
+                solution_plan = get_solution_plan(table_index.cleaned_table, question, plan_prompt)
+
+            # If the plan is invalid or only has one stage (Reasoning)
+            if solution_plan is None or len(solution_plan) == 1:
+                # Perform reasoning without a plan
+                with profile_stage("answer"):
+                    final_answer = generate_noplan_answer(question, table_index.indexed_table, noplan_reasoning_prompt)
+                record_data = make_noplan_record(index, question, answer, final_answer, solution_plan, table_index, noplan_reasoning_prompt)
+            else:
+                # If multiple stages are valid, proceed with Retrieval
+                with profile_stage("retrieval"):
+                    final_subtable, final_row_indices, final_col_indices = retrieve_final_subtable_add(
+                        solution_plan, table_index.indexed_table, table_index.iter_row_descriptions(), table_index.col_descriptions, request_gpt_embedding, question,
+                        row_embeddings=table_index.row_embeddings, col_embeddings=table_index.col_embeddings, row_index=table_index.row_index,
+                        token_index=table_index.token_index, max_table_tokens=get_final_table_budget(question, solution_plan, final_reasoning_prompt),
+                        project_rows=table_index.project_rows if table_index.prunes_columns else None
+                    )
+                with profile_stage("answer"):
+                    final_answer = generate_final_answer(question, solution_plan, final_subtable, final_reasoning_prompt)
+                record_data = make_multistage_record(
+                    index, question, answer, final_answer, solution_plan, table_index,
+                    final_subtable, final_row_indices, final_col_indices, final_reasoning_prompt
+                )
+
+        except Exception as e:
+            print(f"Error encountered {index} ({correlation_id}): {e}. Skipping this iteration.")
+            question_span.update(status="error", error=str(e))
+            indexed_cleaned_table = get_fallback_table(table, table_index)
+            with profile_stage("answer"):
+                final_answer = generate_noplan_answer(question, indexed_cleaned_table, noplan_reasoning_prompt)
+            record_data = make_error_record(index, question, answer, final_answer, e, indexed_cleaned_table, noplan_reasoning_prompt)
+
+    record_data["ids"] = item.get("ids")
+    record_data["correlation_id"] = correlation_id
+    record_data["table_fingerprint"] = fingerprint
+    record_data["embedding_cache"] = get_embedding_cache_stats()
+    record_data["prompt_budget"] = get_prompt_budget_stats()
+    record_data["profile"] = get_profile()
 
     return record_data
 
 
-def main(args):
-    """Main function to process the dataset and generate results"""
-    with open(args.dataset_path, 'r') as f:
-        data = f.readlines()
+def make_noplan_record(index, question, answer, final_answer, solution_plan, table_index, noplan_reasoning_prompt):
+    """Build the result record of a question answered without a plan"""
+    return {
+        "index": index,
+        "question": question,
+        "gold_answer": answer,
+        "pred_answer": final_answer,
+        "is_correct": final_answer.lower() == answer.lower(),
+        "type": "Single stage reasoning or invalid plan",
+        "solution_plan": solution_plan,
+        "table_text": table_index.indexed_table.to_rows(),
+        "prompt": noplan_reasoning_prompt,
+    }
+
+
+def make_multistage_record(index, question, answer, final_answer, solution_plan, table_index, final_subtable, final_row_indices, final_col_indices, final_reasoning_prompt):
+    """Build the result record of a question answered from the retrieved subtable"""
+    final_answer = final_answer.strip()
+    return {
+        "index": index,
+        "question": question,
+        "gold_answer": answer,
+        "pred_answer": final_answer,
+        "is_correct": final_answer.lower() == answer.lower(),
+        "type": "Multiple stages",
+        "solution_plan": solution_plan,
+        "final_sub_table": final_subtable,
+        "final_row_indices": [int(idx) for idx in final_row_indices],
+        "final_col_indices": [int(idx) for idx in final_col_indices],
+        "row_descriptions": table_index.row_descriptions,
+        "col_descriptions": table_index.col_descriptions,
+        "table_text": table_index.indexed_table.to_rows(),
+        "prompt": final_reasoning_prompt,
+    }
+
+
+def make_error_record(index, question, answer, final_answer, error, indexed_cleaned_table, noplan_reasoning_prompt):
+    """Build the result record of a question whose pipeline failed and was answered without a plan"""
+    return {
+        "index": index,
+        "question": question,
+        "gold_answer": answer,
+        "pred_answer": final_answer,
+        "type": "Error generation",
+        "is_correct": final_answer.lower() == answer.lower(),
+        "error": str(error),
+        "table_text": indexed_cleaned_table.to_rows(),
+        "prompt": noplan_reasoning_prompt,
+    }
+
+
+def get_fallback_table(table, table_index):
+    """Get the indexed table for no-plan reasoning, even if the table index could not be built"""
+    if table_index is not None:
+        return table_index.indexed_table
+    return index_table(clean_table(table))
+
+
+def configure_run(args):
+    """Select the backend and enable the caches and client-side rate limits requested on the command line"""
+    configure_backend(args.backend, chat_latency=args.mock_chat_latency, embedding_latency=args.mock_embedding_latency, embedding_dim=args.mock_embedding_dim)
+
+    # Reuse embeddings computed by earlier questions and runs
+    if args.embedding_cache_path:
+        configure_embedding_cache(args.embedding_cache_path, max_entries=args.embedding_cache_max_entries)
+
+    # Replay identical chat requests from earlier runs (opt-in)
+    configure_response_cache(
+        args.response_cache_path, ttl=args.response_cache_ttl, max_entries=args.response_cache_max_entries, replay_only=args.replay_only
+    )
+
+    configure_rate_limits(args.chat_rpm, args.chat_tpm, args.embedding_rpm, args.embedding_tpm)
+
+    # Reuse schema-linking rewrites of identical (question, header) pairs across questions and runs
+    configure_memo_cache("schema_linking", args.rewrite_cache_path, max_entries=args.rewrite_cache_max_entries)
+
+    # Show the same seeded sample of each table to the template and plan prompts, so that prompts are identical across runs
+    configure_table_sampling(args.sample_seed, args.sample_strategy)
+
+    # Persist the outputs of the LLM stages keyed on their inputs, so that an ablation only reruns the stages whose inputs changed
+    # (opt-in: without a cache directory every question samples its own templates, plans and answers)
+    for stage in STAGE_CACHES:
+        if args.stage_cache_dir:
+            configure_memo_cache(stage, os.path.join(args.stage_cache_dir, f"{stage}.sqlite"))
+        else:
+            disable_memo_cache(stage)
+
+    configure_row_index(args.row_index, min_rows=args.ann_min_rows, nlist=args.ivf_nlist, nprobe=args.ivf_nprobe)
+    configure_string_match(rank_by_bm25=args.rank_string_matches)
+    configure_column_pruning(args.column_pruning, min_cols=args.pruning_min_cols)
+    configure_hybrid_retrieval(
+        enabled=args.hybrid_retrieval, row_budget=args.row_budget, rrf_k=args.rrf_k,
+        lexical_weight=args.lexical_weight, dense_weight=args.dense_weight, neighbours=args.neighbour_rows
+    )
+
+    # Pack the tables of the reasoning prompts into a token budget so that no request is rejected for length
+    configure_prompt_budget(args.max_prompt_tokens, args.max_cell_tokens)
+    configure_table_format(args.table_format)
+
+    # Export spans of the API calls and retrieval steps, and metrics in the Prometheus text format (opt-in)
+    configure_tracing(args.trace_path, args.metrics_path)
+
+
+def open_record_store(args):
+    """Open the side store of compact result records, or return None if full records are written"""
+    if not args.compact_results:
+        return None
+    return RecordStore(args.record_store_path or args.result_file_path + ".store.sqlite")
+
+
+def load_prompts(args):
+    """Load the row, column, plan, final reasoning and no-plan reasoning prompts"""
+    return [
+        load_prompt(path) for path in [args.row_prompt_path, args.col_prompt_path, args.plan_prompt_path,
+                                       args.final_reasoning_prompt_path, args.noplan_reasoning_prompt_path]
+    ]
+
+
+def open_checkpoint(args):
+    """Open the checkpoint of the result file, recovering from an interrupted run"""
+    checkpoint = Checkpoint(args.result_file_path, args.checkpoint_path)
+    print(f"{len(checkpoint)} questions already completed in {args.result_file_path}.")
+    return checkpoint
+
+
+def group_by_table(pending, window_size=None, checkpoint=None):
+    """Fingerprint the pending questions, skipping those completed in the checkpoint, and order them so that questions on the same table are adjacent, within windows of window_size questions (the whole dataset if None)"""
+    window = []
+    for index, d in pending:
+        item = json.loads(d)
+        if checkpoint is not None and checkpoint.is_completed(item, index):
+            continue
+
+        # Only the fingerprint is kept, the line is parsed again when it is processed
+        window.append((index, d, table_fingerprint(item["table_text"])))
+        if window_size is not None and len(window) >= window_size:
+            yield from order_by_first_table(window)
+            window = []
+
+    yield from order_by_first_table(window)
+
+
+def order_by_first_table(window):
+    """Order (index, line, fingerprint) entries by the first appearance of their table, keeping the order of each table's questions"""
+    first_seen = {}
+    for position, (_, _, fingerprint) in enumerate(window):
+        first_seen.setdefault(fingerprint, position)
+    return sorted(window, key=lambda entry: first_seen[entry[2]])
+
+
+# State of a shard process, set by init_shard
+_shard = {}
+
+
+def shard_of(fingerprint, num_shards):
+    """Assign a table to a shard from its fingerprint, so that all the questions on a table are processed by the same process"""
+    return int(fingerprint[:16], 16) % num_shards
 
-    # Load prompts from the specified paths
-    with open(args.row_prompt_path, "r") as f:
-        row_prompt = f.read()
 
-    with open(args.col_prompt_path, "r") as f:
-        col_prompt = f.read()
+def shard_trace_path(trace_path, shard):
+    """Get the trace file of a shard process, merged into trace_path at the end of the run"""
+    return f"{trace_path}.shard{shard}"
 
-    with open(args.plan_prompt_path, "r") as f:
-        plan_prompt = f.read()
 
-    with open(args.final_reasoning_prompt_path, "r") as f:
-        final_reasoning_prompt = f.read()
+def init_shard(args, shard):
+    """Configure a shard process like a single-process run, with its own thread pool, table indexes and in-memory caches"""
+    # The client-side rate limits are budgets of the whole run, split evenly between the shards
+    args = copy.copy(args)
+    for name in ["chat_rpm", "chat_tpm", "embedding_rpm", "embedding_tpm"]:
+        if getattr(args, name) is not None:
+            setattr(args, name, getattr(args, name) / args.processes)
 
-    with open(args.noplan_reasoning_prompt_path, "r") as f:
-        noplan_reasoning_prompt = f.read()
+    # Every shard appends its spans to its own file, so that lines of different processes never interleave
+    if args.trace_path:
+        args.trace_path = shard_trace_path(args.trace_path, shard)
 
-    # Read the existing result file and extract already processed indices
-    existing_indices = set()
+    _shard["prompts"] = load_prompts(args)
+    configure_run(args)
+    _shard["executor"] = ThreadPoolExecutor(max_workers=args.max_workers)
 
-    if os.path.exists(args.result_file_path):
-        with open(args.result_file_path, 'r', encoding='utf-8') as result_file:
-            for line in result_file:
-                result_data = json.loads(line)
-                existing_indices.add(result_data["index"])
-    else:
-        print(f"{args.result_file_path} file does not exist, skipping check for existing results.")
+
+def process_chunk(items):
+    """Process (index, line, fingerprint) entries in a shard process, returning the (record, latency in seconds) of each one in order"""
+    prompts = _shard["prompts"]
+
+    def process(item):
+        index, d, fingerprint = item
+        start = time.perf_counter()
+        record = process_single_table(index, d, *prompts, fingerprint)
+        return record, time.perf_counter() - start
+
+    return list(_shard["executor"].map(process, items))
+
+
+def get_shard_stats():
+    """Get the run statistics and metrics of a shard process"""
+    return {**get_run_stats(), "metrics": snapshot_metrics()}
+
+
+def iter_sharded_results(args, pending, num_processes, chunk_size=None, shard_stats=None):
+    """
+    Process (index, line, fingerprint) entries in num_processes processes, each owning the tables of one shard of fingerprints.
+
+    Each process runs args.max_workers threads on chunks of its questions. Results are yielded in the order of
+    pending whatever process computed them, with at most args.max_in_flight questions per process not yet yielded.
+
+    Args:
+        args: The parsed command line arguments, used to configure each process.
+        pending: The (index, line, fingerprint) entries, e.g. from group_by_table.
+        num_processes: The number of processes.
+        chunk_size: The number of questions sent to a process at once (4 times args.max_workers if None).
+        shard_stats: A list to which the statistics of each process are appended at the end of the run, if given.
+
+    Returns:
+        A generator of (record, latency in seconds) pairs.
+    """
+    chunk_size = chunk_size or 4 * args.max_workers
+    max_pending = args.max_in_flight * num_processes
+
+    # Spawned processes do not inherit the clients, locks and caches of this one
+    context = multiprocessing.get_context("spawn")
+    executors = [
+        ProcessPoolExecutor(max_workers=1, mp_context=context, initializer=init_shard, initargs=(args, shard))
+        for shard in range(num_processes)
+    ]
+
+    buffers = [[] for _ in range(num_processes)]
+    futures = {}  # future -> sequence numbers of its questions
+    results = {}  # sequence number -> (record, latency), until it is yielded
+    next_sequence = 0
+
+    def submit(shard):
+        chunk, buffers[shard] = buffers[shard], []
+        future = executors[shard].submit(process_chunk, [item for _, item in chunk])
+        futures[future] = [sequence for sequence, _ in chunk]
+
+    def collect(timeout=None):
+        done, _ = wait(futures, timeout=timeout, return_when=FIRST_COMPLETED)
+        for future in done:
+            results.update(zip(futures.pop(future), future.result()))
+
+    try:
+        num_items = 0
+        for sequence, item in enumerate(pending):
+            num_items = sequence + 1
+            shard = shard_of(item[2], num_processes)
+            buffers[shard].append((sequence, item))
+            if len(buffers[shard]) >= chunk_size:
+                submit(shard)
+
+            # Back-pressure: send the partial chunks too and wait for results before reading more questions
+            collect(timeout=0)
+            while num_items - next_sequence >= max_pending:
+                for buffered_shard in range(num_processes):
+                    if buffers[buffered_shard]:
+                        submit(buffered_shard)
+                collect()
+                while next_sequence in results:
+                    yield results.pop(next_sequence)
+                    next_sequence += 1
+
+            while next_sequence in results:
+                yield results.pop(next_sequence)
+                next_sequence += 1
+
+        for shard in range(num_processes):
+            if buffers[shard]:
+                submit(shard)
+        while next_sequence < num_items:
+            collect()
+            while next_sequence in results:
+                yield results.pop(next_sequence)
+                next_sequence += 1
+
+        if shard_stats is not None:
+            shard_stats.extend(executor.submit(get_shard_stats).result() for executor in executors)
+    finally:
+        for executor in executors:
+            executor.shutdown(cancel_futures=True)
+
+
+def main(args):
+    """Main function to process the dataset and generate results"""
+    # Load prompts from the specified paths
+    row_prompt, col_prompt, plan_prompt, final_reasoning_prompt, noplan_reasoning_prompt = load_prompts(args)
+
+    configure_run(args)
+
+    # Resume from the questions completed by earlier runs
+    checkpoint = open_checkpoint(args)
 
     true_count = 0
     pass_count = 0
 
-    # Thread pool to process each table concurrently
-    with ThreadPoolExecutor(max_workers=args.max_workers) as executor:
-        futures = [
-            executor.submit(process_single_table, index, d, row_prompt, col_prompt, plan_prompt, final_reasoning_prompt, noplan_reasoning_prompt)
-            for index, d in enumerate(data) if index not in existing_indices
-        ]
-
-        with open(args.result_file_path, 'a', encoding='utf-8') as f:
-            for future in tqdm(as_completed(futures), total=len(futures), desc="Processing data"):
-                result = future.result()
-                
-                f.write(json.dumps(result, ensure_ascii=False) + "\n")
-                f.flush()
-
-                if "is_correct" in result and result["is_correct"]:
-                    true_count += 1
-                if "error" in result:
-                    pass_count += 1
+    # Tables, descriptions and prompts of compact records are stored once in a side store
+    record_store = open_record_store(args)
+
+    # Stream the pending questions, grouped by table so that each table index is built once and reused
+    pending = group_by_table(iter_jsonl(args.dataset_path), args.group_window, checkpoint)
+
+    def process(index, d, fingerprint):
+        return process_single_table(index, d, row_prompt, col_prompt, plan_prompt, final_reasoning_prompt, noplan_reasoning_prompt, fingerprint)
+
+    shard_stats = []
+    with contextlib.ExitStack() as stack:
+        f = stack.enter_context(open(args.result_file_path, 'a', encoding='utf-8'))
+        if args.processes > 1:
+            # One thread pool per process, each owning the tables of a shard, with the results written in --group_window order
+            results = (record for record, _ in iter_sharded_results(args, pending, args.processes, args.shard_chunk_size, shard_stats))
+        else:
+            # Thread pool to process each table concurrently, with a bounded number of questions in memory
+            executor = stack.enter_context(ThreadPoolExecutor(max_workers=args.max_workers))
+            results = bounded_map(executor, process, pending, args.max_in_flight)
+
+        for result in tqdm(results, desc="Processing data"):
+            if record_store is not None:
+                result = compact_record(result, record_store)
+
+            checkpoint.write(f, result)
+
+            if "is_correct" in result and result["is_correct"]:
+                true_count += 1
+            if "error" in result:
+                pass_count += 1
 
     print("True count:", true_count)
     print("Pass count:", pass_count)
+    print_run_stats(shard_stats or [get_run_stats()])
 
+    # The metrics and spans of the shard processes are merged into one file each
+    for stats in shard_stats:
+        merge_metrics(stats["metrics"])
+    if args.processes > 1 and args.trace_path:
+        for shard in range(args.processes):
+            merge_trace_file(shard_trace_path(args.trace_path, shard))
+    write_metrics()
 
-if __name__ == "__main__":
+
+def get_run_stats():
+    """Get the rate limiter and cache statistics of this process"""
+    return {
+        "rate_limiter": get_rate_limit_metrics(),
+        "schema_linking_cache": get_memo_cache("schema_linking").stats(),
+        "stage_caches": {stage: get_memo_cache(stage).stats() for stage in STAGE_CACHES},
+        "response_cache": get_response_cache_stats(),
+    }
+
+
+def print_run_stats(run_stats):
+    """Print the statistics of each process of the run (one list entry per shard if there are several)"""
+    for name, label in [("rate_limiter", "Rate limiter"), ("schema_linking_cache", "Schema linking cache"),
+                        ("stage_caches", "Stage caches"), ("response_cache", "Response cache")]:
+        values = [stats[name] for stats in run_stats]
+        print(f"{label}:", values[0] if len(values) == 1 else values)
+
+
+def build_parser():
+    """Build the command line parser shared by the thread pool and asyncio runners"""
     parser = argparse.ArgumentParser(description="Process and generate answers for the tableQA")
     
     # Arguments for paths to dataset and prompt files
@@ -163,7 +471,54 @@ if __name__ == "__main__":
     parser.add_argument('--noplan_reasoning_prompt_path', type=str, required=True, help="Path to the no-plan reasoning prompt file")
     parser.add_argument('--result_file_path', type=str, required=True, help="Path to save the result output")
     parser.add_argument('--max_workers', type=int, default=5, help="Number of threads concurrently")
-    
-    
+    parser.add_argument('--processes', type=int, default=1, help="Number of processes, each owning the tables of one shard of table fingerprints and running --max_workers threads (the results are written grouped by table within --group_window, not in dataset order)")
+    parser.add_argument('--shard_chunk_size', type=int, default=None, help="Number of questions sent to a process at once with --processes (4 times --max_workers if not set)")
+    parser.add_argument('--backend', type=str, default="openai", choices=["openai", "mock"], help="Backend of the chat and embedding requests (mock is a local deterministic stand-in for offline benchmarks)")
+    parser.add_argument('--mock_chat_latency', type=float, default=0.0, help="Seconds spent on each chat request by the mock backend")
+    parser.add_argument('--mock_embedding_latency', type=float, default=0.0, help="Seconds spent on each embedding request by the mock backend")
+    parser.add_argument('--mock_embedding_dim', type=int, default=1536, help="Dimension of the embeddings of the mock backend")
+    parser.add_argument('--max_in_flight', type=int, default=32, help="Maximum number of questions read and in progress at the same time")
+    parser.add_argument('--group_window', type=int, default=1024, help="Number of consecutive questions reordered together so that questions on the same table are adjacent")
+    parser.add_argument('--checkpoint_path', type=str, default=None, help="Path to the SQLite checkpoint of completed questions (result file path + .ckpt.sqlite if not set)")
+    parser.add_argument('--compact_results', action='store_true', help="Write compact result records, storing tables, descriptions and prompts once in a side store")
+    parser.add_argument('--record_store_path', type=str, default=None, help="Path to the SQLite side store of compact records (result file path + .store.sqlite if not set)")
+    parser.add_argument('--embedding_cache_path', type=str, default=None, help="Path to the SQLite embedding cache (disabled if not set)")
+    parser.add_argument('--embedding_cache_max_entries', type=int, default=1000000, help="Maximum number of cached embeddings before LRU eviction")
+    parser.add_argument('--rewrite_cache_path', type=str, default=None, help="Path to the SQLite schema-linking rewrite cache (in memory only if not set)")
+    parser.add_argument('--rewrite_cache_max_entries', type=int, default=1000000, help="Maximum number of persisted rewrites before LRU eviction")
+    parser.add_argument('--sample_seed', type=int, default=0, help="Seed of the table rows sampled for the template and plan prompts")
+    parser.add_argument('--sample_strategy', type=str, default="random", choices=["random", "stratified", "diverse"], help="How table rows are sampled for the template and plan prompts")
+    parser.add_argument('--response_cache_path', type=str, default=None, help="Path to the SQLite cache of chat responses keyed on model, temperature and prompt (disabled if not set)")
+    parser.add_argument('--response_cache_ttl', type=float, default=None, help="Age in seconds after which cached chat responses are ignored (never if not set)")
+    parser.add_argument('--response_cache_max_entries', type=int, default=1000000, help="Maximum number of cached chat responses before LRU eviction")
+    parser.add_argument('--replay_only', action='store_true', help="Serve chat requests only from --response_cache_path, never calling the API")
+    parser.add_argument('--stage_cache_dir', type=str, default=None, help="Directory of the SQLite caches of column templates, solution plans and answers (not memoized if not set)")
+    parser.add_argument('--row_index', type=str, default="exact", choices=["exact", "ivf", "auto"], help="Vector index over row embeddings (auto uses IVF for large tables)")
+    parser.add_argument('--ann_min_rows', type=int, default=20000, help="Number of rows from which --row_index auto uses IVF")
+    parser.add_argument('--ivf_nlist', type=int, default=None, help="Number of IVF clusters (square root of the number of rows if not set)")
+    parser.add_argument('--ivf_nprobe', type=int, default=8, help="Number of IVF clusters searched per question")
+    parser.add_argument('--column_pruning', action='store_true', help="Embed the rows of wide tables over the columns relevant to each question only, selected from the column embeddings")
+    parser.add_argument('--pruning_min_cols', type=int, default=8, help="Number of columns from which --column_pruning applies to a table")
+    parser.add_argument('--rank_string_matches', action='store_true', help="Rank string-matched rows by BM25 score instead of returning them unordered")
+    parser.add_argument('--hybrid_retrieval', action='store_true', help="Build the final sub-table from one fused BM25 and embedding ranking under --row_budget")
+    parser.add_argument('--row_budget', type=int, default=30, help="Maximum number of table rows in the final sub-table with --hybrid_retrieval")
+    parser.add_argument('--rrf_k', type=int, default=60, help="Reciprocal rank fusion constant of --hybrid_retrieval")
+    parser.add_argument('--lexical_weight', type=float, default=1.0, help="Weight of the BM25 ranking of the question in --hybrid_retrieval")
+    parser.add_argument('--dense_weight', type=float, default=1.0, help="Weight of the embedding ranking of each plan stage in --hybrid_retrieval")
+    parser.add_argument('--neighbour_rows', type=int, default=1, help="Number of previous and next rows added around each fused row in --hybrid_retrieval")
+    parser.add_argument('--max_prompt_tokens', type=int, default=None, help="Maximum number of tokens of a reasoning prompt, the table rows that do not fit are dropped (unlimited if not set)")
+    parser.add_argument('--max_cell_tokens', type=int, default=None, help="Maximum number of tokens of a table cell in a reasoning prompt, longer cells are truncated (unlimited if not set)")
+    parser.add_argument('--table_format', type=str, default="markdown", choices=TABLE_FORMATS, help="Format of the tables in the reasoning prompts (csv and tsv use fewer tokens than markdown)")
+    parser.add_argument('--trace_path', type=str, default=None, help="Path to the JSONL file of the spans of every API call and retrieval step (disabled if not set)")
+    parser.add_argument('--metrics_path', type=str, default=None, help="Path to the metrics file in the Prometheus text format, written at the end of the run (disabled if not set)")
+    parser.add_argument('--chat_rpm', type=int, default=None, help="Chat requests per minute shared by all workers (unlimited if not set)")
+    parser.add_argument('--chat_tpm', type=int, default=None, help="Chat tokens per minute shared by all workers (unlimited if not set)")
+    parser.add_argument('--embedding_rpm', type=int, default=None, help="Embedding requests per minute shared by all workers (unlimited if not set)")
+    parser.add_argument('--embedding_tpm', type=int, default=None, help="Embedding tokens per minute shared by all workers (unlimited if not set)")
+    return parser
+
+
+if __name__ == "__main__":
+    parser = build_parser()
     args = parser.parse_args()
     main(args)
@@ -0,0 +1,154 @@
+import json
+import asyncio
+from tqdm import tqdm
+from generate_solution_plan import get_solution_plan_async
+from generate_answer import generate_final_answer_async, generate_noplan_answer_async, get_final_table_budget
+from get_sub_table import retrieve_final_subtable_add_async
+from table_index import get_table_index_async, table_fingerprint
+from final_reasoning import (
+    make_noplan_record, make_multistage_record, make_error_record, get_fallback_table,
+    configure_run, open_record_store, load_prompts, open_checkpoint, group_by_table, build_parser, get_run_stats, print_run_stats
+)
+from utils.request_gpt import configure_async_limits
+from utils.processing import clean_table
+from utils.dataset import iter_jsonl
+from utils.record_store import compact_record
+from utils.embedding_cache import reset_embedding_cache_stats, get_embedding_cache_stats
+from utils.prompt_budget import reset_prompt_budget_stats, get_prompt_budget_stats
+from utils.profiling import reset_profile, get_profile, profile_stage
+from utils.tracing import trace_span, new_correlation_id, write_metrics
+
+
+async def process_single_table_async(index, d, col_prompt, plan_prompt, final_reasoning_prompt, noplan_reasoning_prompt, fingerprint=None):
+    """Asynchronous version of process_single_table, issuing independent LLM and embedding calls concurrently"""
+    item = json.loads(d) if isinstance(d, str) else d
+    table = item["table_text"]
+    question = item["statement"]
+    answer = ", ".join(item["answer"])
+    reset_embedding_cache_stats()
+    reset_prompt_budget_stats()
+    reset_profile()
+    # Every span of this question carries its correlation id, which is also stored in its record
+    correlation_id = new_correlation_id()
+
+    if fingerprint is None:
+        fingerprint = table_fingerprint(table)
+    table_index = None
+
+    # The span of the whole question is the parent of its API calls and retrieval steps, and records its error
+    with trace_span("question", table_fingerprint=fingerprint) as question_span:
+        try:
+            # Build (or reuse) the table index while the solution plan is being generated
+            table_index_task = asyncio.ensure_future(get_table_index_async(table, col_prompt, fingerprint))
+            try:
+                with profile_stage("plan"):
+                    solution_plan = await get_solution_plan_async(clean_table(table), question, plan_prompt)
+            finally:
+                table_index = await table_index_task
+
+            # If the plan is invalid or only has one stage (Reasoning)
+            if solution_plan is None or len(solution_plan) == 1:
+                with profile_stage("answer"):
+                    final_answer = await generate_noplan_answer_async(question, table_index.indexed_table, noplan_reasoning_prompt)
+                record_data = make_noplan_record(index, question, answer, final_answer, solution_plan, table_index, noplan_reasoning_prompt)
+            else:
+                # Rewrite and embed the sub-level questions of all stages concurrently
+                with profile_stage("retrieval"):
+                    final_subtable, final_row_indices, final_col_indices = await retrieve_final_subtable_add_async(
+                        solution_plan, table_index.indexed_table, table_index.iter_row_descriptions(), table_index.col_descriptions, question,
+                        row_embeddings=table_index.row_embeddings, col_embeddings=table_index.col_embeddings, row_index=table_index.row_index,
+                        token_index=table_index.token_index, max_table_tokens=get_final_table_budget(question, solution_plan, final_reasoning_prompt),
+                        project_rows_async=table_index.project_rows_async if table_index.prunes_columns else None
+                    )
+                with profile_stage("answer"):
+                    final_answer = await generate_final_answer_async(question, solution_plan, final_subtable, final_reasoning_prompt)
+                record_data = make_multistage_record(
+                    index, question, answer, final_answer, solution_plan, table_index,
+                    final_subtable, final_row_indices, final_col_indices, final_reasoning_prompt
+                )
+
+        except Exception as e:
+            print(f"Error encountered {index} ({correlation_id}): {e}. Skipping this iteration.")
+            question_span.update(status="error", error=str(e))
+            indexed_cleaned_table = get_fallback_table(table, table_index)
+            with profile_stage("answer"):
+                final_answer = await generate_noplan_answer_async(question, indexed_cleaned_table, noplan_reasoning_prompt)
+            record_data = make_error_record(index, question, answer, final_answer, e, indexed_cleaned_table, noplan_reasoning_prompt)
+
+    record_data["ids"] = item.get("ids")
+    record_data["correlation_id"] = correlation_id
+    record_data["table_fingerprint"] = fingerprint
+    record_data["embedding_cache"] = get_embedding_cache_stats()
+    record_data["prompt_budget"] = get_prompt_budget_stats()
+    record_data["profile"] = get_profile()
+
+    return record_data
+
+
+async def run(args):
+    """Process the dataset with at most max_in_flight questions in progress at any time"""
+    row_prompt, col_prompt, plan_prompt, final_reasoning_prompt, noplan_reasoning_prompt = load_prompts(args)
+
+    configure_run(args)
+    configure_async_limits(args.max_chat_concurrency, args.max_embedding_concurrency)
+
+    checkpoint = open_checkpoint(args)
+    record_store = open_record_store(args)
+    # Stream the pending questions, grouped by table within windows of group_window questions
+    pending = group_by_table(iter_jsonl(args.dataset_path), args.group_window, checkpoint)
+
+    true_count = 0
+    pass_count = 0
+
+    with open(args.result_file_path, 'a', encoding='utf-8') as f, tqdm(desc="Processing data") as progress:
+
+        def write_results(done):
+            nonlocal true_count, pass_count
+            for task in done:
+                result = task.result()
+                if record_store is not None:
+                    result = compact_record(result, record_store)
+
+                checkpoint.write(f, result)
+                progress.update(1)
+
+                if "is_correct" in result and result["is_correct"]:
+                    true_count += 1
+                if "error" in result:
+                    pass_count += 1
+
+        in_flight = set()
+        for index, d, fingerprint in pending:
+            # Back-pressure: wait for a question to finish before starting a new one
+            if len(in_flight) >= args.max_in_flight:
+                done, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                write_results(done)
+
+            in_flight.add(asyncio.ensure_future(process_single_table_async(
+                index, d, col_prompt, plan_prompt, final_reasoning_prompt, noplan_reasoning_prompt, fingerprint
+            )))
+
+        while in_flight:
+            done, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+            write_results(done)
+
+    print("True count:", true_count)
+    print("Pass count:", pass_count)
+    print_run_stats([get_run_stats()])
+    write_metrics()
+
+
+def main(args):
+    """Main function to process the dataset and generate results with the asyncio pipeline"""
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    parser = build_parser()
+    parser.add_argument('--max_chat_concurrency', type=int, default=16, help="Maximum number of concurrent chat completion requests")
+    parser.add_argument('--max_embedding_concurrency', type=int, default=8, help="Maximum number of concurrent embedding requests")
+
+    args = parser.parse_args()
+    if args.processes > 1:
+        parser.error("--processes is only supported by final_reasoning.py")
+    main(args)
@@ -1,4 +1,7 @@
-from utils.request_gpt import request_gpt_chat
+from utils.request_gpt import request_gpt_chat, request_gpt_chat_async
+from utils.memo_cache import get_memo_cache, memo_key
+from utils.prompt_budget import is_prompt_budget_enabled, get_table_token_budget, pack_table
+from utils.table_serializer import serialize_table, serialize_full_table
 
 def generate_final_answer(question, plan, final_subtable_with_header, prompt):
     """
@@ -13,24 +16,71 @@ def generate_final_answer(question, plan, final_subtable_with_header, prompt):
     Returns:
         The final answer generated by GPT after processing the prompt.
     """
-    col_headers = final_subtable_with_header[0]
-    subtable = final_subtable_with_header[1:]
+    prompt = build_final_prompt(question, plan, final_subtable_with_header, prompt)
 
-    subtable_md = "| " + " | ".join(col_headers) + " |\n"
-    subtable_md += "| " + " | ".join(["---"] * len(col_headers)) + " |\n"
-    for row in subtable:
-        subtable_md += "| " + " | ".join(map(str, row)) + " |\n"
+    final_answer = request_answer(prompt)
+
+    return final_answer
+
+
+async def generate_final_answer_async(question, plan, final_subtable_with_header, prompt):
+    """
+    Asynchronous version of generate_final_answer.
+
+    Args:
+        question: The input question to be answered.
+        plan: The solution plan, which contains multiple stages with sub-level questions.
+        final_subtable_with_header: A table with column headers and data, used to provide context for answering the question.
+        prompt: The template prompt to be filled with the question, table, and plan.
+
+    Returns:
+        The final answer generated by GPT after processing the prompt.
+    """
+    prompt = build_final_prompt(question, plan, final_subtable_with_header, prompt)
+
+    final_answer = await request_answer_async(prompt)
+
+    return final_answer
+
+
+def build_final_prompt(question, plan, final_subtable_with_header, prompt):
+    """
+    Fills the final reasoning prompt with the question, the solution plan and the subtable.
+
+    The subtable is expected to be packed into the prompt budget already (see get_final_table_budget).
+
+    Args:
+        question: The input question to be answered.
+        plan: The solution plan, which contains multiple stages with sub-level questions.
+        final_subtable_with_header: A table with column headers and data.
+        prompt: The template prompt to be filled with the question, table, and plan.
+
+    Returns:
+        The filled prompt.
+    """
+    subtable_text = serialize_table(final_subtable_with_header)
 
     plan_text = ""
     for stage in plan:
         plan_text += f"Stage {stage['Stage']}:\n"
         plan_text += f"  Sub-Level-Question: {stage['Sub-Level-Question']}\n"
 
-    prompt = prompt.format(question=question, table=subtable_md, plan=plan_text)
+    return prompt.format(question=question, table=subtable_text, plan=plan_text)
 
-    final_answer = request_gpt_chat(prompt=prompt)
 
-    return final_answer
+def get_final_table_budget(question, plan, prompt):
+    """
+    Computes how many tokens the subtable may use in the final reasoning prompt.
+
+    Args:
+        question: The input question to be answered.
+        plan: The solution plan, which contains multiple stages with sub-level questions.
+        prompt: The template prompt to be filled with the question, table, and plan.
+
+    Returns:
+        The token budget of the subtable, or None if prompts are not limited.
+    """
+    return get_table_token_budget(build_final_prompt(question, plan, [[]], prompt))
 
 
 def generate_noplan_answer(question, table_with_header, prompt):
@@ -45,16 +95,100 @@ def generate_noplan_answer(question, table_with_header, prompt):
     Returns:
         The final answer generated by GPT after processing the prompt.
     """
-    col_headers = table_with_header[0]
-    table = table_with_header[1:]
+    prompt = build_noplan_prompt(question, table_with_header, prompt)
+
+    final_answer = request_answer(prompt)
+
+    return final_answer
+
+
+async def generate_noplan_answer_async(question, table_with_header, prompt):
+    """
+    Asynchronous version of generate_noplan_answer.
 
-    table_md = "| " + " | ".join(col_headers) + " |\n"
-    table_md += "| " + " | ".join(["---"] * len(col_headers)) + " |\n"
-    for row in table:
-        table_md += "| " + " | ".join(map(str, row)) + " |\n"
+    Args:
+        question: The input question to be answered.
+        table_with_header: A table with column headers and data, used to provide context for answering the question.
+        prompt: The template prompt to be filled with the question and table.
 
-    prompt = prompt.format(question=question, table=table_md)
+    Returns:
+        The final answer generated by GPT after processing the prompt.
+    """
+    prompt = build_noplan_prompt(question, table_with_header, prompt)
 
-    final_answer = request_gpt_chat(prompt=prompt)
+    final_answer = await request_answer_async(prompt)
 
     return final_answer
+
+
+def build_noplan_prompt(question, table_with_header, prompt):
+    """
+    Fills the no-plan reasoning prompt with the question and the whole table (or as much of it as fits in the prompt budget).
+
+    Args:
+        question: The input question to be answered.
+        table_with_header: A table with column headers and data.
+        prompt: The template prompt to be filled with the question and table.
+
+    Returns:
+        The filled prompt.
+    """
+    # Keep the first rows of the table that fit in the prompt budget, if prompts are limited
+    if is_prompt_budget_enabled():
+        table_with_header, _, _ = pack_table(table_with_header, get_table_token_budget(prompt.format(question=question, table="")))
+        return prompt.format(question=question, table=serialize_table(table_with_header))
+
+    # The whole table is serialized once and shared by all the questions on it
+    return prompt.format(question=question, table=serialize_full_table(table_with_header).text)
+
+
+def request_answer(prompt, model="gpt-3.5-turbo"):
+    """
+    Requests the answer to a reasoning prompt, reusing the answer of an identical prompt from this or an earlier run.
+
+    Args:
+        prompt: The filled reasoning prompt.
+        model: The model answering the prompt.
+
+    Returns:
+        The answer generated by GPT.
+    """
+    key = memo_key("final_answer", prompt, model)
+    answer_cache = get_memo_cache("final_answer")
+    answer = answer_cache.get(key)
+    if answer is not None:
+        return answer
+
+    answer = request_gpt_chat(prompt=prompt, model=model)
+
+    # Do not memoize API errors
+    if not answer.startswith("Error calling GPT API"):
+        answer_cache.set(key, answer)
+
+    return answer
+
+
+async def request_answer_async(prompt, model="gpt-3.5-turbo"):
+    """
+    Asynchronous version of request_answer.
+
+    Args:
+        prompt: The filled reasoning prompt.
+        model: The model answering the prompt.
+
+    Returns:
+        The answer generated by GPT.
+    """
+    key = memo_key("final_answer", prompt, model)
+    answer_cache = get_memo_cache("final_answer")
+    answer = answer_cache.get(key)
+    if answer is not None:
+        return answer
+
+    answer = await request_gpt_chat_async(prompt=prompt, model=model)
+
+    # Do not memoize API errors
+    if not answer.startswith("Error calling GPT API"):
+        answer_cache.set(key, answer)
+
+    return answer
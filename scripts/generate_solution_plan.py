@@ -1,12 +1,16 @@
 import json
+import os
 import random
 import sys
 import re
 import argparse
 from tqdm import tqdm
-from utils.request_gpt import request_gpt_chat
-from utils.processing import list_to_markdown, sample_table_rows
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from utils.request_gpt import request_gpt_chat, request_gpt_chat_async
+from utils.processing import sample_table_rows, configure_table_sampling
+from utils.table_serializer import serialize_rows
+from utils.memo_cache import get_memo_cache, configure_memo_cache, memo_key
+from concurrent.futures import ThreadPoolExecutor
+from utils.dataset import iter_jsonl, bounded_map
 
 
 def clean_header(header):
@@ -33,7 +37,7 @@ def clean_header(header):
     return cleaned_header
 
 
-def get_solution_plan(table, question, plan_prompt):
+def get_solution_plan(table, question, plan_prompt, model="gpt-3.5-turbo"):
     """
     Generates a solution plan based on the table and question.
 
@@ -41,21 +45,27 @@ def get_solution_plan(table, question, plan_prompt):
         table: The input table containing data.
         question: The question to be answered.
         plan_prompt: The prompt template used to generate the solution plan.
+        model: The model generating the plan.
 
     Returns:
         A dictionary representing the solution plan.
     """
-    header, sampled_rows = sample_table_rows(table)
+    # Reuse the plan of an identical (table, question, prompt) from this or an earlier run
+    key = plan_cache_key(table, question, plan_prompt, model)
+    plan_cache = get_memo_cache("solution_plan")
+    plan_dict = plan_cache.get(key)
+    if plan_dict is not None:
+        return plan_dict
 
-    markdown_table = list_to_markdown(header, sampled_rows)
-    input_plan = plan_prompt.format(question=question, table=markdown_table)
+    input_plan = build_plan_prompt(table, question, plan_prompt)
 
     max_attempts = 10
     for attempt in range(max_attempts):
-        solution_plan = request_gpt_chat(input_plan)
+        solution_plan = request_gpt_chat(input_plan, model=model, sample=attempt)
         
         plan_dict = validate_solution_plan(solution_plan)
         if plan_dict:
+            plan_cache.set(key, plan_dict)
             return plan_dict
         else:
             print(f"Attempt {attempt + 1}: Generated solution plan does not match the expected format, retrying...")
@@ -63,6 +73,77 @@ def get_solution_plan(table, question, plan_prompt):
     raise ValueError("Failed to generate solution plan in the expected format after multiple attempts.")
 
 
+async def get_solution_plan_async(table, question, plan_prompt, model="gpt-3.5-turbo"):
+    """
+    Asynchronous version of get_solution_plan.
+
+    Args:
+        table: The input table containing data.
+        question: The question to be answered.
+        plan_prompt: The prompt template used to generate the solution plan.
+        model: The model generating the plan.
+
+    Returns:
+        A dictionary representing the solution plan.
+    """
+    # Reuse the plan of an identical (table, question, prompt) from this or an earlier run
+    key = plan_cache_key(table, question, plan_prompt, model)
+    plan_cache = get_memo_cache("solution_plan")
+    plan_dict = plan_cache.get(key)
+    if plan_dict is not None:
+        return plan_dict
+
+    input_plan = build_plan_prompt(table, question, plan_prompt)
+
+    max_attempts = 10
+    for attempt in range(max_attempts):
+        solution_plan = await request_gpt_chat_async(input_plan, model=model, sample=attempt)
+        
+        plan_dict = validate_solution_plan(solution_plan)
+        if plan_dict:
+            plan_cache.set(key, plan_dict)
+            return plan_dict
+        else:
+            print(f"Attempt {attempt + 1}: Generated solution plan does not match the expected format, retrying...")
+
+    raise ValueError("Failed to generate solution plan in the expected format after multiple attempts.")
+
+
+def plan_cache_key(table, question, plan_prompt, model):
+    """
+    Builds the key of a solution plan in the "solution_plan" stage cache.
+
+    Args:
+        table: The input table containing data.
+        question: The question to be answered.
+        plan_prompt: The prompt template used to generate the solution plan.
+        model: The model generating the plan.
+
+    Returns:
+        The cache key.
+    """
+    return memo_key("solution_plan", table, question, plan_prompt, model)
+
+
+def build_plan_prompt(table, question, plan_prompt):
+    """
+    Fills the solution plan prompt with the question and a sample of the table rows.
+
+    Args:
+        table: The input table containing data.
+        question: The question to be answered.
+        plan_prompt: The prompt template used to generate the solution plan.
+
+    Returns:
+        The filled prompt.
+    """
+    header, sampled_rows = sample_table_rows(table)
+
+    # Plan prompts always show a markdown table, as in their examples
+    markdown_table = serialize_rows(header, sampled_rows, "markdown")
+    return plan_prompt.format(question=question, table=markdown_table)
+
+
 
 def validate_solution_plan(solution_plan):
     """
@@ -157,26 +238,49 @@ def main():
         type=str, 
         help="Path to the output result file"
     )
+    parser.add_argument(
+        '--max_in_flight', 
+        type=int, 
+        default=32, 
+        help="Maximum number of questions read and in progress at the same time"
+    )
+    parser.add_argument(
+        '--stage_cache_dir', 
+        type=str, 
+        default=None, 
+        help="Directory of the SQLite stage caches, shared with final_reasoning.py (not memoized if not set)"
+    )
+    parser.add_argument(
+        '--sample_seed', 
+        type=int, 
+        default=0, 
+        help="Seed of the table rows sampled for the plan prompt"
+    )
+    parser.add_argument(
+        '--sample_strategy', 
+        type=str, 
+        default="random", 
+        choices=["random", "stratified", "diverse"], 
+        help="How table rows are sampled for the plan prompt"
+    )
     args = parser.parse_args()
 
-    with open(args.dataset_path, 'r') as f:
-        data = f.readlines()
+    configure_table_sampling(args.sample_seed, args.sample_strategy)
+
+    # Persist the plans so that final_reasoning.py reuses them instead of generating them again
+    if args.stage_cache_dir:
+        configure_memo_cache("solution_plan", os.path.join(args.stage_cache_dir, "solution_plan.sqlite"))
 
     with open(args.plan_prompt, "r") as f:
         plan_prompt = f.read()
 
-    with ThreadPoolExecutor(max_workers=8) as executor:
-        futures = [
-            executor.submit(process_single_table, index, d, plan_prompt)
-            for index, d in enumerate(data)
-        ]
-
-        with open(args.output_path, 'a', encoding='utf-8') as f: 
-            for future in tqdm(as_completed(futures), total=len(futures), desc="Processing data"):
-                result = future.result()
-                
-                f.write(json.dumps(result, ensure_ascii=False) + "\n")
-                f.flush()
+    # Stream the dataset so that only max_in_flight questions are in memory at any time
+    pending = ((index, d, plan_prompt) for index, d in iter_jsonl(args.dataset_path))
+
+    with ThreadPoolExecutor(max_workers=8) as executor, open(args.output_path, 'a', encoding='utf-8') as f:
+        for result in tqdm(bounded_map(executor, process_single_table, pending, args.max_in_flight), desc="Processing data"):
+            f.write(json.dumps(result, ensure_ascii=False) + "\n")
+            f.flush()
 
 
 if __name__ == "__main__":
@@ -1,118 +1,223 @@
-import json
-import sys
-import re
-from utils.request_gpt import request_gpt_chat, request_gpt_embedding
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from utils.vector_index import ExactIndex, normalize_rows, top_k_indices
+from utils.inverted_index import InvertedIndex
+from utils.rank_fusion import reciprocal_rank_fusion, select_rows_within_budget, get_hybrid_retrieval_config
+from utils.prompt_budget import is_prompt_budget_enabled, pack_table
+from utils.table_serializer import count_table_tokens
+from utils.request_gpt import request_gpt_chat, request_gpt_embedding, request_gpt_embeddings, request_gpt_embedding_async, request_gpt_embeddings_async
+from utils.profiling import profile_stage, run_in_context
+from utils.tracing import trace_span, is_tracing_enabled
 from scripts.processing_format import get_row_description, get_col_description
 from scripts.generate_solution_plan import get_solution_plan
-from sklearn.metrics.pairwise import cosine_similarity
 import numpy as np
-from tqdm import tqdm
-from scripts.schema_linking import rewrite_question
+from scripts.schema_linking import rewrite_question, rewrite_question_async
 
 
-def get_embeddings(descriptions, request_gpt_embedding):
+def get_embeddings(descriptions, request_gpt_embedding, batch_size=256, max_batch_tokens=100000):
 
-    embeddings = [request_gpt_embedding(desc) for desc in tqdm(descriptions, desc="Generating Embeddings")]
-    return embeddings
+    """Embed descriptions (a list or a generator, consumed one batch at a time), falling back to single requests for the batches that exhausted their rate limit retries."""
+
+    with profile_stage("embeddings"):
+        # Embed the descriptions in batched requests, results come back in input order
+        return request_gpt_embeddings(
+            descriptions, batch_size=batch_size, max_batch_tokens=max_batch_tokens, fallback=request_gpt_embedding
+        )
 
 
-def retrieve_rows_by_string_match(table, question):
+async def get_embeddings_async(descriptions, batch_size=256, max_batch_tokens=100000):
 
-    # Remove trailing punctuation from the question and convert to lowercase
-    question_cleaned = re.sub(r'[^\w\s]$', '', question.strip()).lower()
-    # Split the question into words, keeping only letters, numbers, and spaces
-    question_words = set(word for word in re.split(r'\W+', question_cleaned) if word)
+    """Asynchronous version of get_embeddings, sending all batches concurrently."""
+
+    with profile_stage("embeddings"):
+        return await request_gpt_embeddings_async(
+            descriptions, batch_size=batch_size, max_batch_tokens=max_batch_tokens, fallback=request_gpt_embedding_async
+        )
 
-    matching_rows = set()
 
-    # Iterate over the table rows in reverse order (excluding the header)
-    for row_index, row in enumerate(reversed(table[1:])):
-        # Calculate the actual index of the row in the original table
-        actual_row_index = len(table) - row_index - 2  # -2 accounts for zero-based index and header row
-        for cell in row:
-            # Convert cell content to lowercase and split into words based on non-alphanumeric characters
-            cell_words = set(
-                word for word in re.split(r'\W+', str(cell).lower())
-                if (len(word) > 3 or word.isdigit()) and word
-            )
+def retrieve_rows_by_string_match(table, question, token_index=None):
 
-            # Check if there is any intersection between cell words and question words
-            if question_words.intersection(cell_words):
-                # Uncomment the following line for debugging purposes
-                # print(f"Matched row index: {actual_row_index}, cell content: '{cell}', in question: '{question}'")
-                matching_rows.add(actual_row_index)
+    # Look the question words up in the inverted index of the table, building it if it was not precomputed
+    if token_index is None:
+        token_index = InvertedIndex(table)
 
-    return list(matching_rows)
+    # Rows (zero-based, excluding the header) with a cell word (longer than 3 characters or digits) in the question
+    with trace_span("string_match", rows_scored=len(table) - 1) as span:
+        matching_rows = token_index.match(question)
+        span["rows_selected"] = len(matching_rows)
+    return matching_rows
 
 
-def retrieve_top_relevant_rows_cols(stage, row_embeddings, col_embeddings, request_gpt_embedding, header, topk):
+def retrieve_rows_by_bm25(table, question, token_index=None):
 
-    # Determine the number of rows to select
-    if topk == 'all':
-        topk = len(row_embeddings)
-    else:
-        topk = int(topk)
+    # Rank the rows sharing a word with the question by BM25 score, building the inverted index if it was not precomputed
+    if token_index is None:
+        token_index = InvertedIndex(table)
+
+    return [row_index for row_index, _ in token_index.bm25(question)]
+
+
+def retrieve_top_relevant_rows_cols(stage, row_embeddings, col_embeddings, request_gpt_embedding, header, topk, row_index=None):
 
     # Rewrite the sub-level question using schema linking
     sub_level_question = stage['Sub-Level-Question']
-    rewrited_sub_level_question = rewrite_question(sub_level_question, header)
+    with profile_stage("schema_linking"):
+        rewrited_sub_level_question = rewrite_question(sub_level_question, header)
     # Get the embedding of the rewritten question
-    question_embedding = request_gpt_embedding(rewrited_sub_level_question)
+    with profile_stage("embeddings"):
+        question_embedding = request_gpt_embedding(rewrited_sub_level_question)
+
+    return select_top_rows_cols(question_embedding, row_embeddings, col_embeddings, topk, row_index=row_index)
 
-    # Compute similarities with row descriptions and sort them
-    row_similarities = cosine_similarity([question_embedding], row_embeddings)[0]
-    sorted_row_indices = np.argsort(-row_similarities)  # Sort in descending order of similarity
 
-    # Select the top-k row indices
-    num_rows_to_select = min(topk, len(sorted_row_indices))
-    top_sorted_rows = sorted_row_indices[:num_rows_to_select]
+def retrieve_top_relevant_rows_cols_notopk(question, row_embeddings, col_embeddings, request_gpt_embedding, header, row_index=None):
 
-    # Compute similarities with column descriptions and sort them
-    col_similarities = cosine_similarity([question_embedding], col_embeddings)[0]
-    sorted_col_indices = np.argsort(-col_similarities)  # Sort in descending order of similarity
+    # Rewrite the sub-level question using schema linking
+    with profile_stage("schema_linking"):
+        rewrited_sub_level_question = rewrite_question(question, header)
+    # Generate the embedding for the rewritten question
+    with profile_stage("embeddings"):
+        question_embedding = request_gpt_embedding(rewrited_sub_level_question)
 
-    # Select the top-5 column indices
-    num_cols_to_select = min(5, len(sorted_col_indices))
-    top_sorted_cols = sorted_col_indices[:num_cols_to_select]
+    # Select up to 60 rows based on similarity
+    return select_top_rows_cols(question_embedding, row_embeddings, col_embeddings, 60, row_index=row_index)
 
-    return top_sorted_rows, top_sorted_cols
 
+def select_top_rows_cols(question_embedding, row_embeddings, col_embeddings, topk, num_cols=5, row_index=None):
 
-def retrieve_top_relevant_rows_cols_notopk(question, row_embeddings, col_embeddings, request_gpt_embedding, header):
+    """Select the top rows and columns of a single question, searching the prebuilt row index if given."""
 
-    # Rewrite the sub-level question using schema linking
-    rewrited_sub_level_question = rewrite_question(question, header)
-    # Generate the embedding for the rewritten question
-    question_embedding = request_gpt_embedding(rewrited_sub_level_question)
+    top_rows_per_question, top_cols_per_question = select_top_rows_cols_batch(
+        [question_embedding], row_embeddings, col_embeddings, [topk], num_cols=num_cols, row_index=row_index
+    )
+    return top_rows_per_question[0], top_cols_per_question[0]
 
-    # Calculate cosine similarities with row descriptions and sort them
-    row_similarities = cosine_similarity([question_embedding], row_embeddings)[0]
-    sorted_row_indices = np.argsort(-row_similarities)  # Sort in descending order of similarity
 
-    # Select up to 60 rows based on similarity
-    num_rows_to_select = min(60, len(sorted_row_indices))  
-    top_sorted_rows = sorted_row_indices[:num_rows_to_select]
+def retrieve_plan_rows_cols(solution_plan, row_embeddings, col_embeddings, request_gpt_embedding, header, row_index=None, project_rows=None):
+
+    """Retrieve the top rows and columns of every stage of a plan, rewriting the stage questions concurrently and embedding them in one batch.
+    With project_rows (column pruning), the rows are scored on their projection over the columns relevant to any stage."""
+
+    # Rewrite the sub-level questions of all stages concurrently using schema linking
+    # (in the context of the question, so that the rewrites are counted in its profile)
+    with profile_stage("schema_linking"), ThreadPoolExecutor(max_workers=max(1, len(solution_plan))) as executor:
+        rewrited_questions = run_in_context(
+            executor, lambda stage: rewrite_question(stage['Sub-Level-Question'], header), solution_plan
+        )
+
+    # Embed all rewritten questions in a single batched request
+    question_embeddings = get_embeddings(rewrited_questions, request_gpt_embedding)
+
+    # Two-phase retrieval: select the columns first, then score the rows projected on them
+    if project_rows is not None:
+        row_embeddings, row_index = project_rows(select_relevant_columns(question_embeddings, col_embeddings))
+
+    return select_top_rows_cols_batch(
+        question_embeddings, row_embeddings, col_embeddings, [stage['Top k'] for stage in solution_plan], row_index=row_index
+    )
+
+
+async def retrieve_plan_rows_cols_async(solution_plan, row_embeddings, col_embeddings, header, row_index=None, project_rows_async=None):
+
+    """Asynchronous version of retrieve_plan_rows_cols."""
+
+    with profile_stage("schema_linking"):
+        rewrited_questions = await asyncio.gather(*[
+            rewrite_question_async(stage['Sub-Level-Question'], header) for stage in solution_plan
+        ])
+    question_embeddings = await get_question_embeddings_async(rewrited_questions)
 
-    # Calculate cosine similarities with column descriptions and sort them
-    col_similarities = cosine_similarity([question_embedding], col_embeddings)[0]
-    sorted_col_indices = np.argsort(-col_similarities)  # Sort in descending order of similarity
+    if project_rows_async is not None:
+        row_embeddings, row_index = await project_rows_async(select_relevant_columns(question_embeddings, col_embeddings))
 
-    # Select top 5 columns based on similarity
-    num_cols_to_select = min(5, len(sorted_col_indices))
-    top_sorted_cols = sorted_col_indices[:num_cols_to_select]
+    return select_top_rows_cols_batch(
+        question_embeddings, row_embeddings, col_embeddings, [stage['Top k'] for stage in solution_plan], row_index=row_index
+    )
+
+
+# Batches of question embeddings in progress, keyed by question text: (batch task, position in the batch)
+# (only used from the event loop thread)
+_pending_question_embeddings = {}
+
+
+async def get_question_embeddings_async(questions):
 
-    return top_sorted_rows, top_sorted_cols
+    """Embed the rewritten questions of a plan in one batch, awaiting instead the embedding of a question that a concurrent question is already embedding."""
 
+    in_flight = {question: _pending_question_embeddings[question] for question in questions if question in _pending_question_embeddings}
+    new_questions = [question for question in dict.fromkeys(questions) if question not in in_flight]
+
+    if new_questions:
+        batch = asyncio.ensure_future(get_embeddings_async(new_questions))
+        for position, question in enumerate(new_questions):
+            in_flight[question] = _pending_question_embeddings[question] = (batch, position)
+
+        def forget(_):
+            for question in new_questions:
+                if _pending_question_embeddings.get(question, (None,))[0] is batch:
+                    del _pending_question_embeddings[question]
+        batch.add_done_callback(forget)
+
+    # Shield the shared batches so that one cancelled question does not cancel them for the others
+    embeddings = []
+    for question in questions:
+        question_batch, position = in_flight[question]
+        embeddings.append((await asyncio.shield(question_batch))[position])
+    return embeddings
 
-def retrieve_final_subtable(solution_plan, indexed_table, row_descriptions, col_descriptions, request_gpt_embedding, question):
+
+def select_relevant_columns(question_embeddings, col_embeddings, num_cols=5):
+
+    """Select the union of the top columns of several questions, the columns that select_top_rows_cols_batch can return for them."""
+
+    dimension = np.shape(col_embeddings)[1]
+    question_matrix = np.array([
+        embedding if embedding is not None else np.zeros(dimension, dtype=np.float32) for embedding in question_embeddings
+    ], dtype=np.float32)
+
+    col_similarities = normalize_rows(question_matrix) @ normalize_rows(col_embeddings).T
+    return sorted({int(j) for i in range(len(question_matrix)) for j in top_k_indices(col_similarities[i], num_cols)})
+
+
+def select_top_rows_cols_batch(question_embeddings, row_embeddings, col_embeddings, topks, num_cols=5, row_index=None):
+
+    """Score several questions against all rows and columns at once, and select the top rows and columns of every question."""
+
+    # Search the prebuilt row index if given, otherwise an exact index over the row embeddings
+    if row_index is None:
+        row_index = ExactIndex(row_embeddings)
+
+    # Questions that could not be embedded score zero against everything
+    dimension = np.shape(col_embeddings)[1]
+    question_matrix = np.array([
+        embedding if embedding is not None else np.zeros(dimension, dtype=np.float32) for embedding in question_embeddings
+    ], dtype=np.float32)
+
+    # Determine the number of rows to select for each question
+    num_rows = [len(row_index) if topk == 'all' else int(topk) for topk in topks]
+    with trace_span("row_scoring", questions=len(question_matrix), rows_scored=len(row_index) * len(question_matrix)) as span:
+        top_rows_per_question = row_index.search(question_matrix, num_rows)
+
+        # Cosine similarities of every question with every column
+        col_similarities = normalize_rows(question_matrix) @ normalize_rows(col_embeddings).T
+        top_cols_per_question = [top_k_indices(col_similarities[i], num_cols) for i in range(len(question_matrix))]
+
+        span["rows_selected"] = sum(len(top_rows) for top_rows in top_rows_per_question)
+
+    return top_rows_per_question, top_cols_per_question
+
+
+def retrieve_final_subtable(solution_plan, indexed_table, row_descriptions, col_descriptions, request_gpt_embedding, question, row_embeddings=None, col_embeddings=None, row_index=None, token_index=None):
 
     # Extract header information from the indexed table
     header_with_index = indexed_table[0]
     header = header_with_index[1:]  # Skip the row index column
 
-    # Get embeddings for row and column descriptions
-    row_embeddings = get_embeddings(row_descriptions, request_gpt_embedding)
-    col_embeddings = get_embeddings(col_descriptions, request_gpt_embedding)
+    # Get embeddings for row and column descriptions, unless they were precomputed for this table
+    if row_embeddings is None:
+        row_embeddings = get_embeddings(row_descriptions, request_gpt_embedding)
+    if col_embeddings is None:
+        col_embeddings = get_embeddings(col_descriptions, request_gpt_embedding)
 
     # Initialize lists to store indices for rows and columns
     final_row_indices = list()
@@ -121,20 +226,17 @@ def retrieve_final_subtable(solution_plan, indexed_table, row_descriptions, col_
     embedding_row_indices = list()
     embedding_col_indices = list()
 
-    # Iterate through each stage in the solution plan and gather relevant rows and columns
-    for stage in solution_plan:
-        topk = stage['Top k']
-        # Retrieve the top rows and columns based on embeddings and the sub-level question
-        top_rows, top_cols = retrieve_top_relevant_rows_cols(
-            stage, row_embeddings, col_embeddings, request_gpt_embedding, header, topk
-        )
-
+    # Retrieve the top rows and columns of all stages in the solution plan at once
+    top_rows_per_stage, top_cols_per_stage = retrieve_plan_rows_cols(
+        solution_plan, row_embeddings, col_embeddings, request_gpt_embedding, header, row_index=row_index
+    )
+    for top_rows, top_cols in zip(top_rows_per_stage, top_cols_per_stage):
         # Update row and column indices based on embedding retrieval
         embedding_row_indices.extend(top_rows)
         embedding_col_indices.extend(top_cols)
 
     # Perform string matching to find relevant rows for the main question
-    matching_rows_question = retrieve_rows_by_string_match(indexed_table, question)
+    matching_rows_question = retrieve_rows_by_string_match(indexed_table, question, token_index)
     match_row_indices.extend(matching_rows_question)
 
     # Combine the embedding-based and matching row indices, ensuring uniqueness
@@ -150,116 +252,147 @@ def retrieve_final_subtable(solution_plan, indexed_table, row_descriptions, col_
     final_row_indices = list(dict.fromkeys(final_row_indices))
     final_col_indices = list(dict.fromkeys(final_col_indices))
 
-    # Construct the final subtable based on selected rows and columns
-    final_subtable = []
-    for i in final_row_indices:
-        subtable_row = [indexed_table[i + 1][j + 1] for j in final_col_indices]  # i+1 and j+1 to account for index adjustments
-        final_subtable.append(subtable_row)
+    # Construct the final subtable based on selected rows and columns (i+1 and j+1 to account for index adjustments)
+    final_subtable = indexed_table.select([i + 1 for i in final_row_indices], [j + 1 for j in final_col_indices])
 
     return final_subtable, final_row_indices, final_col_indices
 
 
-def retrieve_final_subtable_add(solution_plan, indexed_table, row_descriptions, col_descriptions, request_gpt_embedding, question):
+def retrieve_final_subtable_add(solution_plan, indexed_table, row_descriptions, col_descriptions, request_gpt_embedding, question, row_embeddings=None, col_embeddings=None, row_index=None, token_index=None, max_table_tokens=None, project_rows=None):
     
     """Retrieve top k row and column indices for all retrieval stages, add the previous and next rows, and generate the final subtable."""
     
     header_with_index = indexed_table[0]
     header = header_with_index[1:]  # Extract column headers (excluding the row index column)
 
-    # Get embeddings for row and column descriptions
-    row_embeddings = get_embeddings(row_descriptions, request_gpt_embedding)
-    col_embeddings = get_embeddings(col_descriptions, request_gpt_embedding)
+    # Get embeddings for row and column descriptions, unless they were precomputed for this table
+    # (or the rows are embedded over the relevant columns only, with project_rows)
+    if row_embeddings is None and project_rows is None:
+        row_embeddings = get_embeddings(row_descriptions, request_gpt_embedding)
+    if col_embeddings is None:
+        col_embeddings = get_embeddings(col_descriptions, request_gpt_embedding)
 
-    # Initialize lists to store final row and column indices
-    final_row_indices = list()
-    final_col_indices = list()
+    # Initialize lists to store retrieved row and column indices
     match_row_indices = list()
     embedding_row_indices = list()
     embedding_col_indices = list()
 
     # Perform string matching for the main question to retrieve relevant rows
-    matching_rows_question = retrieve_rows_by_string_match(indexed_table, question)
+    matching_rows_question = retrieve_rows_by_string_match(indexed_table, question, token_index)
     match_row_indices.extend(matching_rows_question)
 
-    # For each stage in the solution plan, get the top k rows and columns based on embeddings
-    for stage in solution_plan:
-        topk = stage['Top k']
-        top_rows, top_cols = retrieve_top_relevant_rows_cols(
-            stage, row_embeddings, col_embeddings, request_gpt_embedding, header, topk
-        )
-
+    # Get the top k rows and columns of all stages in the solution plan based on embeddings
+    top_rows_per_stage, top_cols_per_stage = retrieve_plan_rows_cols(
+        solution_plan, row_embeddings, col_embeddings, request_gpt_embedding, header, row_index=row_index, project_rows=project_rows
+    )
+    for top_rows, top_cols in zip(top_rows_per_stage, top_cols_per_stage):
         # Update the list of rows and columns based on embedding-based retrieval
         embedding_row_indices.extend(top_rows)
         embedding_col_indices.extend(top_cols)
 
-    # Sort the embedding-based row indices
-    embedding_row_indices = sorted(embedding_row_indices, key=int)
+    # Fuse the BM25 and embedding rankings into one list under the row budget, if enabled
+    if get_hybrid_retrieval_config()["enabled"]:
+        lexical_ranking = retrieve_rows_by_bm25(indexed_table, question, token_index)
+        return build_subtable_hybrid(indexed_table, top_rows_per_stage, embedding_col_indices, lexical_ranking, max_table_tokens)
 
-    # Combine embedding-based and string-matching row indices, ensuring no duplicates
-    combined_rows = embedding_row_indices + match_row_indices
-    combined_rows = list(dict.fromkeys(combined_rows))  # Remove duplicates while preserving order
-
-    # Add the previous and next rows for each selected row (if they exist)
-    for row_index in combined_rows:
-        if row_index > 0:  # Add the previous row if it exists
-            final_row_indices.append(row_index - 1)
-
-        final_row_indices.append(row_index)  # Add the current row
-
-        if row_index < len(indexed_table) - 2:  # Add the next row if it exists
-            final_row_indices.append(row_index + 1)
-
-    # Include columns based on embedding-based retrieval
-    final_col_indices.extend(embedding_col_indices)
-
-    # Add the header row (-1) and row index column (-1, 0) to the final row and column indices
-    final_row_indices = [-1] + final_row_indices  # Add header row
-    final_col_indices = [-1, 0] + final_col_indices  # Add row index column and first column
-
-    # Remove duplicates from the final row and column indices, keeping the last occurrence
-    final_row_indices = list(dict.fromkeys(final_row_indices[::-1]))[::-1]
-    final_col_indices = list(dict.fromkeys(final_col_indices[::-1]))[::-1]
-
-    # Generate the final subtable based on the selected rows and columns
-    final_subtable = []
-    for i in final_row_indices:
-        subtable_row = [indexed_table[i+1][j+1] for j in final_col_indices]  # i+1 and j+1 account for index offsets
-        final_subtable.append(subtable_row)
-
-    return final_subtable, final_row_indices, final_col_indices
+    return build_subtable_add(
+        indexed_table, embedding_row_indices, embedding_col_indices, match_row_indices,
+        dense_rankings=top_rows_per_stage, max_table_tokens=max_table_tokens
+    )
 
 
-def retrieve_final_subtable_add_noplan(indexed_table, row_descriptions, col_descriptions, request_gpt_embedding, question):
+def retrieve_final_subtable_add_noplan(indexed_table, row_descriptions, col_descriptions, request_gpt_embedding, question, row_embeddings=None, col_embeddings=None, row_index=None, token_index=None, max_table_tokens=None):
     
     """Retrieve top k row and column indices, add the previous and next rows, and generate the final subtable without using a solution plan."""
     
     header_with_index = indexed_table[0]
     header = header_with_index[1:]  # Extract column headers (excluding the row index column)
 
-    # Get embeddings for row and column descriptions
-    row_embeddings = get_embeddings(row_descriptions, request_gpt_embedding)
-    col_embeddings = get_embeddings(col_descriptions, request_gpt_embedding)
+    # Get embeddings for row and column descriptions, unless they were precomputed for this table
+    if row_embeddings is None:
+        row_embeddings = get_embeddings(row_descriptions, request_gpt_embedding)
+    if col_embeddings is None:
+        col_embeddings = get_embeddings(col_descriptions, request_gpt_embedding)
 
-    # Initialize lists to store final row and column indices
-    final_row_indices = list()
-    final_col_indices = list()
+    # Initialize lists to store retrieved row and column indices
     match_row_indices = list()
     embedding_row_indices = list()
     embedding_col_indices = list()
 
     # Perform string matching for the main question to retrieve relevant rows
-    matching_rows_question = retrieve_rows_by_string_match(indexed_table, question)
+    matching_rows_question = retrieve_rows_by_string_match(indexed_table, question, token_index)
     match_row_indices.extend(matching_rows_question)
 
     # Retrieve top k rows and columns based on embeddings (without a solution plan)
     top_rows, top_cols = retrieve_top_relevant_rows_cols_notopk(
-        question, row_embeddings, col_embeddings, request_gpt_embedding, header
+        question, row_embeddings, col_embeddings, request_gpt_embedding, header, row_index=row_index
     )
 
     # Update the list of rows and columns based on embedding-based retrieval
     embedding_row_indices.extend(top_rows)
     embedding_col_indices.extend(top_cols)
 
+    # Fuse the BM25 and embedding rankings into one list under the row budget, if enabled
+    if get_hybrid_retrieval_config()["enabled"]:
+        lexical_ranking = retrieve_rows_by_bm25(indexed_table, question, token_index)
+        return build_subtable_hybrid(indexed_table, [top_rows], embedding_col_indices, lexical_ranking, max_table_tokens)
+
+    return build_subtable_add(
+        indexed_table, embedding_row_indices, embedding_col_indices, match_row_indices,
+        dense_rankings=[top_rows], max_table_tokens=max_table_tokens
+    )
+
+
+async def retrieve_final_subtable_add_async(solution_plan, indexed_table, row_descriptions, col_descriptions, question, row_embeddings=None, col_embeddings=None, row_index=None, token_index=None, max_table_tokens=None, project_rows_async=None):
+
+    """Asynchronous version of retrieve_final_subtable_add, rewriting and embedding all stage questions concurrently."""
+
+    header_with_index = indexed_table[0]
+    header = header_with_index[1:]  # Extract column headers (excluding the row index column)
+
+    # Get embeddings for row and column descriptions, unless they were precomputed for this table
+    # (or the rows are embedded over the relevant columns only, with project_rows_async)
+    if row_embeddings is None and project_rows_async is None:
+        row_embeddings = await get_embeddings_async(row_descriptions)
+    if col_embeddings is None:
+        col_embeddings = await get_embeddings_async(col_descriptions)
+
+    # Initialize lists to store retrieved row and column indices
+    match_row_indices = list()
+    embedding_row_indices = list()
+    embedding_col_indices = list()
+
+    # Perform string matching for the main question to retrieve relevant rows
+    matching_rows_question = retrieve_rows_by_string_match(indexed_table, question, token_index)
+    match_row_indices.extend(matching_rows_question)
+
+    # Rewrite the sub-level questions of all stages concurrently, then embed them together
+    top_rows_per_stage, top_cols_per_stage = await retrieve_plan_rows_cols_async(
+        solution_plan, row_embeddings, col_embeddings, header, row_index=row_index, project_rows_async=project_rows_async
+    )
+    for top_rows, top_cols in zip(top_rows_per_stage, top_cols_per_stage):
+        # Update the list of rows and columns based on embedding-based retrieval
+        embedding_row_indices.extend(top_rows)
+        embedding_col_indices.extend(top_cols)
+
+    # Fuse the BM25 and embedding rankings into one list under the row budget, if enabled
+    if get_hybrid_retrieval_config()["enabled"]:
+        lexical_ranking = retrieve_rows_by_bm25(indexed_table, question, token_index)
+        return build_subtable_hybrid(indexed_table, top_rows_per_stage, embedding_col_indices, lexical_ranking, max_table_tokens)
+
+    return build_subtable_add(
+        indexed_table, embedding_row_indices, embedding_col_indices, match_row_indices,
+        dense_rankings=top_rows_per_stage, max_table_tokens=max_table_tokens
+    )
+
+
+def build_subtable_add(indexed_table, embedding_row_indices, embedding_col_indices, match_row_indices, dense_rankings=None, max_table_tokens=None):
+
+    """Combine the retrieved row and column indices, add the previous and next rows, and generate the final subtable."""
+
+    final_row_indices = list()
+    final_col_indices = list()
+
     # Sort the embedding-based row indices
     embedding_row_indices = sorted(embedding_row_indices, key=int)
 
@@ -288,19 +421,77 @@ def retrieve_final_subtable_add_noplan(indexed_table, row_descriptions, col_desc
     final_row_indices = list(dict.fromkeys(final_row_indices[::-1]))[::-1]
     final_col_indices = list(dict.fromkeys(final_col_indices[::-1]))[::-1]
 
-    # Generate the final subtable based on the selected rows and columns
-    final_subtable = []
-    for i in final_row_indices:
-        subtable_row = [indexed_table[i+1][j+1] for j in final_col_indices]  # i+1 and j+1 account for index offsets
-        final_subtable.append(subtable_row)
+    # Rank the rows for the token budget: embedding rows by their fused rank across stages, then string matches
+    if dense_rankings is None:
+        dense_rankings = [embedding_row_indices]
+    dense_rankings = [[int(row_index) for row_index in ranking] for ranking in dense_rankings]
+    ranked_rows = [row_index for row_index, _ in reciprocal_rank_fusion(dense_rankings)] + list(match_row_indices)
+
+    return assemble_subtable(indexed_table, final_row_indices, final_col_indices, ranked_rows, max_table_tokens)
+
+
+def build_subtable_hybrid(indexed_table, dense_rankings, embedding_col_indices, lexical_ranking, max_table_tokens=None):
+
+    """Fuse the embedding rankings of all stages with the BM25 ranking of the question, and generate the final subtable from the best rows under the row budget."""
+
+    config = get_hybrid_retrieval_config()
+
+    # One dense ranking per stage plus the lexical ranking of the main question
+    rankings = [[int(row_index) for row_index in ranking] for ranking in dense_rankings] + [lexical_ranking]
+    weights = [config["dense_weight"]] * len(dense_rankings) + [config["lexical_weight"]]
+    fused_rows = [row_index for row_index, _ in reciprocal_rank_fusion(rankings, weights, k=config["rrf_k"])]
+
+    # Spend the row budget on the best fused rows and their neighbours, kept in table order
+    selected_rows = select_rows_within_budget(fused_rows, len(indexed_table) - 1, config["row_budget"], config["neighbours"])
+
+    # Add the header row (-1) and row index column (-1, 0), as in build_subtable_add
+    final_row_indices = [-1] + selected_rows
+    final_col_indices = [-1, 0] + list(embedding_col_indices)
+    final_col_indices = list(dict.fromkeys(final_col_indices[::-1]))[::-1]
+
+    return assemble_subtable(indexed_table, final_row_indices, final_col_indices, fused_rows, max_table_tokens)
+
+
+def assemble_subtable(indexed_table, final_row_indices, final_col_indices, ranked_rows=None, max_table_tokens=None):
+
+    """Generate the final subtable of the selected rows and columns, keeping the best ranked rows that fit in the token budget if prompts are limited."""
+
+    with trace_span("subtable", rows_selected=len(final_row_indices) - 1) as span:
+        final_subtable, final_row_indices, final_col_indices = pack_subtable(
+            indexed_table, final_row_indices, final_col_indices, ranked_rows, max_table_tokens
+        )
+
+        span.update(rows_kept=len(final_row_indices) - 1, cols_kept=len(final_col_indices))
+        if is_tracing_enabled():
+            span["table_tokens"] = count_table_tokens(final_subtable)
 
     return final_subtable, final_row_indices, final_col_indices
 
 
+def pack_subtable(indexed_table, final_row_indices, final_col_indices, ranked_rows=None, max_table_tokens=None):
 
-    
+    """Extract the selected rows and columns, and pack them into the token budget if prompts are limited."""
 
+    # Generate the final subtable based on the selected rows and columns (i+1 and j+1 account for index offsets)
+    final_subtable = indexed_table.select([i + 1 for i in final_row_indices], [j + 1 for j in final_col_indices])
 
+    if not is_prompt_budget_enabled():
+        return final_subtable, final_row_indices, final_col_indices
 
+    # Positions of the selected table rows in the subtable (the first subtable row is the header, -1)
+    data_rows = final_row_indices[1:]
+    positions = {row_index: position for position, row_index in enumerate(data_rows)}
 
+    # Each ranked row is followed by its previous and next rows, then the remaining rows in subtable order
+    row_priority = []
+    for row_index in ranked_rows or []:
+        for candidate in (row_index, row_index - 1, row_index + 1):
+            if candidate in positions:
+                row_priority.append(positions[candidate])
+    row_priority.extend(range(len(data_rows)))
 
+    final_subtable, kept_positions, num_cols = pack_table(final_subtable, max_table_tokens, row_priority)
+    final_row_indices = [-1] + [data_rows[position] for position in kept_positions]
+    final_col_indices = final_col_indices[:num_cols]
+
+    return final_subtable, final_row_indices, final_col_indices
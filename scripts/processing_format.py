@@ -2,8 +2,13 @@ import random
 import json
 import sys
 import re
-from utils.request_gpt import request_gpt_chat, request_gpt_embedding
-from utils.processing import sample_table_rows
+import string
+import functools
+from operator import itemgetter
+from utils.request_gpt import request_gpt_chat, request_gpt_chat_async, request_gpt_embedding
+from utils.processing import sample_table_rows, iter_data_rows
+from utils.memo_cache import get_memo_cache, memo_key
+from utils.table_serializer import format_row, format_rows
 
 
 def get_row_template(table, prompt):
@@ -17,17 +22,11 @@ def get_row_template(table, prompt):
     Returns:
         A row template generated by the GPT model.
     """
-    header, sampled_rows = sample_table_rows(table)
-    markdown_header = "| " + " | ".join(header) + " |\n"
-    markdown_rows = ""
-    for row in sampled_rows:
-        markdown_rows += "| " + " | ".join(row) + " |\n"
-
-    prompt = prompt.format(header=markdown_header, sampled_rows=markdown_rows)
+    header, prompt = build_template_prompt(table, prompt)
 
     max_attempts = 10
     for attempt in range(max_attempts):
-        row_template = request_gpt_chat(prompt=prompt)
+        row_template = request_gpt_chat(prompt=prompt, sample=attempt)
         
         if validate_row_template(row_template, header):
             return row_template
@@ -36,36 +35,91 @@ def get_row_template(table, prompt):
     raise ValueError("Failed to generate row template in the expected format after multiple attempts.")
 
 
-def get_col_template(table, prompt):
+def get_col_template(table, prompt, model="gpt-3.5-turbo"):
     """
     Generates a column template based on a sampled table and prompt.
     
     Args:
         table: The input table containing data.
         prompt: The prompt to generate the column template.
+        model: The model generating the template.
 
     Returns:
         A column template generated by the GPT model.
     """
-    header, sampled_rows = sample_table_rows(table)
-    markdown_header = "| " + " | ".join(header) + " |\n"
-    markdown_rows = ""
-    for row in sampled_rows:
-        markdown_rows += "| " + " | ".join(row) + " |\n"
+    # Reuse the template of an identical (table, prompt) from this or an earlier run
+    key = memo_key("col_template", table, prompt, model)
+    template_cache = get_memo_cache("col_template")
+    col_template = template_cache.get(key)
+    if col_template is not None:
+        return col_template
+
+    header, prompt = build_template_prompt(table, prompt)
+
+    max_attempts = 10
+    for attempt in range(max_attempts):
+        col_template = request_gpt_chat(prompt=prompt, model=model, sample=attempt)
+        
+        if validate_col_template(col_template, header):
+            template_cache.set(key, col_template)
+            return col_template
+        else:
+            print(f"Attempt {attempt + 1}: Generated template does not match the expected format, retrying...")
+    raise ValueError("Failed to generate column template in the expected format after multiple attempts.")
+
+
+async def get_col_template_async(table, prompt, model="gpt-3.5-turbo"):
+    """
+    Asynchronous version of get_col_template.
+    
+    Args:
+        table: The input table containing data.
+        prompt: The prompt to generate the column template.
+        model: The model generating the template.
+
+    Returns:
+        A column template generated by the GPT model.
+    """
+    # Reuse the template of an identical (table, prompt) from this or an earlier run
+    key = memo_key("col_template", table, prompt, model)
+    template_cache = get_memo_cache("col_template")
+    col_template = template_cache.get(key)
+    if col_template is not None:
+        return col_template
 
-    prompt = prompt.format(header=markdown_header, sampled_rows=markdown_rows)
+    header, prompt = build_template_prompt(table, prompt)
 
     max_attempts = 10
     for attempt in range(max_attempts):
-        col_template = request_gpt_chat(prompt=prompt)
+        col_template = await request_gpt_chat_async(prompt=prompt, model=model, sample=attempt)
         
         if validate_col_template(col_template, header):
+            template_cache.set(key, col_template)
             return col_template
         else:
             print(f"Attempt {attempt + 1}: Generated template does not match the expected format, retrying...")
     raise ValueError("Failed to generate column template in the expected format after multiple attempts.")
 
 
+def build_template_prompt(table, prompt):
+    """
+    Fills a row or column template prompt with the table header and a sample of its rows.
+
+    Args:
+        table: The input table containing data.
+        prompt: The prompt to fill.
+
+    Returns:
+        A tuple of the table header and the filled prompt.
+    """
+    header, sampled_rows = sample_table_rows(table)
+    # Template prompts always show markdown rows, as in their examples
+    markdown_header = format_row(header, "markdown")
+    markdown_rows = format_rows(sampled_rows, "markdown")
+
+    return header, prompt.format(header=markdown_header, sampled_rows=markdown_rows)
+
+
 def validate_col_template(col_template, header):
     """
     Validates whether the generated column descriptions follow the required format.
@@ -94,10 +148,133 @@ def validate_row_template(row_template, header):
         header: The table header containing column names.
 
     Returns:
-        True if all placeholders in the template match the column names in the header; False otherwise.
+        True if all placeholders in the template match the column names in the header (and the template can be
+        compiled for rendering); False otherwise.
     """
+    # Placeholders must be bare column names, e.g. {year} but not {year!r} or {year:>6}
     placeholders = re.findall(r"\{(.*?)\}", row_template)
-    return all(placeholder in header for placeholder in placeholders)
+    if not all(placeholder in header for placeholder in placeholders):
+        return False
+    try:
+        compile_row_template(row_template, header)
+    except ValueError:
+        return False
+    return True
+
+
+class CompiledRowTemplate:
+    """
+    A row template parsed once into literal text and column positions, rendering rows without building a dict per row.
+
+    Rendering a row gives the same text as row_template.format(**dict(zip(header, row))): the template is rewritten
+    with positional fields (e.g. "Name: {name}" becomes "Name: {0}"), filled with the cells fetched by position.
+
+    Attributes:
+        columns: The position in the header of each placeholder, in template order.
+        names: The column name of each placeholder, in template order.
+    """
+
+    def __init__(self, row_template, header):
+        """
+        Args:
+            row_template: The row template, with one {column name} placeholder per column it describes.
+            header: The table header containing column names.
+
+        Raises:
+            ValueError: If the template is malformed or has a placeholder that is not a column name.
+        """
+        # Like dict(zip(header, row)), a repeated column name refers to its last column
+        positions = {name: position for position, name in enumerate(header)}
+
+        segments = []
+        self.columns = []
+        self.names = []
+        for literal, field_name, format_spec, conversion in string.Formatter().parse(row_template):
+            segments.append(literal.replace("{", "{{").replace("}", "}}"))
+            if field_name is None:
+                continue
+            if field_name not in positions:
+                raise ValueError(f"The row template placeholder {{{field_name}}} is not a column of the table.")
+            conversion = f"!{conversion}" if conversion else ""
+            format_spec = f":{format_spec}" if format_spec else ""
+            segments.append(f"{{{len(self.columns)}{conversion}{format_spec}}}")
+            self.columns.append(positions[field_name])
+            self.names.append(field_name)
+
+        self.format = "".join(segments).format
+        self.min_row_length = max(self.columns) + 1 if self.columns else 0
+        if not self.columns:
+            self.get_cells = lambda row: ()
+        elif len(self.columns) == 1:
+            column = self.columns[0]
+            self.get_cells = lambda row: (row[column],)
+        else:
+            self.get_cells = itemgetter(*self.columns)
+
+    def render(self, row):
+        """
+        Args:
+            row: The cells of one row.
+
+        Returns:
+            The description of the row.
+
+        Raises:
+            KeyError: If the row is too short to have a cell for a placeholder.
+        """
+        if len(row) < self.min_row_length:
+            missing = next(name for name, column in zip(self.names, self.columns) if column >= len(row))
+            raise KeyError(missing)
+        return self.format(*self.get_cells(row))
+
+    def render_all(self, rows):
+        """
+        Args:
+            rows: The rows to describe.
+
+        Returns:
+            A list with the description of each row.
+        """
+        # Check the row lengths once, then render in a tight loop (iterators are consumed once, into a list)
+        if not isinstance(rows, (list, tuple)):
+            rows = list(rows)
+        if any(len(row) < self.min_row_length for row in rows):
+            return [self.render(row) for row in rows]
+        render_row, get_cells = self.format, self.get_cells
+        return [render_row(*get_cells(row)) for row in rows]
+
+    def iter_render(self, rows):
+        """
+        Args:
+            rows: An iterable of rows to describe.
+
+        Returns:
+            A generator of the description of each row, rendered only when it is consumed.
+        """
+        for row in rows:
+            yield self.render(row)
+
+
+@functools.lru_cache(maxsize=256)
+def _compile_row_template(row_template, header):
+    return CompiledRowTemplate(row_template, header)
+
+
+def compile_row_template(row_template, header):
+    """
+    Parses a row template once for a header; the same (template, header) is only parsed the first time.
+
+    Args:
+        row_template: The row template.
+        header: The table header containing column names.
+
+    Returns:
+        A CompiledRowTemplate.
+
+    Raises:
+        ValueError: If the template is malformed or has a placeholder that is not a column name.
+    """
+    return _compile_row_template(row_template, tuple(header))
 
 
 def get_row_description(table, row_prompt):
@@ -112,16 +289,23 @@ def get_row_description(table, row_prompt):
         A list of natural language descriptions for each row in the table.
     """
     row_template = get_row_template(table, row_prompt)
-    header, *rows = table
 
-    descriptions = []
-    for row in rows:
-        row_data = dict(zip(header, row))
-        description = row_template.format(**row_data)
-        descriptions.append(description)
+    return compile_row_template(row_template, table[0]).render_all(iter_data_rows(table))
+
+
+def iter_row_descriptions(table, row_template):
+    """
+    Streams the natural language descriptions of the rows of a table, e.g. into get_embeddings,
+    without materializing the list of descriptions.
 
-    return descriptions
+    Args:
+        table: The input table containing data.
+        row_template: The row template, as returned by get_row_template.
 
+    Returns:
+        A generator of the description of each row in the table.
+    """
+    return compile_row_template(row_template, table[0]).iter_render(iter_data_rows(table))
 
 
 def get_col_description(table, col_prompt):
@@ -136,9 +320,38 @@ def get_col_description(table, col_prompt):
         A list of natural language descriptions for each column in the table.
     """
     col_template = get_col_template(table, col_prompt)
-    column_descriptions = col_template.split('\n')
 
-    header, *rows = table
+    return split_col_template(col_template, table[0])
+
+
+async def get_col_description_async(table, col_prompt):
+    """
+    Asynchronous version of get_col_description.
+
+    Args:
+        table: The input table containing data.
+        col_prompt: The prompt used to generate column templates.
+
+    Returns:
+        A list of natural language descriptions for each column in the table.
+    """
+    col_template = await get_col_template_async(table, col_prompt)
+
+    return split_col_template(col_template, table[0])
+
+
+def split_col_template(col_template, header):
+    """
+    Splits a generated column template into one description per column.
+
+    Args:
+        col_template: The generated template for column descriptions.
+        header: The table header containing column names.
+
+    Returns:
+        A list of natural language descriptions for each column in the table.
+    """
+    column_descriptions = col_template.split('\n')
 
     column_texts = []
     for i, col_name in enumerate(header):
@@ -148,22 +361,33 @@ def get_col_description(table, col_prompt):
     return column_texts
 
 
-def get_row_flattened(table):
+def iter_row_flattened(table, columns=None):
+    """
+    Streams the flattened rows of the table, e.g. into get_embeddings, without materializing the list of strings.
+
+    Args:
+        table: The input table containing data.
+        columns: The positions of the columns to keep in each row, all columns if None.
+
+    Returns:
+        A generator of the flattened version of each row in the table.
+    """
+    for row in iter_data_rows(table):
+        yield ''.join(row) if columns is None else ''.join(row[j] for j in columns if j < len(row))
+
+
+def get_row_flattened(table, columns=None):
     """
     Flattens each row of the table into a single string.
 
     Args:
         table: The input table containing data.
+        columns: The positions of the columns to keep in each row, all columns if None.
 
     Returns:
         A list of strings where each string is a flattened version of a row in the table.
     """
-    flattened_rows = []
-    for row in table[1:]:
-        flattened_row = ''.join(row)
-        flattened_rows.append(flattened_row)
-    
-    return flattened_rows
+    return list(iter_row_flattened(table, columns))
 
 
 
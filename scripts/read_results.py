@@ -0,0 +1,26 @@
+import json
+import argparse
+from tqdm import tqdm
+from utils.record_store import iter_result_records
+
+
+def main(args):
+    # Rehydrate the compact records from the side store and write them as full records
+    with open(args.output_path, 'w', encoding='utf-8') as f:
+        for record in tqdm(iter_result_records(args.result_file_path, args.record_store_path), desc="Rehydrating records"):
+            if args.fields:
+                record = {field: record[field] for field in args.fields if field in record}
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rehydrate compact result records into full records")
+    parser.add_argument('--result_file_path', type=str, required=True, help="Path to the compact result file")
+    parser.add_argument('--record_store_path', type=str, default=None, help="Path to the side store of the records (result file path + .store.sqlite if not set)")
+    parser.add_argument('--output_path', type=str, required=True, help="Path to save the full records")
+    parser.add_argument('--fields', type=str, nargs='+', default=None, help="Only keep these fields of each record (all fields if not set)")
+
+    args = parser.parse_args()
+    if args.record_store_path is None:
+        args.record_store_path = args.result_file_path + ".store.sqlite"
+    main(args)
@@ -1,13 +1,67 @@
 import sys
 import json
-from utils.request_gpt import request_gpt_chat
+import re
+import asyncio
+from utils.request_gpt import request_gpt_chat, request_gpt_chat_async
+from utils.prompt_templates import load_prompt
+from utils.memo_cache import get_memo_cache, memo_key
 
+SCHEMA_LINKING_PROMPT_PATH = "prompt/prompt_schema_linking.md"
 
-def rewrite_question(question, headers):
-    with open("prompt/prompt_schema_linking.md", "r") as f:
-        prompt = f.read()
+
+def rewrite_cache_key(question, headers, model):
+    # Questions differing only in surrounding or repeated whitespace share a rewrite
+    normalized_question = re.sub(r'\s+', ' ', question).strip()
+    return memo_key("schema_linking", normalized_question, list(headers), model)
+
+
+def rewrite_question(question, headers, model="gpt-3.5-turbo"):
+    key = rewrite_cache_key(question, headers, model)
+    rewrite_cache = get_memo_cache("schema_linking")
+    rewrited_question = rewrite_cache.get(key)
+    if rewrited_question is not None:
+        return rewrited_question
+
+    prompt = load_prompt(SCHEMA_LINKING_PROMPT_PATH)
     prompt = prompt.format(question=question, headers=str(headers))
-    rewrited_question = request_gpt_chat(prompt=prompt)
+    rewrited_question = request_gpt_chat(prompt=prompt, model=model)
+
+    # Do not memoize API errors
+    if not rewrited_question.startswith("Error calling GPT API"):
+        rewrite_cache.set(key, rewrited_question)
+
+    return rewrited_question
+
+
+# Rewrites in progress, keyed like the rewrite cache (only used from the event loop thread)
+_pending_rewrites = {}
+
+
+async def rewrite_question_async(question, headers, model="gpt-3.5-turbo"):
+    key = rewrite_cache_key(question, headers, model)
+    rewrite_cache = get_memo_cache("schema_linking")
+    rewrited_question = rewrite_cache.get(key)
+    if rewrited_question is not None:
+        return rewrited_question
+
+    # Concurrent questions asking for the same rewrite await a single chat call
+    rewrite = _pending_rewrites.get(key)
+    if rewrite is None:
+        rewrite = asyncio.ensure_future(request_rewrite_async(question, headers, model, key))
+        _pending_rewrites[key] = rewrite
+        rewrite.add_done_callback(lambda _: _pending_rewrites.pop(key, None))
+
+    # Shield the shared call so that one cancelled question does not cancel it for the others
+    return await asyncio.shield(rewrite)
+
+
+async def request_rewrite_async(question, headers, model, key):
+    prompt = load_prompt(SCHEMA_LINKING_PROMPT_PATH)
+    prompt = prompt.format(question=question, headers=str(headers))
+    rewrited_question = await request_gpt_chat_async(prompt=prompt, model=model)
+
+    if not rewrited_question.startswith("Error calling GPT API"):
+        get_memo_cache("schema_linking").set(key, rewrited_question)
 
     return rewrited_question
 
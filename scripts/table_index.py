@@ -0,0 +1,374 @@
+import asyncio
+import threading
+from collections import OrderedDict
+import numpy as np
+from utils.request_gpt import request_gpt_embedding
+from utils.profiling import profile_stage
+from utils.tracing import trace_span
+from utils.processing import clean_table, index_table, table_fingerprint
+from utils.vector_index import build_row_index
+from utils.inverted_index import InvertedIndex
+from scripts.processing_format import get_col_description, get_col_description_async, get_row_flattened, iter_row_flattened
+from scripts.get_sub_table import get_embeddings, get_embeddings_async
+
+
+class TableIndex:
+    """
+    Everything retrieval needs to know about one table, built once and shared by all questions on it.
+
+    Attributes:
+        fingerprint: The content fingerprint of the raw table.
+        cleaned_table: The table with cleaned column names.
+        indexed_table: The cleaned table with a leading "row index" column.
+        row_descriptions: The flattened text of each row, generated on access (the rows are streamed into the embedder).
+        col_descriptions: The LLM-generated description of each column.
+        row_embeddings: A float32 matrix with one embedding per row, None if the rows are only embedded over
+            the columns relevant to each question (column pruning).
+        col_embeddings: A float32 matrix with one embedding per column.
+        row_index: The vector index over the row embeddings, None with column pruning.
+        token_index: The inverted index from cell words to rows, used for string matching.
+        projections: The row embeddings and vector index of each column subset embedded so far (column pruning).
+    """
+
+    def __init__(self, fingerprint, cleaned_table, indexed_table, col_descriptions, row_embeddings, col_embeddings):
+        self.fingerprint = fingerprint
+        self.cleaned_table = cleaned_table
+        self.indexed_table = indexed_table
+        self.col_descriptions = col_descriptions
+        self.row_embeddings = row_embeddings
+        self.col_embeddings = col_embeddings
+        self.row_index = build_row_index(row_embeddings) if row_embeddings is not None else None
+        self.token_index = InvertedIndex(indexed_table)
+
+        self.projections = OrderedDict()
+        self._projection_locks = {}
+        self._projections_lock = threading.Lock()
+        # Asynchronous projections in progress, keyed by column subset (only used from the event loop thread)
+        self._pending_projections = {}
+
+    @property
+    def row_descriptions(self):
+        """The flattened text of each row, as embedded (only materialized for the result records)."""
+        return get_row_flattened(self.cleaned_table)
+
+    def iter_row_descriptions(self):
+        """A generator of the flattened text of each row, consumed only if the rows have to be embedded."""
+        return iter_row_flattened(self.cleaned_table)
+
+    @property
+    def num_rows(self):
+        """The number of data rows."""
+        return len(self.cleaned_table) - 1
+
+    @property
+    def prunes_columns(self):
+        """True if rows are embedded over the relevant columns of each question instead of all columns."""
+        return self.row_embeddings is None
+
+    def project_rows(self, col_indices):
+        """
+        Get the row embeddings and vector index of the rows restricted to a subset of the columns,
+        embedding the projected rows only the first time the subset is asked for.
+
+        Args:
+            col_indices: The positions of the kept columns (excluding the row index column).
+
+        Returns:
+            A tuple of the projected row embedding matrix and its vector index.
+        """
+        key = tuple(sorted(int(j) for j in col_indices))
+        with self._projections_lock:
+            projection = self._cached_projection(key)
+            if projection is not None:
+                return projection
+            build_lock = self._projection_locks.setdefault(key, threading.Lock())
+
+        with build_lock:
+            # Another thread may have embedded the same subset while we were waiting
+            with self._projections_lock:
+                projection = self._cached_projection(key)
+                if projection is not None:
+                    return projection
+
+            with trace_span("column_projection", cols_kept=len(key), rows_embedded=self.num_rows):
+                row_embeddings = to_embedding_matrix(get_embeddings(iter_row_flattened(self.cleaned_table, key), request_gpt_embedding))
+            return self._register_projection(key, row_embeddings)
+
+    async def project_rows_async(self, col_indices):
+        """
+        Asynchronous version of project_rows; concurrent tasks asking for the same subset await a single embedding.
+
+        Args:
+            col_indices: The positions of the kept columns (excluding the row index column).
+
+        Returns:
+            A tuple of the projected row embedding matrix and its vector index.
+        """
+        key = tuple(sorted(int(j) for j in col_indices))
+        with self._projections_lock:
+            projection = self._cached_projection(key)
+            if projection is not None:
+                return projection
+
+        build = self._pending_projections.get(key)
+        if build is None:
+            build = asyncio.ensure_future(self._embed_projection_async(key))
+            self._pending_projections[key] = build
+            build.add_done_callback(lambda _: self._pending_projections.pop(key, None))
+
+        # Shield the shared embedding so that one cancelled question does not cancel it for the others
+        return await asyncio.shield(build)
+
+    async def _embed_projection_async(self, key):
+        with trace_span("column_projection", cols_kept=len(key), rows_embedded=self.num_rows):
+            row_embeddings = to_embedding_matrix(await get_embeddings_async(iter_row_flattened(self.cleaned_table, key)))
+        return self._register_projection(key, row_embeddings)
+
+    def _cached_projection(self, key):
+        # The projection on exactly these columns, or else the narrowest cached projection covering all of them
+        # (its extra columns only add context to the rows), so that close column subsets share their embeddings
+        projection_key = key if key in self.projections else None
+        if projection_key is None:
+            supersets = [cached_key for cached_key in self.projections if set(key) <= set(cached_key)]
+            if supersets:
+                projection_key = min(supersets, key=len)
+        if projection_key is None:
+            return None
+        self.projections.move_to_end(projection_key)
+        return self.projections[projection_key]
+
+    def _register_projection(self, key, row_embeddings):
+        # Keep the most recently used projections of this table
+        projection = (row_embeddings, build_row_index(row_embeddings))
+        with self._projections_lock:
+            self.projections[key] = projection
+            self.projections.move_to_end(key)
+            self._projection_locks.pop(key, None)
+            while len(self.projections) > _column_pruning_config["max_projections"]:
+                self.projections.popitem(last=False)
+        return projection
+
+
+# Recently used table indexes, keyed by fingerprint
+_table_indexes = OrderedDict()
+_table_index_locks = {}
+_registry_lock = threading.Lock()
+MAX_CACHED_TABLES = 16
+
+# Asynchronous builds in progress, keyed by fingerprint (only used from the event loop thread)
+_pending_builds = {}
+
+# Column pruning settings, set by configure_column_pruning (disabled by default)
+_column_pruning_config = {"enabled": False, "min_cols": 8, "max_projections": 32}
+
+
+def configure_column_pruning(enabled=False, min_cols=8, max_projections=32):
+    """
+    Choose whether the rows of wide tables are embedded over the columns relevant to each question only.
+
+    With column pruning, the full rows of a table with at least min_cols columns are never embedded. Retrieval
+    first selects the columns of every plan stage from the column embeddings, then embeds the rows projected on
+    the union of these columns, once per table and column subset.
+
+    Args:
+        enabled: Whether to prune the columns of wide tables before row retrieval.
+        min_cols: The number of columns from which a table is pruned, default is 8.
+        max_projections: The maximum number of column subsets whose row embeddings are kept per table, default is 32.
+    """
+    if min_cols <= 0:
+        raise ValueError(f"The minimum number of columns must be positive, got {min_cols}")
+    _column_pruning_config.update(enabled=enabled, min_cols=min_cols, max_projections=max_projections)
+
+
+def prunes_columns(table):
+    """
+    Check whether the rows of a table are embedded over the relevant columns only.
+
+    Args:
+        table: The cleaned table as a list of lists (rows), including the header row.
+
+    Returns:
+        True if column pruning is enabled and the table is wide enough.
+    """
+    return _column_pruning_config["enabled"] and len(table[0]) >= _column_pruning_config["min_cols"]
+
+
+def to_embedding_matrix(embeddings):
+    """
+    Stack embedding vectors into a contiguous float32 matrix.
+
+    Args:
+        embeddings: A list of embedding vectors, with None for texts that could not be embedded.
+
+    Returns:
+        A (len(embeddings), dim) float32 matrix where missing embeddings are zero vectors.
+    """
+    dimension = next((len(embedding) for embedding in embeddings if embedding is not None), None)
+    if dimension is None:
+        raise ValueError("Failed to generate any embedding for the table.")
+
+    matrix = np.zeros((len(embeddings), dimension), dtype=np.float32)
+    for i, embedding in enumerate(embeddings):
+        if embedding is not None:
+            matrix[i] = embedding
+    return matrix
+
+
+def build_table_index(table, col_prompt, fingerprint=None):
+    """
+    Build the retrieval index of a table: cleaned tables, row/column descriptions and their embeddings.
+
+    Args:
+        table: The raw input table as a list of lists (rows).
+        col_prompt: The prompt used to generate column templates.
+        fingerprint: The precomputed table fingerprint, computed if not given.
+
+    Returns:
+        A TableIndex for the table.
+    """
+    if fingerprint is None:
+        fingerprint = table_fingerprint(table)
+
+    with profile_stage("clean_index"):
+        cleaned_table = clean_table(table)
+        indexed_table = index_table(cleaned_table)
+
+    with profile_stage("col_template"):
+        col_descriptions = get_col_description(cleaned_table, col_prompt)
+
+    # With column pruning, the rows are embedded later over the columns relevant to each question
+    # (the flattened rows are streamed into the batched embedder, without building their list)
+    row_embeddings = None
+    if not prunes_columns(cleaned_table):
+        row_embeddings = to_embedding_matrix(get_embeddings(iter_row_flattened(cleaned_table), request_gpt_embedding))
+    col_embeddings = to_embedding_matrix(get_embeddings(col_descriptions, request_gpt_embedding))
+
+    return TableIndex(fingerprint, cleaned_table, indexed_table, col_descriptions, row_embeddings, col_embeddings)
+
+
+def get_table_index(table, col_prompt, fingerprint=None):
+    """
+    Get the retrieval index of a table, building it only the first time the table is seen.
+
+    Concurrent callers asking for the same table wait for a single build instead of building it twice.
+
+    Args:
+        table: The raw input table as a list of lists (rows).
+        col_prompt: The prompt used to generate column templates.
+        fingerprint: The precomputed table fingerprint, computed if not given.
+
+    Returns:
+        The shared TableIndex for the table.
+    """
+    if fingerprint is None:
+        fingerprint = table_fingerprint(table)
+
+    with _registry_lock:
+        if fingerprint in _table_indexes:
+            _table_indexes.move_to_end(fingerprint)
+            return _table_indexes[fingerprint]
+        build_lock = _table_index_locks.setdefault(fingerprint, threading.Lock())
+
+    with build_lock:
+        # Another thread may have finished building the index while we were waiting
+        with _registry_lock:
+            if fingerprint in _table_indexes:
+                _table_indexes.move_to_end(fingerprint)
+                return _table_indexes[fingerprint]
+
+        table_index = build_table_index(table, col_prompt, fingerprint)
+        register_table_index(table_index)
+
+    return table_index
+
+
+async def build_table_index_async(table, col_prompt, fingerprint=None):
+    """
+    Asynchronous version of build_table_index, embedding the rows while the column template is generated.
+
+    Args:
+        table: The raw input table as a list of lists (rows).
+        col_prompt: The prompt used to generate column templates.
+        fingerprint: The precomputed table fingerprint, computed if not given.
+
+    Returns:
+        A TableIndex for the table.
+    """
+    if fingerprint is None:
+        fingerprint = table_fingerprint(table)
+
+    with profile_stage("clean_index"):
+        cleaned_table = clean_table(table)
+        indexed_table = index_table(cleaned_table)
+
+    if prunes_columns(cleaned_table):
+        # With column pruning, the rows are embedded later over the columns relevant to each question
+        col_descriptions = await get_col_description_timed_async(cleaned_table, col_prompt)
+        row_embeddings = None
+    else:
+        col_descriptions, row_embeddings = await asyncio.gather(
+            get_col_description_timed_async(cleaned_table, col_prompt),
+            get_embeddings_async(iter_row_flattened(cleaned_table))
+        )
+        row_embeddings = to_embedding_matrix(row_embeddings)
+    col_embeddings = await get_embeddings_async(col_descriptions)
+
+    return TableIndex(
+        fingerprint, cleaned_table, indexed_table, col_descriptions,
+        row_embeddings, to_embedding_matrix(col_embeddings)
+    )
+
+
+async def get_col_description_timed_async(table, col_prompt):
+    # The column template is generated concurrently with the row embeddings, time it on its own
+    with profile_stage("col_template"):
+        return await get_col_description_async(table, col_prompt)
+
+
+async def get_table_index_async(table, col_prompt, fingerprint=None):
+    """
+    Asynchronous version of get_table_index; concurrent tasks asking for the same table await a single build.
+
+    Args:
+        table: The raw input table as a list of lists (rows).
+        col_prompt: The prompt used to generate column templates.
+        fingerprint: The precomputed table fingerprint, computed if not given.
+
+    Returns:
+        The shared TableIndex for the table.
+    """
+    if fingerprint is None:
+        fingerprint = table_fingerprint(table)
+
+    with _registry_lock:
+        if fingerprint in _table_indexes:
+            _table_indexes.move_to_end(fingerprint)
+            return _table_indexes[fingerprint]
+
+    build = _pending_builds.get(fingerprint)
+    if build is None:
+        build = asyncio.ensure_future(build_table_index_async(table, col_prompt, fingerprint))
+        _pending_builds[fingerprint] = build
+        build.add_done_callback(lambda _: _pending_builds.pop(fingerprint, None))
+
+    # Shield the shared build so that one cancelled question does not cancel it for the others
+    table_index = await asyncio.shield(build)
+    register_table_index(table_index)
+
+    return table_index
+
+
+def register_table_index(table_index):
+    """
+    Add a built table index to the shared registry, evicting the least recently used tables.
+
+    Args:
+        table_index: The TableIndex to register.
+    """
+    with _registry_lock:
+        _table_indexes[table_index.fingerprint] = table_index
+        _table_indexes.move_to_end(table_index.fingerprint)
+        _table_index_locks.pop(table_index.fingerprint, None)
+        # Evict the least recently used tables to bound memory
+        while len(_table_indexes) > MAX_CACHED_TABLES:
+            _table_indexes.popitem(last=False)
@@ -0,0 +1,145 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+
+
+def question_key(item, index=None):
+    """
+    Identify a question independently of its position in the dataset.
+
+    The dataset "ids" field alone is not unique (e.g. WikiTQ+ has different questions sharing an id), so it
+    is combined with a hash of the question text.
+
+    Parameters:
+    - item (dict): The dataset item, or a result record (with "question" instead of "statement").
+    - index (int): The line index of the question, used only if the item has no "ids" field.
+
+    Returns:
+    - str: The key of the question.
+    """
+    ids = item.get("ids")
+    if ids is None:
+        return f"line:{index}"
+    question = item.get("statement", item.get("question", ""))
+    return f"{ids}#{hashlib.sha256(question.encode('utf-8')).hexdigest()[:16]}"
+
+
+class Checkpoint:
+    """
+    A manifest of the questions completed in a result file, with the byte range of each result line.
+
+    The manifest is a SQLite file next to the result file. On open, only the part of the result file written
+    after the last recorded result is scanned: complete lines are added to the manifest and a torn last line
+    (from a crash in the middle of a write) is truncated, so resuming does not depend on the result file size.
+    """
+
+    def __init__(self, result_file_path, path=None):
+        """
+        Parameters:
+        - result_file_path (str): Path of the JSONL result file.
+        - path (str): Path of the manifest, default is the result file path + ".ckpt.sqlite".
+        """
+        self.result_file_path = result_file_path
+        self.path = path or result_file_path + ".ckpt.sqlite"
+        self.lock = threading.Lock()
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS completed (key TEXT PRIMARY KEY, offset INTEGER, length INTEGER)"
+        )
+        self.connection.commit()
+
+        self.end = self.connection.execute("SELECT COALESCE(MAX(offset + length), 0) FROM completed").fetchone()[0]
+        self.recover()
+
+    def recover(self):
+        """
+        Bring the manifest and the result file back in sync after a crash or an interrupted run.
+        """
+        size = os.path.getsize(self.result_file_path) if os.path.exists(self.result_file_path) else 0
+
+        if size < self.end:
+            # The result file was replaced or truncated behind our back, index it again from the start
+            print(f"{self.result_file_path} is shorter than its checkpoint, rebuilding the checkpoint.")
+            with self.lock:
+                self.connection.execute("DELETE FROM completed")
+                self.connection.commit()
+            self.end = 0
+
+        if size > self.end:
+            self._scan_tail(size)
+
+    def _scan_tail(self, size):
+        # Index the complete lines written after the last recorded result, and cut a torn last line
+        entries = []
+        offset = self.end
+        with open(self.result_file_path, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    record = json.loads(line)
+                    entries.append((question_key(record, record.get("index")), offset, len(line)))
+                except (ValueError, AttributeError):
+                    print(f"Skipping an unreadable result line at byte {offset} of {self.result_file_path}.")
+                offset += len(line)
+
+        with self.lock:
+            self.connection.executemany("INSERT OR REPLACE INTO completed (key, offset, length) VALUES (?, ?, ?)", entries)
+            self.connection.commit()
+
+        if offset < size:
+            print(f"Truncating a partially written result at byte {offset} of {self.result_file_path}.")
+            with open(self.result_file_path, 'r+b') as f:
+                f.truncate(offset)
+        self.end = offset
+
+    def __contains__(self, key):
+        with self.lock:
+            return self.connection.execute("SELECT 1 FROM completed WHERE key = ?", (key,)).fetchone() is not None
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM completed").fetchone()[0]
+
+    def is_completed(self, item, index):
+        """
+        Check whether a dataset question already has a result.
+
+        Parameters:
+        - item (dict): The dataset item.
+        - index (int): The line index of the question.
+
+        Returns:
+        - bool: True if the question was completed; results written before records had an "ids" field are matched by line index.
+        """
+        return question_key(item, index) in self or f"line:{index}" in self
+
+    def write(self, f, record):
+        """
+        Append a result record to the result file and record it as completed once it is flushed.
+
+        Parameters:
+        - f (file): The result file, opened for appending in text mode with UTF-8 encoding.
+        - record (dict): The result record.
+        """
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        f.write(line)
+        f.flush()
+
+        length = len(line.encode('utf-8'))
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO completed (key, offset, length) VALUES (?, ?, ?)",
+                (question_key(record, record.get("index")), self.end, length)
+            )
+            self.connection.commit()
+            self.end += length
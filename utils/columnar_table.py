@@ -0,0 +1,224 @@
+import hashlib
+import json
+import sys
+
+
+def _intern(cell):
+    # Repeated cell values (e.g. years, countries, "-") share one string object
+    return sys.intern(cell) if type(cell) is str else cell
+
+
+class _RowLabels:
+    """
+    The virtual "row index" column of an indexed table: "row 1", "row 2", ... generated on access instead of stored.
+    """
+
+    __slots__ = ("num_rows",)
+
+    def __init__(self, num_rows):
+        self.num_rows = num_rows
+
+    def __len__(self):
+        return self.num_rows
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [f"row {i + 1}" for i in range(*position.indices(self.num_rows))]
+        if position < 0:
+            position += self.num_rows
+        if not 0 <= position < self.num_rows:
+            raise IndexError("row index out of range")
+        return f"row {position + 1}"
+
+    def __iter__(self):
+        return (f"row {i + 1}" for i in range(self.num_rows))
+
+
+class ColumnarTable:
+    """
+    A read-only table stored column by column, with interned cells.
+
+    Deriving a table with a cleaned header (with_header) or a leading "row index" column (with_row_index)
+    shares the columns instead of copying the rows, and the row index column is virtual. Subtables are
+    extracted by row and column positions (select), and rows are iterated without copying (iter_rows).
+
+    The table also behaves like the list of lists (rows) it replaces: table[0] is the header, table[i]
+    the i-th data row and table[1:] the data rows, each materialized as a list on access. Tables with
+    rows of different lengths keep them, so that code indexing past the end of a short row still fails
+    as it did on lists.
+    """
+
+    __slots__ = ("header", "columns", "num_rows", "row_lengths", "_json")
+
+    def __init__(self, header, columns, num_rows, row_lengths=None):
+        """
+        Parameters:
+        - header (tuple): The column names.
+        - columns (list): One sequence of num_rows cells per column, shorter rows padded with None.
+        - num_rows (int): The number of data rows (excluding the header).
+        - row_lengths (list): The length of each data row if the rows are not all as wide as the table, else None.
+        """
+        self.header = header
+        self.columns = columns
+        self.num_rows = num_rows
+        self.row_lengths = row_lengths
+        self._json = None
+
+    @classmethod
+    def from_rows(cls, table):
+        """
+        Build a columnar table from a list of lists (rows), the header row first.
+
+        Parameters:
+        - table (list): The table as a list of lists (rows).
+
+        Returns:
+        - ColumnarTable: The same table, stored by column.
+        """
+        if isinstance(table, ColumnarTable):
+            return table
+
+        header = tuple(table[0])
+        rows = table[1:]
+        width = max([len(header)] + [len(row) for row in rows])
+
+        row_lengths = None
+        if any(len(row) != width for row in rows):
+            row_lengths = [len(row) for row in rows]
+            rows = [list(row) + [None] * (width - len(row)) for row in rows]
+
+        if rows:
+            columns = [tuple(map(_intern, column)) for column in zip(*rows)]
+        else:
+            columns = [() for _ in range(width)]
+        return cls(header, columns, len(rows), row_lengths)
+
+    def with_header(self, header):
+        """
+        Get the same table with another header, sharing the columns.
+
+        Parameters:
+        - header (list): The new column names.
+
+        Returns:
+        - ColumnarTable: The table with the new header.
+        """
+        return ColumnarTable(tuple(header), self.columns, self.num_rows, self.row_lengths)
+
+    def with_row_index(self):
+        """
+        Get the same table with a leading "row index" column numbering the rows ("row 1", "row 2", ...), sharing the columns.
+
+        Returns:
+        - ColumnarTable: The indexed table.
+        """
+        row_lengths = [length + 1 for length in self.row_lengths] if self.row_lengths is not None else None
+        return ColumnarTable(("row index",) + self.header, [_RowLabels(self.num_rows)] + self.columns, self.num_rows, row_lengths)
+
+    @property
+    def width(self):
+        """The number of columns."""
+        return len(self.columns)
+
+    def column(self, j):
+        """
+        Parameters:
+        - j (int): The position of the column.
+
+        Returns:
+        - sequence: The cells of the column, one per data row.
+        """
+        return self.columns[j]
+
+    def row(self, position):
+        """
+        Parameters:
+        - position (int): The position of the data row (zero-based, excluding the header).
+
+        Returns:
+        - list: The cells of the row.
+        """
+        row = [column[position] for column in self.columns]
+        if self.row_lengths is not None:
+            del row[self.row_lengths[position]:]
+        return row
+
+    def iter_rows(self):
+        """
+        Returns:
+        - iterator: The data rows as tuples (lists if the rows have different lengths), in table order.
+        """
+        if self.row_lengths is None:
+            return zip(*self.columns) if self.columns else iter(() for _ in range(self.num_rows))
+        return (self.row(position) for position in range(self.num_rows))
+
+    def select(self, row_ids, col_ids):
+        """
+        Extract a subtable by positions, as a list of lists.
+
+        Parameters:
+        - row_ids (list): The rows to keep, in list-of-lists coordinates (0 is the header, i the i-th data row).
+        - col_ids (list): The positions of the columns to keep.
+
+        Returns:
+        - list: The selected rows, each restricted to the selected columns.
+        """
+        if self.row_lengths is not None:
+            return [[self[i][j] for j in col_ids] for i in row_ids]
+
+        header = self.header
+        columns = [self.columns[j] for j in col_ids]
+        return [
+            [header[j] for j in col_ids] if i == 0 else [column[i - 1] for column in columns]
+            for i in row_ids
+        ]
+
+    def to_rows(self):
+        """
+        Returns:
+        - list: The table as a list of lists (rows), the header row first.
+        """
+        return [list(self.header)] + [list(row) for row in self.iter_rows()]
+
+    def to_json(self):
+        """
+        Returns:
+        - str: The JSON serialization of the rows (as json.dumps of to_rows), computed once.
+        """
+        if self._json is None:
+            self._json = json.dumps(self.to_rows(), ensure_ascii=False)
+        return self._json
+
+    @property
+    def fingerprint(self):
+        """The content fingerprint of the table, identical to the one of its rows (see utils.processing.table_fingerprint)."""
+        return hashlib.sha256(self.to_json().encode('utf-8')).hexdigest()
+
+    def __len__(self):
+        return self.num_rows + 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return self.to_rows()[i]
+        if i < 0:
+            i += len(self)
+        if i == 0:
+            return list(self.header)
+        if not 0 < i <= self.num_rows:
+            raise IndexError("table row index out of range")
+        return self.row(i - 1)
+
+    def __iter__(self):
+        yield list(self.header)
+        for row in self.iter_rows():
+            yield list(row)
+
+    def __eq__(self, other):
+        if isinstance(other, ColumnarTable):
+            other = other.to_rows()
+        return self.to_rows() == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"ColumnarTable({self.num_rows} rows x {self.width} columns)"
@@ -0,0 +1,53 @@
+from concurrent.futures import wait, FIRST_COMPLETED
+
+
+def iter_jsonl(path, skip_indices=None):
+    """
+    Read a JSONL dataset lazily, one line at a time.
+
+    Parameters:
+    - path (str): Path of the dataset file.
+    - skip_indices (set): Line indices to skip, e.g. questions already processed; default is None.
+
+    Returns:
+    - generator: (index, line) pairs, where index is the zero-based line number. Blank lines are skipped.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        for index, line in enumerate(f):
+            if skip_indices and index in skip_indices:
+                continue
+            if not line.strip():
+                continue
+            yield index, line
+
+
+def bounded_map(executor, fn, items, max_in_flight):
+    """
+    Submit fn(*item) for each item to an executor, with at most max_in_flight calls pending at any time.
+
+    Items are only pulled from the iterable when there is room, so that a lazily read dataset is never
+    materialized in memory.
+
+    Parameters:
+    - executor (concurrent.futures.Executor): The executor running the calls.
+    - fn (callable): The function to call.
+    - items (iterable): The argument tuples of the calls.
+    - max_in_flight (int): The maximum number of submitted calls whose result has not been yielded yet.
+
+    Returns:
+    - generator: The results of the calls, in completion order.
+    """
+    in_flight = set()
+    for item in items:
+        # Back-pressure: wait for a call to finish before submitting a new one
+        if len(in_flight) >= max_in_flight:
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+        in_flight.add(executor.submit(fn, *item))
+
+    while in_flight:
+        done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+        for future in done:
+            yield future.result()
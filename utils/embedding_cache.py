@@ -0,0 +1,110 @@
+import contextvars
+import hashlib
+import numpy as np
+from utils.sqlite_cache import SQLiteCache
+from utils.tracing import increment
+
+# The process-wide embedding cache, disabled until configure_embedding_cache is called
+_embedding_cache = None
+
+# Hit/miss counters of the current question (each worker thread or task has its own)
+_cache_stats = contextvars.ContextVar("embedding_cache_stats", default=None)
+
+
+def configure_embedding_cache(path, max_entries=None):
+    """
+    Enable the persistent embedding cache for this process.
+
+    Parameters:
+    - path (str): Path of the SQLite file storing the embeddings.
+    - max_entries (int): Maximum number of embeddings to keep, None for unbounded.
+    """
+    global _embedding_cache
+    _embedding_cache = SQLiteCache(path, max_entries=max_entries)
+
+
+def embedding_cache_key(text, model):
+    """
+    Build the content-addressed cache key of a text embedded with a model.
+
+    Parameters:
+    - text (str): The embedded text.
+    - model (str): The embedding model.
+
+    Returns:
+    - str: The cache key.
+    """
+    return f"{model}:{hashlib.sha256(text.encode('utf-8')).hexdigest()}"
+
+
+def reset_embedding_cache_stats():
+    """
+    Start a fresh set of hit/miss counters for the current question.
+    """
+    _cache_stats.set({"hits": 0, "misses": 0})
+
+
+def get_embedding_cache_stats():
+    """
+    Get the hit/miss counters of the current question.
+
+    Returns:
+    - dict: The number of cache hits and misses since the last reset.
+    """
+    stats = _cache_stats.get()
+    return dict(stats) if stats is not None else {"hits": 0, "misses": 0}
+
+
+def _count(hits, misses):
+    # The per-question counters and the process-wide metrics count the same lookups
+    increment("embedding_cache_hits", hits)
+    increment("embedding_cache_misses", misses)
+    stats = _cache_stats.get()
+    if stats is not None:
+        stats["hits"] += hits
+        stats["misses"] += misses
+
+
+def lookup_embeddings(texts, model):
+    """
+    Look up cached embeddings for a list of texts.
+
+    Parameters:
+    - texts (list): The texts to look up.
+    - model (str): The embedding model.
+
+    Returns:
+    - list: The cached embedding vectors in input order, with None for texts that are not cached.
+    """
+    if _embedding_cache is None:
+        return [None] * len(texts)
+
+    keys = [embedding_cache_key(text, model) for text in texts]
+    found = _embedding_cache.get_many(keys)
+    embeddings = [
+        np.frombuffer(found[key], dtype=np.float32).tolist() if key in found else None
+        for key in keys
+    ]
+
+    hits = sum(embedding is not None for embedding in embeddings)
+    _count(hits, len(texts) - hits)
+    return embeddings
+
+
+def store_embeddings(texts, embeddings, model):
+    """
+    Store embeddings in the cache, skipping texts that could not be embedded.
+
+    Parameters:
+    - texts (list): The embedded texts.
+    - embeddings (list): The embedding vectors, aligned with texts.
+    - model (str): The embedding model.
+    """
+    if _embedding_cache is None:
+        return
+
+    _embedding_cache.set_many({
+        embedding_cache_key(text, model): np.asarray(embedding, dtype=np.float32).tobytes()
+        for text, embedding in zip(texts, embeddings)
+        if embedding is not None
+    })
@@ -0,0 +1,121 @@
+import math
+import re
+from collections import Counter, defaultdict
+from utils.processing import iter_data_rows
+
+
+def tokenize_question(question):
+    """
+    Split a question into lowercase words, ignoring trailing punctuation.
+
+    Parameters:
+    - question (str): The question.
+
+    Returns:
+    - list: The words of the question.
+    """
+    question_cleaned = re.sub(r'[^\w\s]$', '', question.strip()).lower()
+    return [word for word in re.split(r'\W+', question_cleaned) if word]
+
+
+def tokenize_cell(cell):
+    """
+    Split a table cell into the lowercase words used for string matching.
+
+    Only words longer than 3 characters or made of digits are kept.
+
+    Parameters:
+    - cell: The cell content.
+
+    Returns:
+    - list: The words of the cell.
+    """
+    return [
+        word for word in re.split(r'\W+', str(cell).lower())
+        if (len(word) > 3 or word.isdigit()) and word
+    ]
+
+
+# Whether string matches are ranked by BM25, set by configure_string_match
+_string_match_config = {"rank_by_bm25": False}
+
+
+def configure_string_match(rank_by_bm25=False):
+    """
+    Choose whether string-matched rows are returned ranked by BM25 score.
+
+    Parameters:
+    - rank_by_bm25 (bool): Rank matches by BM25 score instead of returning them unordered.
+    """
+    _string_match_config["rank_by_bm25"] = rank_by_bm25
+
+
+class InvertedIndex:
+    """
+    A per-table inverted index from cell words to the rows containing them.
+
+    Built once per table, so that matching a question costs time proportional to the question length.
+    """
+
+    def __init__(self, table, k1=1.5, b=0.75):
+        """
+        Parameters:
+        - table (list or ColumnarTable): The table as a list of lists (rows), including the header row, or a columnar table.
+        - k1 (float): The BM25 term frequency saturation, default is 1.5.
+        - b (float): The BM25 length normalization, default is 0.75.
+        """
+        self.k1 = k1
+        self.b = b
+
+        # word -> {row index (zero-based, excluding the header): term frequency}
+        self.postings = defaultdict(dict)
+        self.row_lengths = []
+        for row_index, row in enumerate(iter_data_rows(table)):
+            counts = Counter(word for cell in row for word in tokenize_cell(cell))
+            for word, count in counts.items():
+                self.postings[word][row_index] = count
+            self.row_lengths.append(sum(counts.values()))
+
+        self.num_rows = len(self.row_lengths)
+        self.average_length = sum(self.row_lengths) / self.num_rows if self.num_rows else 0.0
+
+    def match(self, question):
+        """
+        Find the rows sharing at least one word with the question.
+
+        Parameters:
+        - question (str): The question.
+
+        Returns:
+        - list: The matching row indices, ranked by BM25 score if configured, in table (ascending) order otherwise
+          (the order the original table scan produced).
+        """
+        if _string_match_config["rank_by_bm25"]:
+            return [row_index for row_index, _ in self.bm25(question)]
+
+        rows = set()
+        for word in set(tokenize_question(question)):
+            rows.update(self.postings.get(word, ()))
+        return sorted(rows)
+
+    def bm25(self, question):
+        """
+        Score the rows matching the question with BM25.
+
+        Parameters:
+        - question (str): The question.
+
+        Returns:
+        - list: (row index, score) pairs of the matching rows, in descending order of score.
+        """
+        scores = defaultdict(float)
+        for word in set(tokenize_question(question)):
+            posting = self.postings.get(word)
+            if not posting:
+                continue
+            idf = math.log(1 + (self.num_rows - len(posting) + 0.5) / (len(posting) + 0.5))
+            for row_index, frequency in posting.items():
+                length_norm = 1 - self.b + self.b * self.row_lengths[row_index] / (self.average_length or 1)
+                scores[row_index] += idf * frequency * (self.k1 + 1) / (frequency + self.k1 * length_norm)
+
+        return sorted(scores.items(), key=lambda item: (-item[1], item[0]))
@@ -0,0 +1,185 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from utils.sqlite_cache import SQLiteCache
+from utils.columnar_table import ColumnarTable
+
+
+class MemoCache:
+    """
+    A memoization cache with a bounded in-memory LRU in front of an optional persistent SQLite store.
+
+    Values must be JSON serializable. The cache can be shared by all threads of a run.
+    """
+
+    def __init__(self, max_memory_entries=4096, store=None):
+        """
+        Parameters:
+        - max_memory_entries (int): Maximum number of values kept in memory, default is 4096.
+        - store (SQLiteCache): The persistent backing store, None to keep values in memory only.
+        """
+        self.max_memory_entries = max_memory_entries
+        self.store = store
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """
+        Look up a memoized value, first in memory and then in the persistent store.
+
+        Parameters:
+        - key (str): The key to look up.
+
+        Returns:
+        - The memoized value, or None if the key has not been memoized.
+        """
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                self.hits += 1
+                return self.memory[key]
+
+        value = None
+        if self.store is not None:
+            stored = self.store.get(key)
+            if stored is not None:
+                value = json.loads(stored)
+
+        with self.lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._remember(key, value)
+        return value
+
+    def set(self, key, value):
+        """
+        Memoize a value in memory and in the persistent store.
+
+        Parameters:
+        - key (str): The key to store.
+        - value: The JSON serializable value to store.
+        """
+        with self.lock:
+            self._remember(key, value)
+        if self.store is not None:
+            self.store.set(key, json.dumps(value, ensure_ascii=False).encode('utf-8'))
+
+    def _remember(self, key, value):
+        self.memory[key] = value
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_memory_entries:
+            self.memory.popitem(last=False)
+
+    def stats(self):
+        """
+        Returns:
+        - dict: The number of hits and misses so far.
+        """
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+
+class PassThroughCache:
+    """
+    The cache of a name that has not been configured: nothing is memoized, so every lookup misses.
+    """
+
+    def get(self, key):
+        """
+        Parameters:
+        - key (str): The key to look up.
+
+        Returns:
+        - None, the value is always computed again.
+        """
+        return None
+
+    def set(self, key, value):
+        """
+        Discard a value.
+
+        Parameters:
+        - key (str): The key to store.
+        - value: The value to store.
+        """
+
+    def stats(self):
+        """
+        Returns:
+        - dict: The number of hits and misses so far (always zero, lookups are not counted).
+        """
+        return {"hits": 0, "misses": 0}
+
+
+# Named caches shared by the whole process
+_memo_caches = {}
+_memo_caches_lock = threading.Lock()
+_pass_through_cache = PassThroughCache()
+
+
+def get_memo_cache(name):
+    """
+    Get the shared memoization cache with the given name.
+
+    Only the caches enabled by configure_memo_cache memoize values: the cache of any other name
+    is a pass-through, so that e.g. sampled LLM outputs are not silently reused by default.
+
+    Parameters:
+    - name (str): The name of the cache, e.g. "schema_linking".
+
+    Returns:
+    - MemoCache: The shared cache, or a PassThroughCache if the name has not been configured.
+    """
+    with _memo_caches_lock:
+        return _memo_caches.get(name, _pass_through_cache)
+
+
+def configure_memo_cache(name, path=None, max_entries=None, max_memory_entries=4096):
+    """
+    Enable (or replace) the shared memoization cache with the given name, optionally backed by a SQLite file.
+
+    Parameters:
+    - name (str): The name of the cache.
+    - path (str): Path of the SQLite file, None to keep values in memory only.
+    - max_entries (int): Maximum number of persisted values, None for unbounded.
+    - max_memory_entries (int): Maximum number of values kept in memory, default is 4096.
+    """
+    store = SQLiteCache(path, max_entries=max_entries) if path else None
+    with _memo_caches_lock:
+        _memo_caches[name] = MemoCache(max_memory_entries=max_memory_entries, store=store)
+
+
+def disable_memo_cache(name):
+    """
+    Stop memoizing the values of the given name: get_memo_cache returns a pass-through afterwards.
+
+    Parameters:
+    - name (str): The name of the cache.
+    """
+    with _memo_caches_lock:
+        _memo_caches.pop(name, None)
+
+
+def memo_key(*parts):
+    """
+    Build a memoization key from JSON serializable parts.
+
+    Parameters:
+    - parts: The values identifying the memoized computation.
+
+    Returns:
+    - str: A hex digest of the parts.
+    """
+    return hashlib.sha256(json.dumps(parts, ensure_ascii=False, default=_rows_of).encode('utf-8')).hexdigest()
+
+
+def _rows_of(value):
+    # Columnar tables are keyed by their rows, so that keys match those of the lists of lists they replace
+    if isinstance(value, ColumnarTable):
+        return value.to_rows()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
@@ -0,0 +1,200 @@
+import asyncio
+import csv
+import hashlib
+import json
+import re
+import time
+import types
+import numpy as np
+
+
+class MockBackend:
+    """
+    A local, deterministic stand-in for the OpenAI chat and embedding endpoints.
+
+    Chat responses are derived from the prompt templates of this repository: column and row templates
+    matching the table header, valid solution plans, schema-linking rewrites and short answers. Embeddings
+    are hashed bag-of-words vectors, so that texts sharing words are similar. Every response only depends
+    on the request, and each request sleeps for a configurable latency to mimic the network.
+    """
+
+    def __init__(self, chat_latency=0.0, embedding_latency=0.0, embedding_dim=1536):
+        """
+        Parameters:
+        - chat_latency (float): Seconds spent on each chat completion request, default is 0.
+        - embedding_latency (float): Seconds spent on each embedding request, default is 0.
+        - embedding_dim (int): The dimension of the embeddings, default is 1536 (as text-embedding-3-small).
+        """
+        self.chat_latency = chat_latency
+        self.embedding_latency = embedding_latency
+        self.embedding_dim = embedding_dim
+
+    def complete(self, model, messages, temperature=None):
+        """
+        Build the response object of a chat completion request.
+
+        Parameters:
+        - model (str): The requested model.
+        - messages (list): The messages of the request; the last one holds the prompt.
+        - temperature (float): Ignored, responses are deterministic.
+
+        Returns:
+        - A response object shaped like the OpenAI client's, with choices and usage.
+        """
+        prompt = messages[-1]["content"]
+        content = self.respond(prompt)
+        usage = types.SimpleNamespace(total_tokens=(len(prompt) + len(content)) // 4 + 1)
+        message = types.SimpleNamespace(role="assistant", content=content)
+        return types.SimpleNamespace(model=model, choices=[types.SimpleNamespace(index=0, message=message)], usage=usage)
+
+    def embed(self, input, model):
+        """
+        Build the response object of an embedding request.
+
+        Parameters:
+        - input (str or list): The text or texts to embed.
+        - model (str): The requested model.
+
+        Returns:
+        - A response object shaped like the OpenAI client's, with one data item per text and usage.
+        """
+        texts = [input] if isinstance(input, str) else list(input)
+        if any(not text for text in texts):
+            raise ValueError("Error code: 400 - input cannot be an empty string")
+
+        data = [types.SimpleNamespace(index=i, embedding=self.embedding(text)) for i, text in enumerate(texts)]
+        usage = types.SimpleNamespace(total_tokens=sum(len(text) // 4 + 1 for text in texts))
+        return types.SimpleNamespace(model=model, data=data, usage=usage)
+
+    def embedding(self, text):
+        """
+        Compute the pseudo-embedding of a text by hashing its words into signed buckets.
+
+        Parameters:
+        - text (str): The text to embed.
+
+        Returns:
+        - list: A unit-length vector of embedding_dim floats.
+        """
+        vector = np.zeros(self.embedding_dim, dtype=np.float32)
+        for word in re.findall(r'\w+', text.lower()) or [text]:
+            digest = hashlib.blake2b(word.encode('utf-8'), digest_size=8).digest()
+            bucket = int.from_bytes(digest[:4], 'little') % self.embedding_dim
+            vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def respond(self, prompt):
+        """
+        Generate the response to a prompt, recognizing the prompt templates by their last line.
+
+        Parameters:
+        - prompt (str): The filled prompt.
+
+        Returns:
+        - str: The response text.
+        """
+        prompt = prompt.rstrip()
+        if prompt.endswith("### Output"):
+            header = self._last_header(prompt)
+            # Unnamed columns still need a name for the template to validate
+            return "\n".join(
+                f"Col{i + 1} ## {name or f'column {i + 1}'}: The {name.replace('_', ' ') or 'value'} of the row." for i, name in enumerate(header)
+            )
+
+        if prompt.endswith("### Template"):
+            header = self._last_header(prompt)
+            return "This row has " + ", ".join(f"{name} {{{name}}}" for name in header) + "."
+
+        if prompt.endswith("Plan:"):
+            return json.dumps(self._plan(self._last_field(prompt, "Question:")))
+
+        if prompt.endswith("### Your Generation"):
+            return self._last_field(prompt, "1. Question:")
+
+        if prompt.endswith("Answer:"):
+            return self._answer(prompt)
+
+        return "OK"
+
+    def _last_header(self, prompt):
+        header_line = prompt.rsplit("Header:", 1)[-1].split("\n", 1)[0]
+        return [name.strip() for name in header_line.strip().strip("|").split("|")]
+
+    def _last_field(self, prompt, label):
+        return prompt.rsplit(label, 1)[-1].split("\n", 1)[0].strip()
+
+    def _plan(self, question):
+        # One question in ten is planned as a single reasoning stage, the others get one to three retrieval stages
+        seed = int(hashlib.sha256(question.encode('utf-8')).hexdigest(), 16)
+        if seed % 10 == 0:
+            return [{"Stage": 1, "Sub-Level-Question": question, "Action": "Reasoning", "Top k": "all"}]
+
+        num_retrievals = 1 + seed % 3
+        plan = [
+            {"Stage": i + 1, "Sub-Level-Question": question, "Action": "Retrieval", "Top k": str([3, 5, 10][(seed >> i) % 3])}
+            for i in range(num_retrievals)
+        ]
+        plan.append({"Stage": num_retrievals + 1, "Sub-Level-Question": question, "Action": "Reasoning", "Top k": "all"})
+        return plan
+
+    def _answer(self, prompt):
+        # Answer with the last column of the first table row after the last "Relevant table:" (in markdown, CSV or TSV)
+        table_text = prompt.rsplit("Relevant table:", 1)[-1].rsplit("Answer:", 1)[0].strip("\n")
+        table_lines = [line for line in table_text.splitlines() if line.startswith("|")]
+        if table_lines:
+            if len(table_lines) < 3:
+                return "0"
+            return table_lines[2].strip().strip("|").split("|")[-1].strip()
+
+        table_lines = [line for line in table_text.splitlines() if line.strip()]
+        if len(table_lines) < 2:
+            return "0"
+        if "\t" in table_lines[0]:
+            return table_lines[1].split("\t")[-1].strip()
+        return next(csv.reader([table_lines[1]]))[-1].strip()
+
+
+class MockClient:
+    """
+    A synchronous client exposing the MockBackend through the chat.completions.create and embeddings.create
+    methods of the OpenAI client.
+    """
+
+    def __init__(self, backend):
+        """
+        Parameters:
+        - backend (MockBackend): The backend generating the responses.
+        """
+        def create_completion(model, messages, **kwargs):
+            time.sleep(backend.chat_latency)
+            return backend.complete(model, messages, kwargs.get("temperature"))
+
+        def create_embedding(input, model, **kwargs):
+            time.sleep(backend.embedding_latency)
+            return backend.embed(input, model)
+
+        self.chat = types.SimpleNamespace(completions=types.SimpleNamespace(create=create_completion))
+        self.embeddings = types.SimpleNamespace(create=create_embedding)
+
+
+class AsyncMockClient:
+    """
+    An asynchronous client exposing the MockBackend like the AsyncOpenAI client.
+    """
+
+    def __init__(self, backend):
+        """
+        Parameters:
+        - backend (MockBackend): The backend generating the responses.
+        """
+        async def create_completion(model, messages, **kwargs):
+            await asyncio.sleep(backend.chat_latency)
+            return backend.complete(model, messages, kwargs.get("temperature"))
+
+        async def create_embedding(input, model, **kwargs):
+            await asyncio.sleep(backend.embedding_latency)
+            return backend.embed(input, model)
+
+        self.chat = types.SimpleNamespace(completions=types.SimpleNamespace(create=create_completion))
+        self.embeddings = types.SimpleNamespace(create=create_embedding)
@@ -1,47 +1,129 @@
+import hashlib
+import json
 import random
 import re
-import copy
+import threading
+from collections import OrderedDict
+from utils.columnar_table import ColumnarTable
+
+# How table rows are sampled for the template and plan prompts, set by configure_table_sampling
+_sampling_config = {"seed": 0, "strategy": "random"}
+
+# Sampled row positions of recently seen tables, shared by all prompts built on the same table
+_sample_cache = OrderedDict()
+_sample_cache_lock = threading.Lock()
+MAX_CACHED_SAMPLES = 1024
+
+
+def configure_table_sampling(seed=0, strategy="random"):
+    """
+    Choose how table rows are sampled for the template and plan prompts.
+
+    Parameters:
+    - seed (int): The seed combined with the table content, default is 0.
+    - strategy (str): "random" (seeded random rows), "stratified" (one seeded random row per equal slice of the table),
+      or "diverse" (rows covering the most distinct cell values).
+    """
+    if strategy not in ("random", "stratified", "diverse"):
+        raise ValueError(f"Unknown sampling strategy: {strategy}")
+    _sampling_config.update(seed=seed, strategy=strategy)
+
+
+def table_fingerprint(table):
+    """
+    Compute a content fingerprint of a table, identical for identical tables.
+
+    Parameters:
+    - table (list or ColumnarTable): The input table as a list of lists (rows), or a columnar table.
+
+    Returns:
+    - str: A hex digest identifying the table content.
+    """
+    if isinstance(table, ColumnarTable):
+        return table.fingerprint
+    return hashlib.sha256(json.dumps(table, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+def _sample_positions(rows, num_samples, rng, strategy):
+    if strategy == "stratified":
+        # Split the rows into num_samples contiguous slices of (almost) equal size and pick one row in each
+        bounds = [len(rows) * i // num_samples for i in range(num_samples + 1)]
+        return [rng.randrange(bounds[i], bounds[i + 1]) for i in range(num_samples)]
+
+    if strategy == "diverse":
+        # Greedily pick the row adding the most (column, value) pairs not seen in the rows picked so far
+        seen = set()
+        positions = []
+        for _ in range(num_samples):
+            best_position, best_gain = None, -1
+            for position, row in enumerate(rows):
+                if position in positions:
+                    continue
+                gain = len({(j, str(cell)) for j, cell in enumerate(row)} - seen)
+                if gain > best_gain:
+                    best_position, best_gain = position, gain
+            positions.append(best_position)
+            seen.update((j, str(cell)) for j, cell in enumerate(rows[best_position]))
+        return positions
+
+    return rng.sample(range(len(rows)), num_samples)
+
 
 def sample_table_rows(table, num_samples=5):
     """
-    Randomly sample a specified number (num_samples) of rows from a 2D array representing a table.
+    Sample a specified number (num_samples) of rows from a 2D array representing a table.
+
+    The sample only depends on the table content and the configured seed and strategy, so every prompt built
+    on the same table sees the same rows, in every run. Tables with fewer rows are returned whole.
 
     Parameters:
     - table (list): The input table as a list of lists (rows).
     - num_samples (int): The number of rows to sample (default is 5).
 
     Returns:
-    - tuple: A tuple containing the header and the sampled rows.
+    - tuple: A tuple containing the header and the sampled rows, in table order.
     """
     # Extract the header (first row)
     header = table[0]
-    
-    # Sample the specified number of rows (excluding the header)
-    rows = random.sample(table[1:], num_samples)
-    
-    return header, rows
+    num_rows = len(table) - 1
+
+    if num_rows <= num_samples:
+        return header, list(table[1:])
+
+    seed, strategy = _sampling_config["seed"], _sampling_config["strategy"]
+    key = (table_fingerprint(table), num_samples, seed, strategy)
+
+    with _sample_cache_lock:
+        positions = _sample_cache.get(key)
+        if positions is not None:
+            _sample_cache.move_to_end(key)
+
+    if positions is None:
+        # Seed with the table content so that the sample does not depend on which tables were sampled before
+        rng = random.Random(f"{seed}:{key[0]}")
+        positions = sorted(_sample_positions(table[1:], num_samples, rng, strategy))
+        with _sample_cache_lock:
+            _sample_cache[key] = positions
+            while len(_sample_cache) > MAX_CACHED_SAMPLES:
+                _sample_cache.popitem(last=False)
 
+    # Only the sampled rows are materialized (columnar tables build each row on access)
+    return header, [table[position + 1] for position in positions]
 
-def list_to_markdown(header, rows):
+
+def iter_data_rows(table):
     """
-    Convert a table (header and rows) into a markdown-formatted table.
+    Iterate over the data rows of a table (excluding the header), without materializing the rows of a columnar table first.
 
     Parameters:
-    - header (list): The list of column names (header).
-    - rows (list): The list of rows to include in the table.
+    - table (list or ColumnarTable): The input table as a list of lists (rows), or a columnar table.
 
     Returns:
-    - str: A markdown-formatted string representing the table.
+    - iterable: The data rows, in table order.
     """
-    # Start the markdown table with the header
-    markdown_table = "| " + " | ".join(header) + " |\n"
-    # Add the separator row with dashes
-    markdown_table += "| " + " | ".join(["---"] * len(header)) + " |\n"
-    # Add each data row to the markdown table
-    for row in rows:
-        markdown_table += "| " + " | ".join(row) + " |\n"
-    
-    return markdown_table
+    if isinstance(table, ColumnarTable):
+        return table.iter_rows()
+    return table[1:]
 
 
 def clean_header(header):
@@ -73,17 +155,13 @@ def clean_table(table):
     Clean the entire table by cleaning the header and ensuring column names are valid.
 
     Parameters:
-    - table (list): The input table as a list of lists (rows).
+    - table (list or ColumnarTable): The input table as a list of lists (rows), or a columnar table.
 
     Returns:
-    - list: A cleaned version of the input table with cleaned headers.
+    - ColumnarTable: A cleaned version of the input table with cleaned headers, sharing its columns.
     """
-    table_copy = copy.deepcopy(table)
-    header = table_copy[0]
-    cleaned_header = clean_header(header)
-    cleaned_table = [cleaned_header] + table_copy[1:]
-    
-    return cleaned_table
+    columnar_table = ColumnarTable.from_rows(table)
+    return columnar_table.with_header(clean_header(columnar_table.header))
 
 
 def index_table(table):
@@ -91,15 +169,9 @@ def index_table(table):
     Add a row index to the table, creating a new "row index" column and numbering each row.
 
     Parameters:
-    - table (list): The input table as a list of lists (rows).
+    - table (list or ColumnarTable): The input table as a list of lists (rows), or a columnar table.
 
     Returns:
-    - list: A new table with a "row index" column added.
+    - ColumnarTable: A new table with a (virtual) "row index" column added, sharing the columns of the input table.
     """
-    table_copy = copy.deepcopy(table)
-    table_copy[0].insert(0, "row index")
-
-    for i in range(1, len(table_copy)):
-        table_copy[i].insert(0, f"row {i}")
-    
-    return table_copy
+    return ColumnarTable.from_rows(table).with_row_index()
@@ -0,0 +1,92 @@
+import contextlib
+import contextvars
+import threading
+import time
+
+# Stage timings and API usage of the current question (each worker thread or task has its own)
+_profile = contextvars.ContextVar("profile", default=None)
+
+# Threads started by a question (e.g. concurrent schema linking) update its profile through a copied context
+_profile_lock = threading.Lock()
+
+
+def reset_profile():
+    """
+    Start a fresh profile for the current question.
+    """
+    _profile.set({"stages": {}, "api_calls": {}, "tokens": {}})
+
+
+def get_profile():
+    """
+    Get the profile of the current question.
+
+    Returns:
+    - dict: The wall time in seconds spent in each stage, and the number of API requests and tokens per endpoint.
+    """
+    profile = _profile.get()
+    if profile is None:
+        return {"stages": {}, "api_calls": {}, "tokens": {}}
+    with _profile_lock:
+        return {key: dict(value) for key, value in profile.items()}
+
+
+@contextlib.contextmanager
+def profile_stage(name):
+    """
+    Add the wall time of the enclosed block to a stage of the current question.
+
+    Stages may nest (e.g. the question embeddings are part of the retrieval), each one reports its own wall time.
+    Works across awaits, since the profile follows the asyncio task.
+
+    Parameters:
+    - name (str): The name of the stage.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile = _profile.get()
+        if profile is not None:
+            elapsed = time.perf_counter() - start
+            with _profile_lock:
+                profile["stages"][name] = profile["stages"].get(name, 0.0) + elapsed
+
+
+def record_api_call(endpoint, response=None):
+    """
+    Count an API request of the current question, with the tokens reported in the response usage.
+
+    Parameters:
+    - endpoint (str): "chat" or "embedding".
+    - response: The API response, None if the request failed.
+    """
+    profile = _profile.get()
+    if profile is None:
+        return
+
+    usage = getattr(response, "usage", None)
+    with _profile_lock:
+        profile["api_calls"][endpoint] = profile["api_calls"].get(endpoint, 0) + 1
+        for field in ["prompt_tokens", "completion_tokens", "total_tokens"]:
+            tokens = getattr(usage, field, None)
+            if tokens is not None:
+                key = f"{endpoint}_{field}"
+                profile["tokens"][key] = profile["tokens"].get(key, 0) + tokens
+
+
+def run_in_context(executor, fn, items):
+    """
+    Map a function over items in a thread pool, each call running in a copy of the caller's context,
+    so that the calls update the profile of the calling question.
+
+    Parameters:
+    - executor (ThreadPoolExecutor): The thread pool.
+    - fn (callable): The function to apply to each item.
+    - items (list): The items.
+
+    Returns:
+    - list: The results in item order.
+    """
+    contexts = [contextvars.copy_context() for _ in items]
+    return list(executor.map(lambda context, item: context.run(fn, item), contexts, items))
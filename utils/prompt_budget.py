@@ -0,0 +1,152 @@
+import contextvars
+from utils.tokens import count_tokens, truncate_to_tokens
+from utils.table_serializer import format_header, format_row, serialize_rows, get_table_format
+
+# Prompt size limits, set by configure_prompt_budget (disabled by default)
+_prompt_budget_config = {"max_prompt_tokens": None, "max_cell_tokens": None, "model": "gpt-3.5-turbo"}
+
+# Packing counters of the current question (each worker thread or task has its own)
+_budget_stats = contextvars.ContextVar("prompt_budget_stats", default=None)
+
+
+def configure_prompt_budget(max_prompt_tokens=None, max_cell_tokens=None, model="gpt-3.5-turbo"):
+    """
+    Limit the size of the reasoning prompts by packing their tables into a token budget.
+
+    Parameters:
+    - max_prompt_tokens (int): The maximum number of tokens of a reasoning prompt, None for no limit.
+    - max_cell_tokens (int): The maximum number of tokens of a table cell, longer cells are truncated; None for no limit.
+    - model (str): The model whose tokenizer counts the tokens, default is "gpt-3.5-turbo".
+    """
+    if max_prompt_tokens is not None and max_prompt_tokens <= 0:
+        raise ValueError(f"The prompt budget must be positive, got {max_prompt_tokens}")
+    if max_cell_tokens is not None and max_cell_tokens <= 0:
+        raise ValueError(f"The cell budget must be positive, got {max_cell_tokens}")
+    _prompt_budget_config.update(max_prompt_tokens=max_prompt_tokens, max_cell_tokens=max_cell_tokens, model=model)
+
+
+def is_prompt_budget_enabled():
+    """
+    Check whether reasoning prompts are packed into a budget.
+
+    Returns:
+    - bool: True if a prompt or cell budget is configured.
+    """
+    return _prompt_budget_config["max_prompt_tokens"] is not None or _prompt_budget_config["max_cell_tokens"] is not None
+
+
+def get_table_token_budget(prompt_without_table):
+    """
+    Compute how many tokens are left for the table of a prompt.
+
+    Parameters:
+    - prompt_without_table (str): The prompt filled with everything but the table.
+
+    Returns:
+    - int: The number of tokens left for the table (at least 0), or None if prompts are not limited.
+    """
+    max_prompt_tokens = _prompt_budget_config["max_prompt_tokens"]
+    if max_prompt_tokens is None:
+        return None
+    return max(0, max_prompt_tokens - count_tokens(prompt_without_table, _prompt_budget_config["model"]))
+
+
+def reset_prompt_budget_stats():
+    """
+    Start a fresh set of packing counters for the current question.
+    """
+    _budget_stats.set({"table_tokens": 0, "dropped_rows": 0, "dropped_cols": 0, "truncated_cells": 0})
+
+
+def get_prompt_budget_stats():
+    """
+    Get the packing counters of the current question.
+
+    Returns:
+    - dict: The tokens of the packed table, and the rows, columns and cells dropped or truncated since the last reset.
+    """
+    stats = _budget_stats.get()
+    return dict(stats) if stats is not None else {"table_tokens": 0, "dropped_rows": 0, "dropped_cols": 0, "truncated_cells": 0}
+
+
+def _record(table_tokens, dropped_rows, dropped_cols, truncated_cells):
+    stats = _budget_stats.get()
+    if stats is None:
+        return
+    # A question may pack several tables (e.g. after a failed retrieval), report the last one's size
+    stats["table_tokens"] = table_tokens
+    stats["dropped_rows"] += dropped_rows
+    stats["dropped_cols"] += dropped_cols
+    stats["truncated_cells"] += truncated_cells
+
+
+def pack_table(table, max_tokens=None, row_priority=None):
+    """
+    Keep the most important rows and columns of a table that fit in a token budget, truncating long cells.
+
+    The header is always kept. Rows are added in priority order while the markdown table fits in the
+    budget; if not even the header and the first row fit, the last columns are dropped first. Tokens are
+    counted on the table serialized in the configured table format.
+
+    Parameters:
+    - table (list): The table as a list of lists (rows), including the header row.
+    - max_tokens (int): The maximum number of tokens of the serialized table, None for no limit.
+    - row_priority (list): Positions of the data rows (zero-based, excluding the header) from most to least
+      important, default is the table order. Rows missing from it are dropped.
+
+    Returns:
+    - tuple: The packed table in the original row order, the positions of the kept rows, and the number of kept columns.
+    """
+    model = _prompt_budget_config["model"]
+    table_format = get_table_format()
+    max_cell_tokens = _prompt_budget_config["max_cell_tokens"]
+
+    # Truncate long cells first, so that a single huge cell does not consume the whole budget
+    truncated_cells = 0
+    if max_cell_tokens is not None:
+        truncated_table = []
+        for row in table:
+            truncated_row = []
+            for cell in row:
+                cell, truncated = truncate_to_tokens(str(cell), max_cell_tokens, model)
+                truncated_row.append(cell)
+                truncated_cells += truncated
+            truncated_table.append(truncated_row)
+        table = truncated_table
+
+    header, rows = table[0], table[1:]
+    if row_priority is None:
+        row_priority = range(len(rows))
+    row_priority = list(dict.fromkeys(row_priority))
+
+    num_cols = len(header)
+    if max_tokens is None:
+        kept_rows = sorted(row_priority)
+    else:
+        # Drop the last (least relevant) columns until the header, the separator and the best row fit
+        def fixed_tokens(width):
+            lines = format_header(header[:width], table_format)
+            if row_priority:
+                lines += format_row(rows[row_priority[0]][:width], table_format)
+            return count_tokens(lines, model)
+
+        while num_cols > 1 and fixed_tokens(num_cols) > max_tokens:
+            num_cols -= 1
+
+        # Add rows in priority order while they fit
+        used_tokens = count_tokens(format_header(header[:num_cols], table_format), model)
+        kept_rows = []
+        for position in row_priority:
+            row_tokens = count_tokens(format_row(rows[position][:num_cols], table_format), model)
+            if used_tokens + row_tokens > max_tokens:
+                break
+            kept_rows.append(position)
+            used_tokens += row_tokens
+        kept_rows.sort()
+
+    packed_table = [header[:num_cols]] + [rows[position][:num_cols] for position in kept_rows]
+
+    table_tokens = count_tokens(serialize_rows(packed_table[0], packed_table[1:], table_format), model)
+    _record(table_tokens, len(rows) - len(kept_rows), len(header) - num_cols, truncated_cells)
+
+    return packed_table, kept_rows, num_cols
@@ -0,0 +1,24 @@
+import os
+import threading
+
+# Prompt templates loaded so far, keyed by absolute path
+_templates = {}
+_templates_lock = threading.Lock()
+
+
+def load_prompt(path):
+    """
+    Load a prompt template, reading each file from disk only once per process.
+
+    Parameters:
+    - path (str): Path of the prompt template file.
+
+    Returns:
+    - str: The content of the template.
+    """
+    key = os.path.abspath(path)
+    with _templates_lock:
+        if key not in _templates:
+            with open(path, "r") as f:
+                _templates[key] = f.read()
+        return _templates[key]
@@ -0,0 +1,100 @@
+from collections import defaultdict
+
+
+def reciprocal_rank_fusion(rankings, weights=None, k=60):
+    """
+    Fuse several rankings of the same items into one with (weighted) reciprocal rank fusion.
+
+    Each item scores sum(weight / (k + rank)) over the rankings it appears in, with ranks starting at 1.
+
+    Parameters:
+    - rankings (list): The rankings to fuse, each a list of items in descending order of relevance.
+    - weights (list): One weight per ranking, default is 1 for all of them.
+    - k (int): The rank smoothing constant, default is 60; larger values flatten the contribution of top ranks.
+
+    Returns:
+    - list: (item, score) pairs of all ranked items, in descending order of fused score.
+    """
+    if weights is None:
+        weights = [1.0] * len(rankings)
+
+    scores = defaultdict(float)
+    first_seen = {}
+    for ranking, weight in zip(rankings, weights):
+        # An item listed twice in the same ranking only counts at its best rank
+        for rank, item in enumerate(dict.fromkeys(ranking), start=1):
+            scores[item] += weight / (k + rank)
+            first_seen.setdefault(item, len(first_seen))
+
+    # Break ties by the order in which the items were first seen
+    return sorted(scores.items(), key=lambda entry: (-entry[1], first_seen[entry[0]]))
+
+
+def select_rows_within_budget(ranked_rows, num_rows, row_budget, neighbours=1):
+    """
+    Select the best ranked rows and their neighbours until the row budget is spent.
+
+    Parameters:
+    - ranked_rows (list): Row indices in descending order of relevance.
+    - num_rows (int): The number of rows of the table.
+    - row_budget (int): The maximum number of rows to select, None for no limit.
+    - neighbours (int): The number of previous and next rows added around each ranked row, default is 1.
+
+    Returns:
+    - list: The selected row indices, in table order.
+    """
+    selected = set()
+    for row_index in ranked_rows:
+        # The ranked row comes first, then its closest neighbours while there is room left
+        candidates = [row_index]
+        for offset in range(1, neighbours + 1):
+            candidates.extend([row_index - offset, row_index + offset])
+
+        for candidate in candidates:
+            if row_budget is not None and len(selected) >= row_budget:
+                return sorted(selected)
+            if 0 <= candidate < num_rows:
+                selected.add(candidate)
+
+    return sorted(selected)
+
+
+# Hybrid retrieval settings, set by configure_hybrid_retrieval
+_hybrid_retrieval_config = {
+    "enabled": False,
+    "row_budget": 30,
+    "rrf_k": 60,
+    "lexical_weight": 1.0,
+    "dense_weight": 1.0,
+    "neighbours": 1,
+}
+
+
+def configure_hybrid_retrieval(enabled=False, row_budget=30, rrf_k=60, lexical_weight=1.0, dense_weight=1.0, neighbours=1):
+    """
+    Choose whether the final sub-table is built from one fused lexical and dense ranking under a row budget.
+
+    Parameters:
+    - enabled (bool): Use the fused ranking instead of concatenating embedding and string-match rows.
+    - row_budget (int): The maximum number of table rows in the final sub-table (header excluded), None for no limit.
+    - rrf_k (int): The reciprocal rank fusion constant, default is 60.
+    - lexical_weight (float): The weight of the BM25 ranking of the question, default is 1.
+    - dense_weight (float): The weight of the embedding ranking of each plan stage, default is 1.
+    - neighbours (int): The number of previous and next rows added around each ranked row, default is 1.
+    """
+    if row_budget is not None and row_budget <= 0:
+        raise ValueError(f"The row budget must be positive, got {row_budget}")
+    _hybrid_retrieval_config.update(
+        enabled=enabled, row_budget=row_budget, rrf_k=rrf_k,
+        lexical_weight=lexical_weight, dense_weight=dense_weight, neighbours=neighbours
+    )
+
+
+def get_hybrid_retrieval_config():
+    """
+    Get the current hybrid retrieval settings.
+
+    Returns:
+    - dict: A copy of the settings set by configure_hybrid_retrieval.
+    """
+    return dict(_hybrid_retrieval_config)
@@ -0,0 +1,221 @@
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+
+
+class RateLimiter:
+    """
+    A client-side limiter enforcing requests-per-minute and tokens-per-minute budgets.
+
+    Both budgets are token buckets refilled continuously. One limiter is shared by all threads and
+    asyncio tasks of a run, so that a rate limit error seen by one worker pauses all of them.
+    """
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None):
+        """
+        Parameters:
+        - requests_per_minute (int): Request budget per minute, None for unlimited.
+        - tokens_per_minute (int): Token budget per minute, None for unlimited.
+        """
+        self.lock = threading.Lock()
+        self.set_limits(requests_per_minute, tokens_per_minute)
+
+        # Usage of the last minute and counters for utilization metrics
+        self.history = deque()
+        self.num_requests = 0
+        self.num_rate_limited = 0
+        self.total_wait_time = 0.0
+        self.paused_until = 0.0
+
+    def set_limits(self, requests_per_minute=None, tokens_per_minute=None):
+        """
+        Change the budgets and refill both buckets.
+
+        Parameters:
+        - requests_per_minute (int): Request budget per minute, None for unlimited.
+        - tokens_per_minute (int): Token budget per minute, None for unlimited.
+        """
+        with self.lock:
+            self.requests_per_minute = requests_per_minute
+            self.tokens_per_minute = tokens_per_minute
+            self.available_requests = float(requests_per_minute or 0)
+            self.available_tokens = float(tokens_per_minute or 0)
+            self.last_refill = time.monotonic()
+
+    def _refill(self, now):
+        elapsed = now - self.last_refill
+        self.last_refill = now
+        if self.requests_per_minute:
+            self.available_requests = min(self.requests_per_minute, self.available_requests + elapsed * self.requests_per_minute / 60)
+        if self.tokens_per_minute:
+            self.available_tokens = min(self.tokens_per_minute, self.available_tokens + elapsed * self.tokens_per_minute / 60)
+
+    def _reserve(self, tokens):
+        """Take one request and the given tokens from the buckets, or return how long to wait before trying again."""
+        with self.lock:
+            now = time.monotonic()
+            if now < self.paused_until:
+                return self.paused_until - now
+
+            self._refill(now)
+            # A single request larger than the whole budget only has to wait for a full bucket
+            if self.tokens_per_minute:
+                tokens = min(tokens, self.tokens_per_minute)
+
+            wait = 0.0
+            if self.requests_per_minute and self.available_requests < 1:
+                wait = max(wait, (1 - self.available_requests) * 60 / self.requests_per_minute)
+            if self.tokens_per_minute and self.available_tokens < tokens:
+                wait = max(wait, (tokens - self.available_tokens) * 60 / self.tokens_per_minute)
+            if wait > 0:
+                return wait
+
+            if self.requests_per_minute:
+                self.available_requests -= 1
+            if self.tokens_per_minute:
+                self.available_tokens -= tokens
+
+            self.num_requests += 1
+            self.history.append((now, tokens))
+            return 0.0
+
+    def acquire(self, tokens=0):
+        """
+        Block the calling thread until a request of the given size fits in the budgets.
+
+        Parameters:
+        - tokens (int): The estimated number of tokens of the request.
+        """
+        while True:
+            wait = self._reserve(tokens)
+            if wait <= 0:
+                return
+            with self.lock:
+                self.total_wait_time += wait
+            time.sleep(wait)
+
+    async def acquire_async(self, tokens=0):
+        """
+        Asynchronous version of acquire, yielding to the event loop while waiting.
+
+        Parameters:
+        - tokens (int): The estimated number of tokens of the request.
+        """
+        while True:
+            wait = self._reserve(tokens)
+            if wait <= 0:
+                return
+            with self.lock:
+                self.total_wait_time += wait
+            await asyncio.sleep(wait)
+
+    def record_usage(self, estimated_tokens, actual_tokens):
+        """
+        Correct the token bucket once the actual usage of a request is known.
+
+        Parameters:
+        - estimated_tokens (int): The number of tokens reserved by acquire.
+        - actual_tokens (int): The number of tokens reported by the API.
+        """
+        with self.lock:
+            if self.tokens_per_minute:
+                self.available_tokens -= actual_tokens - estimated_tokens
+            if self.history:
+                # Attribute the correction to the most recent request, close enough for metrics
+                timestamp, tokens = self.history[-1]
+                self.history[-1] = (timestamp, tokens + actual_tokens - estimated_tokens)
+
+    def pause(self, seconds):
+        """
+        Stop all requests through this limiter for a while, after the API reported a rate limit error.
+
+        Parameters:
+        - seconds (float): How long to pause.
+        """
+        with self.lock:
+            self.num_rate_limited += 1
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def utilization(self):
+        """
+        Report the usage of the last minute relative to the budgets.
+
+        Returns:
+        - dict: Requests and tokens used in the last minute, their share of the budgets, and cumulative counters.
+        """
+        with self.lock:
+            now = time.monotonic()
+            while self.history and self.history[0][0] < now - 60:
+                self.history.popleft()
+            requests_last_minute = len(self.history)
+            tokens_last_minute = sum(tokens for _, tokens in self.history)
+
+            return {
+                "requests_last_minute": requests_last_minute,
+                "tokens_last_minute": tokens_last_minute,
+                "request_utilization": requests_last_minute / self.requests_per_minute if self.requests_per_minute else None,
+                "token_utilization": tokens_last_minute / self.tokens_per_minute if self.tokens_per_minute else None,
+                "total_requests": self.num_requests,
+                "rate_limited": self.num_rate_limited,
+                "total_wait_time": round(self.total_wait_time, 3),
+            }
+
+
+def is_rate_limit_error(error):
+    """
+    Check whether an API error is a rate limit (HTTP 429) error.
+
+    Parameters:
+    - error (Exception): The error raised by the API client.
+
+    Returns:
+    - bool: True if the error is a rate limit error.
+    """
+    return getattr(error, "status_code", None) == 429 or "Error code: 429" in str(error)
+
+
+def get_retry_after(error):
+    """
+    Read the delay requested by the server in the Retry-After headers of an API error.
+
+    Parameters:
+    - error (Exception): The error raised by the API client.
+
+    Returns:
+    - float: The requested delay in seconds, or None if the server did not send one.
+    """
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+
+    try:
+        if headers.get("retry-after-ms") is not None:
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after") is not None:
+            return float(headers["retry-after"])
+    except (TypeError, ValueError):
+        pass
+    return None
+
+
+def backoff_delay(attempt, retry_after=None, base=1.0, cap=30.0):
+    """
+    Compute how long to wait before retrying a failed request.
+
+    Parameters:
+    - attempt (int): The zero-based number of the failed attempt.
+    - retry_after (float): The delay requested by the server, honored if given.
+    - base (float): The delay of the first retry in seconds, default is 1.
+    - cap (float): The maximum delay in seconds, default is 30.
+
+    Returns:
+    - float: The delay in seconds, exponential in the attempt number with random jitter.
+    """
+    if retry_after is not None:
+        return retry_after
+    # Keep half of the exponential delay and randomize the other half so that workers do not retry in lockstep
+    delay = min(cap, base * 2 ** attempt)
+    return delay / 2 + random.uniform(0, delay / 2)
@@ -0,0 +1,168 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from utils.sqlite_cache import SQLiteCache
+
+# Record fields stored once in the side store and replaced by a "<field>_ref" content key
+COMPACT_FIELDS = ["table_text", "row_descriptions", "col_descriptions", "prompt"]
+
+
+class RecordStore:
+    """
+    A content-addressed side store for the large, repeated values of result records (tables, descriptions, prompts).
+
+    Each value is stored once under the SHA-256 of its JSON serialization, however many records refer to it.
+    The store can be shared by all threads of a run.
+    """
+
+    def __init__(self, path, max_memory_entries=256):
+        """
+        Parameters:
+        - path (str): Path of the SQLite file storing the values.
+        - max_memory_entries (int): Maximum number of values kept in memory while reading, default is 256.
+        """
+        self.store = SQLiteCache(path)
+        self.max_memory_entries = max_memory_entries
+        self.memory = OrderedDict()
+        self.written_keys = set()
+        self.lock = threading.Lock()
+
+    def put(self, value):
+        """
+        Store a value, unless an identical value is already stored.
+
+        Parameters:
+        - value: A JSON serializable value.
+
+        Returns:
+        - str: The content key of the value.
+        """
+        data = json.dumps(value, ensure_ascii=False).encode('utf-8')
+        key = hashlib.sha256(data).hexdigest()
+
+        with self.lock:
+            if key in self.written_keys:
+                return key
+            self.written_keys.add(key)
+
+        # Identical content has the same key, so rewriting an existing entry is harmless
+        self.store.set(key, data)
+        return key
+
+    def get(self, key):
+        """
+        Load a stored value.
+
+        Parameters:
+        - key (str): The content key returned by put.
+
+        Returns:
+        - The stored value, or None if the key is unknown.
+        """
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                return self.memory[key]
+
+        data = self.store.get(key)
+        if data is None:
+            return None
+        value = json.loads(data)
+
+        # Records of the same table are usually adjacent, keep the most recent values in memory
+        with self.lock:
+            self.memory[key] = value
+            while len(self.memory) > self.max_memory_entries:
+                self.memory.popitem(last=False)
+        return value
+
+
+def extract_subtable(table, row_indices, col_indices):
+    """
+    Select rows and columns of an indexed table, with the index convention of the retrieval (-1 is the header / row index column).
+
+    Parameters:
+    - table (list): The indexed table as a list of lists (rows), including the header row.
+    - row_indices (list): The selected row indices.
+    - col_indices (list): The selected column indices.
+
+    Returns:
+    - list: The sub-table as a list of lists (rows).
+    """
+    return [[table[i + 1][j + 1] for j in col_indices] for i in row_indices]
+
+
+def compact_record(record, store):
+    """
+    Move the large fields of a result record to the side store, keeping only their content keys.
+
+    The final sub-table is dropped when it can be rebuilt from the table and the row/column indices,
+    and stored like the other fields otherwise (e.g. when long cells were truncated).
+
+    Parameters:
+    - record (dict): The full result record.
+    - store (RecordStore): The side store.
+
+    Returns:
+    - dict: The compact record.
+    """
+    compact = dict(record)
+    for field in COMPACT_FIELDS:
+        if field in compact:
+            compact[field + "_ref"] = store.put(compact.pop(field))
+
+    if "final_sub_table" in compact:
+        final_subtable = compact.pop("final_sub_table")
+        rebuilt = extract_subtable(record["table_text"], record["final_row_indices"], record["final_col_indices"])
+        if rebuilt != final_subtable:
+            compact["final_sub_table_ref"] = store.put(final_subtable)
+
+    return compact
+
+
+def rehydrate_record(record, store):
+    """
+    Restore the full result record from a compact record and the side store.
+
+    Parameters:
+    - record (dict): The compact (or already full) result record.
+    - store (RecordStore): The side store the record was compacted into.
+
+    Returns:
+    - dict: The full record.
+    """
+    full = dict(record)
+    for field in COMPACT_FIELDS + ["final_sub_table"]:
+        key = full.pop(field + "_ref", None)
+        if key is not None:
+            value = store.get(key)
+            if value is None:
+                raise ValueError(f"Missing {field} {key} in the record store.")
+            full[field] = value
+
+    # A multi-stage record without a stored sub-table had one identical to its rebuild
+    if "final_row_indices" in full and "final_sub_table" not in full and "table_text" in full:
+        full["final_sub_table"] = extract_subtable(full["table_text"], full["final_row_indices"], full["final_col_indices"])
+
+    return full
+
+
+def iter_result_records(result_file_path, store_path=None):
+    """
+    Read a result file lazily, rehydrating compact records.
+
+    Parameters:
+    - result_file_path (str): Path of the JSONL result file.
+    - store_path (str): Path of the side store of compact records, None if the records are full.
+
+    Returns:
+    - generator: The full result records, in file order.
+    """
+    store = RecordStore(store_path) if store_path else None
+    with open(result_file_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            yield rehydrate_record(record, store) if store is not None else record
@@ -1,6 +1,16 @@
 import os
 import time
-from openai import OpenAI
+import asyncio
+import contextlib
+from itertools import islice
+from openai import OpenAI, AsyncOpenAI
+from utils.tokens import count_tokens
+from utils.embedding_cache import lookup_embeddings, store_embeddings
+from utils.rate_limiter import RateLimiter, is_rate_limit_error, get_retry_after, backoff_delay
+from utils.mock_backend import MockBackend, MockClient, AsyncMockClient
+from utils.response_cache import response_cache_key, lookup_response, store_response, is_replay_only
+from utils.profiling import record_api_call
+from utils.tracing import trace_span
 
 # Initialize the OpenAI client with the provided API key and base URL.
 client = OpenAI(
@@ -8,7 +18,118 @@ client = OpenAI(
     base_url=""  # The base URL for the API should be set here
 )
 
-def request_gpt_chat(prompt, model="gpt-3.5-turbo", retries=30):
+# Asynchronous client used by the asyncio pipeline, configured the same way
+async_client = AsyncOpenAI(
+    api_key="",  # API key should be set here
+    base_url=""  # The base URL for the API should be set here
+)
+
+# The OpenAI clients, kept to switch back from another backend
+_openai_clients = (client, async_client)
+
+
+def configure_backend(backend="openai", chat_latency=0.0, embedding_latency=0.0, embedding_dim=1536):
+    """
+    Choose the backend serving chat completion and embedding requests.
+
+    Parameters:
+    - backend (str): "openai" for the OpenAI clients above, or "mock" for a local deterministic stand-in
+      (see utils.mock_backend) that needs no network access.
+    - chat_latency (float): Seconds spent on each mock chat completion request, default is 0.
+    - embedding_latency (float): Seconds spent on each mock embedding request, default is 0.
+    - embedding_dim (int): The dimension of the mock embeddings, default is 1536.
+    """
+    global client, async_client
+    if backend == "openai":
+        client, async_client = _openai_clients
+    elif backend == "mock":
+        mock_backend = MockBackend(chat_latency=chat_latency, embedding_latency=embedding_latency, embedding_dim=embedding_dim)
+        client, async_client = MockClient(mock_backend), AsyncMockClient(mock_backend)
+    else:
+        raise ValueError(f"Unknown backend: {backend}")
+
+
+# Sampling temperature of all chat completion requests
+CHAT_TEMPERATURE = 0.7
+
+# Concurrency limits of the asynchronous chat and embedding requests (unlimited until configured)
+_chat_semaphore = None
+_embedding_semaphore = None
+
+
+def configure_async_limits(max_chat_requests, max_embedding_requests):
+    """
+    Set how many asynchronous chat and embedding requests may be in flight at the same time.
+
+    Must be called from inside the event loop that sends the requests.
+
+    Parameters:
+    - max_chat_requests (int): Maximum number of concurrent chat completion requests.
+    - max_embedding_requests (int): Maximum number of concurrent embedding requests.
+    """
+    global _chat_semaphore, _embedding_semaphore
+    _chat_semaphore = asyncio.Semaphore(max_chat_requests)
+    _embedding_semaphore = asyncio.Semaphore(max_embedding_requests)
+
+
+def _limit(semaphore):
+    return semaphore if semaphore is not None else contextlib.nullcontext()
+
+
+# Client-side request and token budgets shared by all threads and tasks (unlimited until configured)
+chat_limiter = RateLimiter()
+embedding_limiter = RateLimiter()
+
+
+def configure_rate_limits(chat_rpm=None, chat_tpm=None, embedding_rpm=None, embedding_tpm=None):
+    """
+    Set the requests-per-minute and tokens-per-minute budgets of the chat and embedding endpoints.
+
+    Parameters:
+    - chat_rpm (int): Chat requests per minute, None for unlimited.
+    - chat_tpm (int): Chat tokens per minute, None for unlimited.
+    - embedding_rpm (int): Embedding requests per minute, None for unlimited.
+    - embedding_tpm (int): Embedding tokens per minute, None for unlimited.
+    """
+    chat_limiter.set_limits(chat_rpm, chat_tpm)
+    embedding_limiter.set_limits(embedding_rpm, embedding_tpm)
+
+
+def get_rate_limit_metrics():
+    """
+    Report the current utilization of the chat and embedding budgets.
+
+    Returns:
+    - dict: The utilization metrics of each limiter.
+    """
+    return {"chat": chat_limiter.utilization(), "embedding": embedding_limiter.utilization()}
+
+
+def _retry_delay(limiter, error, attempt):
+    # Back off exponentially, honoring Retry-After, and pause every worker if the API rate limited us
+    delay = backoff_delay(attempt, get_retry_after(error))
+    if is_rate_limit_error(error):
+        limiter.pause(delay)
+    return delay
+
+
+def _record_usage(limiter, response, estimated_tokens):
+    usage = getattr(response, "usage", None)
+    if usage is not None and getattr(usage, "total_tokens", None) is not None:
+        limiter.record_usage(estimated_tokens, usage.total_tokens)
+
+
+def _trace_response(span, response, attempt):
+    # Report the retries before the successful attempt and the token usage on the span of the request
+    span["retries"] = attempt
+    usage = getattr(response, "usage", None)
+    for field in ["prompt_tokens", "completion_tokens", "total_tokens"]:
+        tokens = getattr(usage, field, None)
+        if tokens is not None:
+            span[field] = tokens
+
+
+def request_gpt_chat(prompt, model="gpt-3.5-turbo", retries=30, sample=0):
     """
     Send a request to the GPT model for generating chat completions.
 
@@ -16,34 +137,61 @@ def request_gpt_chat(prompt, model="gpt-3.5-turbo", retries=30):
     - prompt (str): The input prompt for GPT.
     - model (str): The model to be used, default is "gpt-3.5-turbo".
     - retries (int): Number of retries in case of failure, default is 30.
+    - sample (int): Which sample of the same prompt is requested, e.g. the attempt number of a validation loop; default is 0.
 
     Returns:
     - str: The generated answer from GPT or error message.
     """
-    e = None
-    for attempt in range(retries):
-        try:
-            # Call the GPT API for chat completions
-            response = client.chat.completions.create(
-                model=model,
-                messages=[{"role": "user", "content": prompt}],  # Pass the user prompt
-                temperature=0.7  # Control the randomness of the model's responses
-            )
-
-            # Extract and return the answer from the response
-            answer = response.choices[0].message.content
-            return answer
-
-        except Exception as error:
-            e = error
-            print(f"Error calling GPT API: {e}, sleeping for 1 second before retrying...")  # Print error message
-            time.sleep(1)  # Sleep for 1 second before retrying
-            if "This model's maximum context length is 16385 tokens." in str(e):
-                # If the error is due to the token limit, break out of the loop
-                break
-
-    print("Max retries exceeded.")
-    return f"Error calling GPT API: {e}"  # Return error message if retries are exhausted
+    with trace_span("chat", model=model) as span:
+        # Serve identical requests from the response cache, if enabled
+        cache_key = response_cache_key(model, CHAT_TEMPERATURE, prompt, sample)
+        cached_answer = lookup_response(cache_key)
+        if cached_answer is not None:
+            span["cache_hit"] = True
+            return cached_answer
+        if is_replay_only():
+            span["status"] = "error"
+            print("Error calling GPT API: no cached response in replay-only mode.")
+            return "Error calling GPT API: no cached response in replay-only mode"
+
+        estimated_tokens = count_tokens(prompt, model)
+        e = None
+        for attempt in range(retries):
+            try:
+                # Wait until the request fits in the shared budgets
+                chat_limiter.acquire(estimated_tokens)
+
+                # Call the GPT API for chat completions
+                response = client.chat.completions.create(
+                    model=model,
+                    messages=[{"role": "user", "content": prompt}],  # Pass the user prompt
+                    temperature=CHAT_TEMPERATURE  # Control the randomness of the model's responses
+                )
+                _record_usage(chat_limiter, response, estimated_tokens)
+                record_api_call("chat", response)
+                _trace_response(span, response, attempt)
+
+                # Extract and return the answer from the response
+                answer = response.choices[0].message.content
+                store_response(cache_key, answer)
+                return answer
+
+            except Exception as error:
+                e = error
+                record_api_call("chat")
+                if "This model's maximum context length is 16385 tokens." in str(e):
+                    # If the error is due to the token limit, break out of the loop
+                    print(f"Error calling GPT API: {e}")
+                    break
+                delay = _retry_delay(chat_limiter, e, attempt)
+                print(f"Error calling GPT API: {e}, sleeping for {delay:.1f} seconds before retrying...")  # Print error message
+                time.sleep(delay)
+
+        span.update(status="error", error=str(e))
+        print("Max retries exceeded.")
+        return f"Error calling GPT API: {e}"  # Return error message if retries are exhausted
+
+EMBEDDING_MODEL = "text-embedding-3-small"
 
 def request_gpt_embedding(input, retries=5):
     """
@@ -56,28 +204,436 @@ def request_gpt_embedding(input, retries=5):
     Returns:
     - list: The generated embedding vector or None if failed.
     """
-    for attempt in range(retries):
-        try:
-            # Call the GPT API for embeddings
-            response = client.embeddings.create(
-                input=input,
-                model="text-embedding-3-small"  # Specify the model for embeddings
-            )
-
-            # Extract the embedding vector from the response
-            embedding = response.data[0].embedding
-            time.sleep(0.1)  # Sleep briefly to avoid rate-limiting issues
-
-            return embedding
-
-        except Exception as e:
-            if "Error code: 429" in str(e):
-                # If rate limit exceeded, wait for 1 second before retrying
-                print(f"Received 429 error, {e}, sleeping for 1 second before retrying...")
-                time.sleep(1)
-            else:
-                print(f"Error calling GPT API: {e}")  # Print any other errors
-                return None
-
-    print("Max retries exceeded.")
-    return None  # Return None if retries are exhausted
+    with trace_span("embedding", inputs=1) as span:
+        # Return the cached embedding if this text has been embedded before
+        cached_embedding = lookup_embeddings([input], EMBEDDING_MODEL)[0]
+        if cached_embedding is not None:
+            span["cache_hit"] = True
+            return cached_embedding
+
+        estimated_tokens = count_tokens(input, EMBEDDING_MODEL)
+        for attempt in range(retries):
+            try:
+                # Wait until the request fits in the shared budgets
+                embedding_limiter.acquire(estimated_tokens)
+
+                # Call the GPT API for embeddings
+                response = client.embeddings.create(
+                    input=input,
+                    model=EMBEDDING_MODEL  # Specify the model for embeddings
+                )
+                _record_usage(embedding_limiter, response, estimated_tokens)
+                record_api_call("embedding", response)
+                _trace_response(span, response, attempt)
+
+                # Extract the embedding vector from the response
+                embedding = response.data[0].embedding
+                store_embeddings([input], [embedding], EMBEDDING_MODEL)
+
+                return embedding
+
+            except Exception as e:
+                record_api_call("embedding")
+                if is_rate_limit_error(e):
+                    # If rate limit exceeded, back off before retrying
+                    delay = _retry_delay(embedding_limiter, e, attempt)
+                    print(f"Received 429 error, {e}, sleeping for {delay:.1f} seconds before retrying...")
+                    time.sleep(delay)
+                else:
+                    span.update(status="error", error=str(e))
+                    print(f"Error calling GPT API: {e}")  # Print any other errors
+                    return None
+
+        span["status"] = "error"
+        print("Max retries exceeded.")
+        return None  # Return None if retries are exhausted
+
+
+def iter_batches(items, batch_size=256, max_batch_tokens=100000, model=EMBEDDING_MODEL):
+    """
+    Group a stream of texts into consecutive batches bounded by size and token budget, consuming it one batch at a time.
+
+    Parameters:
+    - items (iterable): (position, text) pairs, e.g. enumerate(texts).
+    - batch_size (int): Maximum number of texts per batch, default is 256.
+    - max_batch_tokens (int): Maximum number of tokens per batch, default is 100000.
+    - model (str): The model whose tokenizer is used to count tokens.
+
+    Returns:
+    - generator: The batches, each a list of (position, text) pairs in input order.
+    """
+    current_batch = []
+    current_tokens = 0
+    for position, text in items:
+        num_tokens = count_tokens(text, model)
+        # Close the current batch if adding this text would exceed either limit
+        if current_batch and (len(current_batch) >= batch_size or current_tokens + num_tokens > max_batch_tokens):
+            yield current_batch
+            current_batch = []
+            current_tokens = 0
+        current_batch.append((position, text))
+        current_tokens += num_tokens
+
+    if current_batch:
+        yield current_batch
+
+
+def split_into_batches(inputs, batch_size=256, max_batch_tokens=100000, model=EMBEDDING_MODEL):
+    """
+    Split a list of texts into consecutive batches bounded by size and token budget.
+
+    Parameters:
+    - inputs (list): The texts to split.
+    - batch_size (int): Maximum number of texts per batch, default is 256.
+    - max_batch_tokens (int): Maximum number of tokens per batch, default is 100000.
+    - model (str): The model whose tokenizer is used to count tokens.
+
+    Returns:
+    - list: A list of batches, each a list of (position, text) pairs in input order.
+    """
+    return list(iter_batches(enumerate(inputs), batch_size, max_batch_tokens, model))
+
+
+def _iter_uncached(inputs, embeddings, chunk_size):
+    # Look the texts up in the embedding cache one chunk at a time, appending the cached embeddings (None if not
+    # cached) to embeddings, and yield the (position, text) of the texts that still have to be embedded
+    iterator = iter(inputs)
+    position = 0
+    while True:
+        chunk = list(islice(iterator, chunk_size))
+        if not chunk:
+            return
+        cached_embeddings = lookup_embeddings(chunk, EMBEDDING_MODEL)
+        embeddings.extend(cached_embeddings)
+        for offset, (text, embedding) in enumerate(zip(chunk, cached_embeddings)):
+            if embedding is None:
+                yield position + offset, text
+        position += len(chunk)
+
+
+def request_gpt_embedding_batch(inputs, retries=5):
+    """
+    Send a single embeddings request for a batch of texts, splitting the batch in half if it is rejected
+    (e.g. too large, or with an invalid input), so that a single bad input does not lose the whole batch.
+
+    Parameters:
+    - inputs (list): The texts to embed in one request.
+    - retries (int): Number of retries per request in case of rate limiting, default is 5.
+
+    Returns:
+    - list: The embedding vectors in input order, with None for texts that could not be embedded even alone.
+
+    Raises:
+    - Exception: The rate limit error of the last attempt if the retries are exhausted; the batch is not split
+      then, as smaller requests would only add to the rate limiting.
+    """
+    with trace_span("embedding", inputs=len(inputs)) as span:
+        estimated_tokens = sum(count_tokens(text, EMBEDDING_MODEL) for text in inputs)
+        rate_limit_error = RuntimeError("No embeddings request was attempted.")
+        for attempt in range(retries):
+            try:
+                embedding_limiter.acquire(estimated_tokens)
+                response = client.embeddings.create(
+                    input=inputs,
+                    model=EMBEDDING_MODEL
+                )
+                _record_usage(embedding_limiter, response, estimated_tokens)
+                record_api_call("embedding", response)
+                _trace_response(span, response, attempt)
+
+                # The API reports the position of each input, do not rely on response order
+                embeddings = [None] * len(inputs)
+                for item in response.data:
+                    embeddings[item.index] = item.embedding
+                return embeddings
+
+            except Exception as e:
+                record_api_call("embedding")
+                if is_rate_limit_error(e):
+                    rate_limit_error = e
+                    delay = _retry_delay(embedding_limiter, e, attempt)
+                    print(f"Received 429 error, {e}, sleeping for {delay:.1f} seconds before retrying...")
+                    time.sleep(delay)
+                else:
+                    print(f"Error calling GPT API for a batch of {len(inputs)} inputs: {e}")
+                    break
+        else:
+            span["status"] = "error"
+            print(f"Max retries exceeded for a batch of {len(inputs)} inputs.")
+            raise rate_limit_error
+
+        span["status"] = "error"
+        if len(inputs) == 1:
+            return [None]
+
+        # Split the rejected batch so that a single bad input does not lose the whole batch
+        middle = len(inputs) // 2
+        return request_gpt_embedding_batch(inputs[:middle], retries) + request_gpt_embedding_batch(inputs[middle:], retries)
+
+
+def _embed_batch(texts, retries):
+    # The embeddings of a batch, and whether it exhausted its rate limit retries (all None then)
+    try:
+        return request_gpt_embedding_batch(texts, retries), False
+    except Exception as e:
+        if not is_rate_limit_error(e):
+            raise
+        return [None] * len(texts), True
+
+
+def request_gpt_embeddings(inputs, batch_size=256, max_batch_tokens=100000, retries=5, fallback=None):
+    """
+    Generate embeddings for a stream of texts using batched requests.
+
+    The texts are consumed one batch at a time, so a generator of descriptions is embedded without building
+    the list of all texts.
+
+    Parameters:
+    - inputs (iterable): The texts to generate embeddings for, e.g. a list or a generator.
+    - batch_size (int): Maximum number of texts per request, default is 256.
+    - max_batch_tokens (int): Maximum number of tokens per request, default is 100000.
+    - retries (int): Number of retries per request in case of rate limiting, default is 5.
+    - fallback (callable): Embeds a single text of a batch that exhausted its rate limit retries (e.g. request_gpt_embedding),
+      None to leave it unembedded. Texts that failed alone after a batch was split are not sent again.
+
+    Returns:
+    - list: The embedding vectors in input order, with None for texts that could not be embedded.
+    """
+    # Start from the cached embeddings and only request the missing ones
+    embeddings = []
+    for batch in iter_batches(_iter_uncached(inputs, embeddings, batch_size), batch_size, max_batch_tokens):
+        texts = [text for _, text in batch]
+        batch_embeddings, rate_limited = _embed_batch(texts, retries)
+        store_embeddings(texts, batch_embeddings, EMBEDDING_MODEL)
+        for (position, text), embedding in zip(batch, batch_embeddings):
+            # The text is still at hand, even when the input is a generator that has moved past it
+            if embedding is None and rate_limited and fallback is not None:
+                embedding = fallback(text)
+            embeddings[position] = embedding
+
+    return embeddings
+
+
+async def request_gpt_chat_async(prompt, model="gpt-3.5-turbo", retries=30, sample=0):
+    """
+    Asynchronous version of request_gpt_chat, bounded by the chat concurrency limit.
+
+    Parameters:
+    - prompt (str): The input prompt for GPT.
+    - model (str): The model to be used, default is "gpt-3.5-turbo".
+    - retries (int): Number of retries in case of failure, default is 30.
+    - sample (int): Which sample of the same prompt is requested, e.g. the attempt number of a validation loop; default is 0.
+
+    Returns:
+    - str: The generated answer from GPT or error message.
+    """
+    with trace_span("chat", model=model) as span:
+        # Serve identical requests from the response cache, if enabled
+        cache_key = response_cache_key(model, CHAT_TEMPERATURE, prompt, sample)
+        cached_answer = lookup_response(cache_key)
+        if cached_answer is not None:
+            span["cache_hit"] = True
+            return cached_answer
+        if is_replay_only():
+            span["status"] = "error"
+            print("Error calling GPT API: no cached response in replay-only mode.")
+            return "Error calling GPT API: no cached response in replay-only mode"
+
+        estimated_tokens = count_tokens(prompt, model)
+        e = None
+        for attempt in range(retries):
+            try:
+                await chat_limiter.acquire_async(estimated_tokens)
+                async with _limit(_chat_semaphore):
+                    response = await async_client.chat.completions.create(
+                        model=model,
+                        messages=[{"role": "user", "content": prompt}],
+                        temperature=CHAT_TEMPERATURE
+                    )
+                _record_usage(chat_limiter, response, estimated_tokens)
+                record_api_call("chat", response)
+                _trace_response(span, response, attempt)
+
+                answer = response.choices[0].message.content
+                store_response(cache_key, answer)
+                return answer
+
+            except Exception as error:
+                e = error
+                record_api_call("chat")
+                if "This model's maximum context length is 16385 tokens." in str(e):
+                    print(f"Error calling GPT API: {e}")
+                    break
+                delay = _retry_delay(chat_limiter, e, attempt)
+                print(f"Error calling GPT API: {e}, sleeping for {delay:.1f} seconds before retrying...")
+                await asyncio.sleep(delay)
+
+        span.update(status="error", error=str(e))
+        print("Max retries exceeded.")
+        return f"Error calling GPT API: {e}"
+
+
+async def request_gpt_embedding_async(input, retries=5):
+    """
+    Asynchronous version of request_gpt_embedding, bounded by the embedding concurrency limit.
+
+    Parameters:
+    - input (str): The input text to generate embeddings for.
+    - retries (int): Number of retries in case of failure, default is 5.
+
+    Returns:
+    - list: The generated embedding vector or None if failed.
+    """
+    with trace_span("embedding", inputs=1) as span:
+        # Return the cached embedding if this text has been embedded before
+        cached_embedding = lookup_embeddings([input], EMBEDDING_MODEL)[0]
+        if cached_embedding is not None:
+            span["cache_hit"] = True
+            return cached_embedding
+
+        estimated_tokens = count_tokens(input, EMBEDDING_MODEL)
+        for attempt in range(retries):
+            try:
+                await embedding_limiter.acquire_async(estimated_tokens)
+                async with _limit(_embedding_semaphore):
+                    response = await async_client.embeddings.create(
+                        input=input,
+                        model=EMBEDDING_MODEL
+                    )
+                _record_usage(embedding_limiter, response, estimated_tokens)
+                record_api_call("embedding", response)
+                _trace_response(span, response, attempt)
+
+                embedding = response.data[0].embedding
+                store_embeddings([input], [embedding], EMBEDDING_MODEL)
+
+                return embedding
+
+            except Exception as e:
+                record_api_call("embedding")
+                if is_rate_limit_error(e):
+                    delay = _retry_delay(embedding_limiter, e, attempt)
+                    print(f"Received 429 error, {e}, sleeping for {delay:.1f} seconds before retrying...")
+                    await asyncio.sleep(delay)
+                else:
+                    span.update(status="error", error=str(e))
+                    print(f"Error calling GPT API: {e}")
+                    return None
+
+        span["status"] = "error"
+        print("Max retries exceeded.")
+        return None
+
+
+async def request_gpt_embedding_batch_async(inputs, retries=5):
+    """
+    Asynchronous version of request_gpt_embedding_batch, bounded by the embedding concurrency limit.
+
+    Parameters:
+    - inputs (list): The texts to embed in one request.
+    - retries (int): Number of retries per request in case of rate limiting, default is 5.
+
+    Returns:
+    - list: The embedding vectors in input order, with None for texts that could not be embedded even alone.
+
+    Raises:
+    - Exception: The rate limit error of the last attempt if the retries are exhausted (the batch is not split).
+    """
+    with trace_span("embedding", inputs=len(inputs)) as span:
+        estimated_tokens = sum(count_tokens(text, EMBEDDING_MODEL) for text in inputs)
+        rate_limit_error = RuntimeError("No embeddings request was attempted.")
+        for attempt in range(retries):
+            try:
+                await embedding_limiter.acquire_async(estimated_tokens)
+                async with _limit(_embedding_semaphore):
+                    response = await async_client.embeddings.create(
+                        input=inputs,
+                        model=EMBEDDING_MODEL
+                    )
+                _record_usage(embedding_limiter, response, estimated_tokens)
+                record_api_call("embedding", response)
+                _trace_response(span, response, attempt)
+
+                embeddings = [None] * len(inputs)
+                for item in response.data:
+                    embeddings[item.index] = item.embedding
+                return embeddings
+
+            except Exception as e:
+                record_api_call("embedding")
+                if is_rate_limit_error(e):
+                    rate_limit_error = e
+                    delay = _retry_delay(embedding_limiter, e, attempt)
+                    print(f"Received 429 error, {e}, sleeping for {delay:.1f} seconds before retrying...")
+                    await asyncio.sleep(delay)
+                else:
+                    print(f"Error calling GPT API for a batch of {len(inputs)} inputs: {e}")
+                    break
+        else:
+            span["status"] = "error"
+            print(f"Max retries exceeded for a batch of {len(inputs)} inputs.")
+            raise rate_limit_error
+
+        span["status"] = "error"
+        if len(inputs) == 1:
+            return [None]
+
+        # Wait for both halves before raising the rate limit error of either, so that no request is left running
+        middle = len(inputs) // 2
+        halves = await asyncio.gather(
+            request_gpt_embedding_batch_async(inputs[:middle], retries),
+            request_gpt_embedding_batch_async(inputs[middle:], retries),
+            return_exceptions=True
+        )
+        for half in halves:
+            if isinstance(half, BaseException):
+                raise half
+        return halves[0] + halves[1]
+
+
+async def _embed_batch_async(texts, retries):
+    # Asynchronous version of _embed_batch
+    try:
+        return await request_gpt_embedding_batch_async(texts, retries), False
+    except Exception as e:
+        if not is_rate_limit_error(e):
+            raise
+        return [None] * len(texts), True
+
+
+async def request_gpt_embeddings_async(inputs, batch_size=256, max_batch_tokens=100000, retries=5, fallback=None):
+    """
+    Asynchronous version of request_gpt_embeddings, sending all batches concurrently.
+
+    Parameters:
+    - inputs (iterable): The texts to generate embeddings for, e.g. a list or a generator.
+    - batch_size (int): Maximum number of texts per request, default is 256.
+    - max_batch_tokens (int): Maximum number of tokens per request, default is 100000.
+    - retries (int): Number of retries per request in case of rate limiting, default is 5.
+    - fallback (coroutine function): Embeds a single text of a batch that exhausted its rate limit retries
+      (e.g. request_gpt_embedding_async), None to leave it unembedded.
+
+    Returns:
+    - list: The embedding vectors in input order, with None for texts that could not be embedded.
+    """
+    embeddings = []
+    batches = list(iter_batches(_iter_uncached(inputs, embeddings, batch_size), batch_size, max_batch_tokens))
+    batch_results = await asyncio.gather(*[
+        _embed_batch_async([text for _, text in batch], retries) for batch in batches
+    ])
+
+    failed = []
+    for batch, (batch_embeddings, rate_limited) in zip(batches, batch_results):
+        store_embeddings([text for _, text in batch], batch_embeddings, EMBEDDING_MODEL)
+        for (position, text), embedding in zip(batch, batch_embeddings):
+            embeddings[position] = embedding
+            if embedding is None and rate_limited:
+                failed.append((position, text))
+
+    # Embed the texts of the rate limited batches one by one, concurrently
+    if fallback is not None and failed:
+        retried_embeddings = await asyncio.gather(*[fallback(text) for _, text in failed])
+        for (position, _), embedding in zip(failed, retried_embeddings):
+            embeddings[position] = embedding
+
+    return embeddings
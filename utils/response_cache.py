@@ -0,0 +1,117 @@
+import hashlib
+import json
+import threading
+import time
+from utils.sqlite_cache import SQLiteCache
+
+# The process-wide chat response cache, disabled until configure_response_cache is called
+_response_cache = None
+_response_cache_config = {"ttl": None, "replay_only": False}
+
+# Counters since the cache was configured
+_stats = {"hits": 0, "misses": 0, "expired": 0, "stores": 0}
+_stats_lock = threading.Lock()
+
+
+def configure_response_cache(path=None, ttl=None, max_entries=None, replay_only=False):
+    """
+    Enable (or disable) the persistent cache of chat completion responses for this process.
+
+    Parameters:
+    - path (str): Path of the SQLite file storing the responses, None to disable the cache.
+    - ttl (float): Age in seconds after which a cached response is ignored, None to keep responses forever.
+    - max_entries (int): Maximum number of cached responses before least-recently-used eviction, None for unbounded.
+    - replay_only (bool): Never call the API; requests missing from the cache fail instead.
+    """
+    global _response_cache
+    if replay_only and not path:
+        raise ValueError("Replay-only mode needs a response cache path.")
+
+    _response_cache = SQLiteCache(path, max_entries=max_entries) if path else None
+    _response_cache_config.update(ttl=ttl, replay_only=replay_only)
+    with _stats_lock:
+        _stats.update(hits=0, misses=0, expired=0, stores=0)
+
+
+def is_replay_only():
+    """
+    Returns:
+    - bool: True if requests must be served from the response cache.
+    """
+    return _response_cache_config["replay_only"]
+
+
+def response_cache_key(model, temperature, prompt, sample=0):
+    """
+    Build the cache key of a chat completion request.
+
+    Parameters:
+    - model (str): The model of the request.
+    - temperature (float): The sampling temperature of the request.
+    - prompt (str): The prompt of the request.
+    - sample (int): Which sample of the same request this is, so that retries of a request whose
+      response was rejected get a new response instead of the cached one; default is 0.
+
+    Returns:
+    - str: The cache key.
+    """
+    prompt_hash = hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+    return f"{model}:{temperature}:{sample}:{prompt_hash}"
+
+
+def lookup_response(key):
+    """
+    Look a response up in the cache.
+
+    Parameters:
+    - key (str): The key built by response_cache_key.
+
+    Returns:
+    - str: The cached response, or None if it is not cached, has expired, or the cache is disabled.
+    """
+    if _response_cache is None:
+        return None
+
+    stored = _response_cache.get(key)
+    if stored is not None:
+        entry = json.loads(stored)
+        ttl = _response_cache_config["ttl"]
+        if ttl is None or time.time() - entry["created"] <= ttl:
+            with _stats_lock:
+                _stats["hits"] += 1
+            return entry["response"]
+        with _stats_lock:
+            _stats["expired"] += 1
+
+    with _stats_lock:
+        _stats["misses"] += 1
+    return None
+
+
+def store_response(key, response):
+    """
+    Store a response in the cache, if it is enabled.
+
+    Parameters:
+    - key (str): The key built by response_cache_key.
+    - response (str): The response to store.
+    """
+    if _response_cache is None:
+        return
+    _response_cache.set(key, json.dumps({"response": response, "created": time.time()}, ensure_ascii=False).encode('utf-8'))
+    with _stats_lock:
+        _stats["stores"] += 1
+
+
+def get_response_cache_stats():
+    """
+    Get the response cache counters since it was configured.
+
+    Returns:
+    - dict: The number of hits, misses (including expired entries), expired entries and stored responses, and the hit rate.
+    """
+    with _stats_lock:
+        stats = dict(_stats)
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = stats["hits"] / lookups if lookups else None
+    return stats
@@ -0,0 +1,116 @@
+import os
+import sqlite3
+import threading
+import time
+
+
+class SQLiteCache:
+    """
+    A persistent key-value store backed by a single SQLite file, with least-recently-used eviction.
+
+    Keys are strings and values are bytes. The store can be shared by all threads of a run.
+    """
+
+    def __init__(self, path, max_entries=None):
+        """
+        Open (or create) the cache file.
+
+        Parameters:
+        - path (str): Path of the SQLite file.
+        - max_entries (int): Maximum number of entries to keep, None for unbounded.
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB, last_access REAL)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS cache_last_access ON cache (last_access)")
+        self.connection.commit()
+
+    def get(self, key):
+        """
+        Look up a single key.
+
+        Parameters:
+        - key (str): The key to look up.
+
+        Returns:
+        - bytes: The stored value, or None if the key is not cached.
+        """
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys):
+        """
+        Look up several keys at once and mark the found ones as recently used.
+
+        Parameters:
+        - keys (list): The keys to look up.
+
+        Returns:
+        - dict: A mapping from each cached key to its value; missing keys are absent.
+        """
+        found = {}
+        unique_keys = list(dict.fromkeys(keys))
+        with self.lock:
+            # Query in chunks to stay below SQLite's limit on bound parameters
+            for start in range(0, len(unique_keys), 500):
+                chunk = unique_keys[start:start + 500]
+                placeholders = ", ".join("?" * len(chunk))
+                rows = self.connection.execute(
+                    f"SELECT key, value FROM cache WHERE key IN ({placeholders})", chunk
+                ).fetchall()
+                found.update(rows)
+
+            if found:
+                now = time.time()
+                self.connection.executemany(
+                    "UPDATE cache SET last_access = ? WHERE key = ?", [(now, key) for key in found]
+                )
+                self.connection.commit()
+
+        return found
+
+    def set(self, key, value):
+        """
+        Store a single value.
+
+        Parameters:
+        - key (str): The key to store.
+        - value (bytes): The value to store.
+        """
+        self.set_many({key: value})
+
+    def set_many(self, items):
+        """
+        Store several values at once, evicting the least recently used entries if the cache is full.
+
+        Parameters:
+        - items (dict): A mapping from keys to values.
+        """
+        if not items:
+            return
+
+        now = time.time()
+        with self.lock:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO cache (key, value, last_access) VALUES (?, ?, ?)",
+                [(key, value, now) for key, value in items.items()]
+            )
+            if self.max_entries is not None:
+                self.connection.execute(
+                    "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY last_access ASC "
+                    "LIMIT max(0, (SELECT COUNT(*) FROM cache) - ?))",
+                    (self.max_entries,)
+                )
+            self.connection.commit()
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
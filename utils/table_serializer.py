@@ -0,0 +1,199 @@
+import threading
+from collections import OrderedDict, namedtuple
+from utils.processing import table_fingerprint, iter_data_rows
+from utils.tokens import count_tokens
+
+# Supported table formats: markdown (the default of all prompts), and CSV and TSV, which use fewer tokens per row
+TABLE_FORMATS = ("markdown", "csv", "tsv")
+
+# Format of the tables in the reasoning prompts, set by configure_table_format
+_serializer_config = {"format": "markdown"}
+
+# Serialized full tables, keyed by (table fingerprint, format); shared by all questions on the same table
+_serialized_cache = OrderedDict()
+_serialized_cache_lock = threading.Lock()
+MAX_CACHED_TABLES = 256
+
+# A serialized table and its number of tokens
+SerializedTable = namedtuple("SerializedTable", ["text", "num_tokens"])
+
+
+def configure_table_format(table_format="markdown"):
+    """
+    Choose the format of the tables in the reasoning prompts.
+
+    Parameters:
+    - table_format (str): "markdown", "csv" or "tsv", default is "markdown".
+    """
+    if table_format not in TABLE_FORMATS:
+        raise ValueError(f"Unknown table format: {table_format}")
+    _serializer_config["format"] = table_format
+
+
+def get_table_format():
+    """
+    Returns:
+    - str: The configured format of the tables in the reasoning prompts.
+    """
+    return _serializer_config["format"]
+
+
+def _escape_markdown_cell(cell):
+    # A pipe would end the cell and a line break the row
+    return cell.replace("|", "\\|").replace("\r\n", " ").replace("\n", " ").replace("\r", " ")
+
+
+def _markdown_row(cells):
+    cells = [str(cell) for cell in cells]
+    line = " | ".join(cells)
+    # Only rows with a pipe or line break in a cell need escaping (the join itself adds len(cells) - 1 pipes)
+    if line.count("|") >= len(cells) or "\n" in line or "\r" in line:
+        line = " | ".join(map(_escape_markdown_cell, cells))
+    return "| " + line + " |\n"
+
+
+def _csv_cell(cell):
+    # Quote the cells with a delimiter, quote or line break, doubling their quotes
+    if "," in cell or '"' in cell or "\n" in cell or "\r" in cell:
+        return '"' + cell.replace('"', '""') + '"'
+    return cell
+
+
+def _csv_row(cells):
+    return ",".join([_csv_cell(str(cell)) for cell in cells]) + "\n"
+
+
+def _tsv_cell(cell):
+    # TSV has no quoting, tabs and line breaks become spaces
+    if "\t" in cell or "\n" in cell or "\r" in cell:
+        return cell.replace("\r\n", " ").replace("\t", " ").replace("\n", " ").replace("\r", " ")
+    return cell
+
+
+def _tsv_row(cells):
+    return "\t".join([_tsv_cell(str(cell)) for cell in cells]) + "\n"
+
+
+_ROW_FORMATTERS = {"markdown": _markdown_row, "csv": _csv_row, "tsv": _tsv_row}
+
+
+def format_row(cells, table_format="markdown"):
+    """
+    Render one row of a table.
+
+    Parameters:
+    - cells (list): The cells of the row.
+    - table_format (str): "markdown", "csv" or "tsv", default is "markdown".
+
+    Returns:
+    - str: The line of the row, including the trailing newline.
+    """
+    return _ROW_FORMATTERS[table_format](cells)
+
+
+def format_rows(rows, table_format="markdown"):
+    """
+    Render rows of a table in a single join.
+
+    Parameters:
+    - rows (iterable): The rows, each a list of cells.
+    - table_format (str): "markdown", "csv" or "tsv", default is "markdown".
+
+    Returns:
+    - str: One line per row.
+    """
+    return "".join(map(_ROW_FORMATTERS[table_format], rows))
+
+
+def format_header(header, table_format="markdown"):
+    """
+    Render the header of a table, followed by the separator line in markdown.
+
+    Parameters:
+    - header (list): The column names.
+    - table_format (str): "markdown", "csv" or "tsv", default is "markdown".
+
+    Returns:
+    - str: The header line(s).
+    """
+    if table_format == "markdown":
+        return _markdown_row(header) + "| " + " | ".join(["---"] * len(header)) + " |\n"
+    return format_row(header, table_format)
+
+
+def serialize_rows(header, rows, table_format=None):
+    """
+    Serialize a header and rows into a table.
+
+    Parameters:
+    - header (list): The column names.
+    - rows (iterable): The data rows, each a list of cells.
+    - table_format (str): "markdown", "csv" or "tsv", default is the configured format.
+
+    Returns:
+    - str: The serialized table.
+    """
+    table_format = table_format or _serializer_config["format"]
+    return format_header(header, table_format) + format_rows(rows, table_format)
+
+
+def serialize_table(table, table_format=None):
+    """
+    Serialize a table, e.g. a retrieved subtable.
+
+    Parameters:
+    - table (list or ColumnarTable): The table as a list of lists (rows), including the header row, or a columnar table.
+    - table_format (str): "markdown", "csv" or "tsv", default is the configured format.
+
+    Returns:
+    - str: The serialized table.
+    """
+    return serialize_rows(table[0], iter_data_rows(table), table_format)
+
+
+def count_table_tokens(table, table_format=None, model="gpt-3.5-turbo"):
+    """
+    Count the tokens of a serialized table.
+
+    Parameters:
+    - table (list or ColumnarTable): The table as a list of lists (rows), including the header row, or a columnar table.
+    - table_format (str): "markdown", "csv" or "tsv", default is the configured format.
+    - model (str): The model whose tokenizer counts the tokens, default is "gpt-3.5-turbo".
+
+    Returns:
+    - int: The number of tokens of the serialized table.
+    """
+    return count_tokens(serialize_table(table, table_format), model)
+
+
+def serialize_full_table(table, table_format=None, model="gpt-3.5-turbo"):
+    """
+    Serialize a whole table, reusing the serialization of an identical table.
+
+    Whole tables are serialized into every no-plan prompt on them, so they are serialized (and their
+    tokens counted) once per table fingerprint and format.
+
+    Parameters:
+    - table (list or ColumnarTable): The table as a list of lists (rows), including the header row, or a columnar table.
+    - table_format (str): "markdown", "csv" or "tsv", default is the configured format.
+    - model (str): The model whose tokenizer counts the tokens, default is "gpt-3.5-turbo".
+
+    Returns:
+    - SerializedTable: The serialized table and its number of tokens.
+    """
+    table_format = table_format or _serializer_config["format"]
+    key = (table_fingerprint(table), table_format, model)
+
+    with _serialized_cache_lock:
+        serialized = _serialized_cache.get(key)
+        if serialized is not None:
+            _serialized_cache.move_to_end(key)
+            return serialized
+
+    text = serialize_table(table, table_format)
+    serialized = SerializedTable(text, count_tokens(text, model))
+    with _serialized_cache_lock:
+        _serialized_cache[key] = serialized
+        while len(_serialized_cache) > MAX_CACHED_TABLES:
+            _serialized_cache.popitem(last=False)
+    return serialized
@@ -0,0 +1,72 @@
+import threading
+import tiktoken
+
+# Cache of loaded tiktoken encodings, keyed by model name
+_encodings = {}
+_encodings_lock = threading.Lock()
+
+
+def get_encoding(model="gpt-3.5-turbo"):
+    """
+    Load (and cache) the tiktoken encoding used by a model.
+
+    Parameters:
+    - model (str): The model whose tokenizer should be loaded, default is "gpt-3.5-turbo".
+
+    Returns:
+    - tiktoken.Encoding: The encoding, or None if it cannot be loaded (e.g. offline without a local BPE cache).
+    """
+    if model not in _encodings:
+        # Load each encoding once, even when several threads ask for it at the same time
+        with _encodings_lock:
+            if model not in _encodings:
+                try:
+                    _encodings[model] = tiktoken.encoding_for_model(model)
+                except Exception as e:
+                    print(f"Could not load tiktoken encoding for {model}: {e}, falling back to a length estimate.")
+                    _encodings[model] = None
+    return _encodings[model]
+
+
+def count_tokens(text, model="gpt-3.5-turbo"):
+    """
+    Count the number of tokens in a text for the given model.
+
+    Parameters:
+    - text (str): The text to count tokens for.
+    - model (str): The model whose tokenizer is used, default is "gpt-3.5-turbo".
+
+    Returns:
+    - int: The number of tokens (estimated as one token per 4 characters if no encoding is available).
+    """
+    encoding = get_encoding(model)
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_to_tokens(text, max_tokens, model="gpt-3.5-turbo", suffix="..."):
+    """
+    Shorten a text to at most the given number of tokens.
+
+    Parameters:
+    - text (str): The text to shorten.
+    - max_tokens (int): The maximum number of tokens kept from the text.
+    - model (str): The model whose tokenizer is used, default is "gpt-3.5-turbo".
+    - suffix (str): Appended to the text when it is shortened, default is "...".
+
+    Returns:
+    - tuple: The (possibly shortened) text, and whether it was shortened.
+    """
+    encoding = get_encoding(model)
+    if encoding is None:
+        # Same estimate as count_tokens: one token per 4 characters
+        max_chars = max_tokens * 4
+        if len(text) <= max_chars:
+            return text, False
+        return text[:max_chars] + suffix, True
+
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text, False
+    return encoding.decode(tokens[:max_tokens]) + suffix, True
@@ -0,0 +1,295 @@
+import os
+import json
+import time
+import uuid
+import threading
+import contextlib
+import contextvars
+
+# Where spans and metrics are exported, set by configure_tracing (disabled by default)
+_tracing_config = {"trace_path": None, "metrics_path": None}
+_trace_file = None
+_trace_lock = threading.Lock()
+
+# The correlation id of the current question and the innermost open span (each worker thread or task has its own)
+_correlation_id = contextvars.ContextVar("correlation_id", default=None)
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+# Process-wide metrics, keyed by (name, sorted label pairs)
+_counters = {}
+_histograms = {}
+_metrics_lock = threading.Lock()
+
+# Upper bounds in seconds of the span duration histogram buckets
+DURATION_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0]
+
+# Prefix of the exported metric names
+METRIC_PREFIX = "tableqa_"
+
+
+def configure_tracing(trace_path=None, metrics_path=None):
+    """
+    Enable the export of spans and metrics for this process.
+
+    Parameters:
+    - trace_path (str): Path of the JSONL file the spans are appended to, None to not record spans.
+    - metrics_path (str): Path of the file the metrics are written to in the Prometheus text format by
+      write_metrics, None to not collect metrics.
+    """
+    global _trace_file
+    with _trace_lock:
+        if _trace_file is not None:
+            _trace_file.close()
+            _trace_file = None
+        if trace_path:
+            directory = os.path.dirname(trace_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # Line buffered, so that the spans of a crashed run are not lost
+            _trace_file = open(trace_path, 'a', encoding='utf-8', buffering=1)
+
+    _tracing_config.update(trace_path=trace_path, metrics_path=metrics_path)
+    with _metrics_lock:
+        _counters.clear()
+        _histograms.clear()
+
+
+def is_tracing_enabled():
+    """
+    Returns:
+    - bool: True if spans or metrics are exported, i.e. if instrumentation is worth computing.
+    """
+    return _tracing_config["trace_path"] is not None or _tracing_config["metrics_path"] is not None
+
+
+def new_correlation_id():
+    """
+    Start the trace of a new question: every span opened afterwards in this thread or task carries its id.
+
+    Returns:
+    - str: The correlation id, to be stored in the result record of the question.
+    """
+    correlation_id = uuid.uuid4().hex[:16]
+    _correlation_id.set(correlation_id)
+    return correlation_id
+
+
+def get_correlation_id():
+    """
+    Returns:
+    - str: The correlation id of the current question, or None outside a question.
+    """
+    return _correlation_id.get()
+
+
+@contextlib.contextmanager
+def trace_span(name, **attributes):
+    """
+    Trace the enclosed block as a span of the current question.
+
+    The block can add attributes to the yielded dict (e.g. token counts). On exit, the span is appended to
+    the trace file with its duration, status and parent span, and the metrics are updated: a duration
+    histogram per span name and status, and a counter per numeric or true boolean attribute
+    (e.g. the "retries" attribute of "chat" spans adds to tableqa_chat_retries_total).
+
+    Parameters:
+    - name (str): The name of the span, e.g. "chat" or "row_scoring".
+    - attributes: The initial attributes of the span.
+    """
+    if not is_tracing_enabled():
+        yield attributes
+        return
+
+    span_id = uuid.uuid4().hex[:16]
+    parent_id = _current_span.get()
+    token = _current_span.set(span_id)
+    start_time = time.time()
+    start = time.perf_counter()
+    status = "ok"
+    try:
+        yield attributes
+    except BaseException as e:
+        status = "error"
+        attributes["error"] = str(e)
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        _current_span.reset(token)
+        if attributes.get("status") == "error":
+            status = "error"
+        attributes.pop("status", None)
+
+        _record_span_metrics(name, status, duration, attributes)
+        _write_span({
+            "correlation_id": _correlation_id.get(),
+            "span": name,
+            "span_id": span_id,
+            "parent_id": parent_id,
+            "start": start_time,
+            "duration": duration,
+            "status": status,
+            "attributes": attributes,
+        })
+
+
+def increment(name, value=1, **labels):
+    """
+    Add to a counter, if metrics are collected.
+
+    Parameters:
+    - name (str): The counter name, without the prefix and "_total" suffix.
+    - value (float): The increment, default is 1.
+    - labels: The labels of the counter.
+    """
+    if not is_tracing_enabled():
+        return
+    key = (name, tuple(sorted(labels.items())))
+    with _metrics_lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def _record_span_metrics(name, status, duration, attributes):
+    key = (f"{name}_duration_seconds", (("status", status),))
+    with _metrics_lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = {"buckets": [0] * len(DURATION_BUCKETS), "sum": 0.0, "count": 0}
+        for i, bound in enumerate(DURATION_BUCKETS):
+            if duration <= bound:
+                histogram["buckets"][i] += 1
+        histogram["sum"] += duration
+        histogram["count"] += 1
+
+        for attribute, value in attributes.items():
+            if isinstance(value, bool):
+                value = int(value)
+                if not value:
+                    continue
+            elif not isinstance(value, (int, float)):
+                continue
+            counter_key = (f"{name}_{attribute}", ())
+            _counters[counter_key] = _counters.get(counter_key, 0) + value
+
+
+def snapshot_metrics():
+    """
+    Copy the metrics of this process, e.g. to send them from a worker process to the one writing the metrics file.
+
+    Returns:
+    - dict: The counters and span duration histograms, as picklable values.
+    """
+    with _metrics_lock:
+        return {
+            "counters": dict(_counters),
+            "histograms": {key: {"buckets": list(value["buckets"]), "sum": value["sum"], "count": value["count"]} for key, value in _histograms.items()},
+        }
+
+
+def merge_metrics(snapshot):
+    """
+    Add the metrics of another process (see snapshot_metrics) to the metrics of this process, if metrics are collected.
+
+    Parameters:
+    - snapshot (dict): The counters and span duration histograms to add.
+    """
+    if not is_tracing_enabled():
+        return
+    with _metrics_lock:
+        for key, value in snapshot["counters"].items():
+            _counters[key] = _counters.get(key, 0) + value
+        for key, value in snapshot["histograms"].items():
+            histogram = _histograms.get(key)
+            if histogram is None:
+                histogram = _histograms[key] = {"buckets": [0] * len(DURATION_BUCKETS), "sum": 0.0, "count": 0}
+            histogram["buckets"] = [count + other for count, other in zip(histogram["buckets"], value["buckets"])]
+            histogram["sum"] += value["sum"]
+            histogram["count"] += value["count"]
+
+
+def merge_trace_file(path):
+    """
+    Append the spans of another process, e.g. a worker process with its own trace file, to the trace file
+    of this process, then remove its file. Nothing is appended if this process does not record spans.
+
+    Parameters:
+    - path (str): The trace file of the other process.
+    """
+    if not os.path.exists(path):
+        return
+    with _trace_lock:
+        if _trace_file is not None:
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    _trace_file.write(line)
+    if _trace_file is not None:
+        os.remove(path)
+
+
+def _write_span(event):
+    if _trace_file is None:
+        return
+    line = json.dumps(event, ensure_ascii=False, default=str) + "\n"
+    with _trace_lock:
+        if _trace_file is not None:
+            _trace_file.write(line)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+def format_metrics():
+    """
+    Render the metrics in the Prometheus text exposition format.
+
+    Returns:
+    - str: The counters and span duration histograms.
+    """
+    with _metrics_lock:
+        counters = dict(_counters)
+        histograms = {key: {"buckets": list(value["buckets"]), "sum": value["sum"], "count": value["count"]} for key, value in _histograms.items()}
+
+    lines = []
+    for name in sorted({name for name, _ in counters}):
+        metric = f"{METRIC_PREFIX}{name}_total"
+        lines.append(f"# TYPE {metric} counter")
+        for (counter_name, labels), value in sorted(counters.items()):
+            if counter_name == name:
+                lines.append(f"{metric}{_format_labels(labels)} {value}")
+
+    for name in sorted({name for name, _ in histograms}):
+        metric = f"{METRIC_PREFIX}{name}"
+        lines.append(f"# TYPE {metric} histogram")
+        for (histogram_name, labels), histogram in sorted(histograms.items()):
+            if histogram_name != name:
+                continue
+            for bound, count in zip(DURATION_BUCKETS, histogram["buckets"]):
+                lines.append(f"{metric}_bucket{_format_labels(labels + (('le', bound),))} {count}")
+            lines.append(f"{metric}_bucket{_format_labels(labels + (('le', '+Inf'),))} {histogram['count']}")
+            lines.append(f"{metric}_sum{_format_labels(labels)} {histogram['sum']}")
+            lines.append(f"{metric}_count{_format_labels(labels)} {histogram['count']}")
+
+    return "\n".join(lines) + "\n"
+
+
+def write_metrics(path=None):
+    """
+    Write the metrics to a file in the Prometheus text format (e.g. for the node exporter textfile collector).
+
+    The file is replaced atomically, so a scraper never reads a partial file.
+
+    Parameters:
+    - path (str): The metrics file, default is the metrics path given to configure_tracing. Nothing is written if neither is set.
+    """
+    path = path or _tracing_config["metrics_path"]
+    if not path:
+        return
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    with open(temporary_path, 'w', encoding='utf-8') as f:
+        f.write(format_metrics())
+    os.replace(temporary_path, path)
@@ -0,0 +1,221 @@
+import math
+import time
+import numpy as np
+
+
+def normalize_rows(matrix):
+    """
+    Scale each row of a matrix to unit length, as float32.
+
+    Parameters:
+    - matrix (array-like): The vectors to normalize, one per row.
+
+    Returns:
+    - np.ndarray: The normalized float32 matrix; all-zero rows (e.g. failed embeddings) stay zero.
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return matrix / norms
+
+
+def top_k_indices(scores, k):
+    """
+    Select the indices of the k highest scores, in descending order of score.
+
+    Parameters:
+    - scores (np.ndarray): A 1-D array of scores.
+    - k (int): The number of indices to select.
+
+    Returns:
+    - np.ndarray: The selected indices, computed with a partial sort when k is smaller than the array.
+    """
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.array([], dtype=np.int64)
+    if k < len(scores):
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates], kind='stable')]
+
+
+def _as_list_of_k(ks, num_queries):
+    return list(ks) if isinstance(ks, (list, tuple)) else [ks] * num_queries
+
+
+class ExactIndex:
+    """
+    Exact cosine similarity search over vectors normalized once at build time.
+    """
+
+    def __init__(self, embeddings):
+        """
+        Parameters:
+        - embeddings (array-like): The indexed vectors, one per row.
+        """
+        self.vectors = normalize_rows(embeddings)
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def search(self, queries, ks):
+        """
+        Find the most similar indexed vectors of each query.
+
+        Parameters:
+        - queries (array-like): The query vectors, one per row.
+        - ks (int or list): The number of results, shared by all queries or one per query.
+
+        Returns:
+        - list: One array of indices per query, in descending order of similarity.
+        """
+        query_matrix = normalize_rows(queries)
+        # A single matrix product scores every query against every vector
+        scores = query_matrix @ self.vectors.T
+        return [top_k_indices(scores[i], k) for i, k in enumerate(_as_list_of_k(ks, len(query_matrix)))]
+
+
+class IVFIndex:
+    """
+    Approximate cosine similarity search with an inverted file index.
+
+    The vectors are clustered with spherical k-means; a query is only compared with the vectors
+    of its nprobe closest clusters.
+    """
+
+    def __init__(self, embeddings, nlist=None, nprobe=8, iterations=10, seed=0):
+        """
+        Parameters:
+        - embeddings (array-like): The indexed vectors, one per row.
+        - nlist (int): The number of clusters, default is the square root of the number of vectors.
+        - nprobe (int): The number of clusters searched per query, default is 8.
+        - iterations (int): The number of k-means iterations, default is 10.
+        - seed (int): The random seed of the cluster initialization, default is 0.
+        """
+        self.vectors = normalize_rows(embeddings)
+        num_vectors = len(self.vectors)
+        self.nlist = max(1, min(nlist or int(math.sqrt(num_vectors)), num_vectors))
+        self.nprobe = nprobe
+
+        rng = np.random.default_rng(seed)
+        self.centroids = self.vectors[rng.choice(num_vectors, self.nlist, replace=False)]
+        for _ in range(iterations):
+            assignments = self._assign(self.vectors)
+            sums = np.zeros_like(self.centroids)
+            np.add.at(sums, assignments, self.vectors)
+            counts = np.bincount(assignments, minlength=self.nlist)
+            # Keep the previous centroid of clusters that lost all their vectors
+            non_empty = counts > 0
+            self.centroids[non_empty] = normalize_rows(sums[non_empty])
+
+        assignments = self._assign(self.vectors)
+        order = np.argsort(assignments, kind='stable')
+        boundaries = np.searchsorted(assignments[order], np.arange(self.nlist + 1))
+        self.lists = [order[boundaries[c]:boundaries[c + 1]] for c in range(self.nlist)]
+
+    def _assign(self, vectors, chunk_size=4096):
+        # Assign vectors to their closest centroid in chunks to bound memory
+        assignments = np.empty(len(vectors), dtype=np.int64)
+        for start in range(0, len(vectors), chunk_size):
+            assignments[start:start + chunk_size] = np.argmax(vectors[start:start + chunk_size] @ self.centroids.T, axis=1)
+        return assignments
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def search(self, queries, ks):
+        """
+        Find approximately the most similar indexed vectors of each query.
+
+        Parameters:
+        - queries (array-like): The query vectors, one per row.
+        - ks (int or list): The number of results, shared by all queries or one per query.
+
+        Returns:
+        - list: One array of indices per query, in descending order of similarity.
+        """
+        query_matrix = normalize_rows(queries)
+        centroid_scores = query_matrix @ self.centroids.T
+
+        results = []
+        for i, k in enumerate(_as_list_of_k(ks, len(query_matrix))):
+            probed = top_k_indices(centroid_scores[i], self.nprobe)
+            candidates = np.concatenate([self.lists[c] for c in probed])
+            if len(candidates) < min(k, len(self.vectors)):
+                # Not enough candidates in the probed clusters, fall back to exact search
+                candidates = np.arange(len(self.vectors))
+            scores = self.vectors[candidates] @ query_matrix[i]
+            results.append(candidates[top_k_indices(scores, k)])
+        return results
+
+
+# Row index used for new tables, set by configure_row_index
+_row_index_config = {"kind": "exact", "min_rows": 20000, "nlist": None, "nprobe": 8}
+
+
+def configure_row_index(kind="exact", min_rows=20000, nlist=None, nprobe=8):
+    """
+    Choose the vector index used for row embeddings.
+
+    Parameters:
+    - kind (str): "exact", "ivf", or "auto" to use IVF only for tables with at least min_rows rows.
+    - min_rows (int): The table size from which "auto" switches to IVF, default is 20000.
+    - nlist (int): The number of IVF clusters, default is the square root of the number of rows.
+    - nprobe (int): The number of IVF clusters searched per query, default is 8.
+    """
+    if kind not in ("exact", "ivf", "auto"):
+        raise ValueError(f"Unknown row index kind: {kind}")
+    _row_index_config.update(kind=kind, min_rows=min_rows, nlist=nlist, nprobe=nprobe)
+
+
+def build_row_index(embeddings):
+    """
+    Build the configured vector index over the row embeddings of a table.
+
+    Parameters:
+    - embeddings (array-like): The row embeddings, one per row.
+
+    Returns:
+    - ExactIndex or IVFIndex: The index.
+    """
+    kind = _row_index_config["kind"]
+    if kind == "ivf" or (kind == "auto" and len(embeddings) >= _row_index_config["min_rows"]):
+        return IVFIndex(embeddings, nlist=_row_index_config["nlist"], nprobe=_row_index_config["nprobe"])
+    return ExactIndex(embeddings)
+
+
+def evaluate_index(index, exact_index, queries, k):
+    """
+    Compare an index with exact search on a set of queries.
+
+    Parameters:
+    - index: The index to evaluate.
+    - exact_index (ExactIndex): The exact index over the same vectors.
+    - queries (array-like): The query vectors, one per row.
+    - k (int): The number of results per query.
+
+    Returns:
+    - dict: The recall@k of the index and the per-query latency (ms) of both indexes.
+    """
+    def timed_search(searched_index):
+        results, latencies = [], []
+        for query in np.asarray(queries, dtype=np.float32):
+            start = time.perf_counter()
+            results.append(searched_index.search(query[None, :], k)[0])
+            latencies.append((time.perf_counter() - start) * 1000)
+        return results, np.array(latencies)
+
+    approximate_results, approximate_latencies = timed_search(index)
+    exact_results, exact_latencies = timed_search(exact_index)
+
+    recalls = [
+        len(set(approximate.tolist()) & set(exact.tolist())) / max(1, len(exact))
+        for approximate, exact in zip(approximate_results, exact_results)
+    ]
+    return {
+        "k": k,
+        "recall": float(np.mean(recalls)),
+        "latency_ms": {"mean": float(approximate_latencies.mean()), "p50": float(np.percentile(approximate_latencies, 50)), "p95": float(np.percentile(approximate_latencies, 95))},
+        "exact_latency_ms": {"mean": float(exact_latencies.mean()), "p50": float(np.percentile(exact_latencies, 50)), "p95": float(np.percentile(exact_latencies, 95))},
+    }